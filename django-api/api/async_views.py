@@ -0,0 +1,73 @@
+"""
+Async views used when django-api is served over ASGI (see config/asgi.py).
+
+DRF 3.14 function views are synchronous, so under ASGI every request would
+hold a thread for the whole upstream wait. These views run on the event loop
+instead: authentication uses KeycloakJWTAuthentication.aauthenticate() and
+the weather API is called through the async HTTP client, so one worker can
+keep thousands of upstream requests in flight. Responses match the DRF views.
+"""
+from django.http import JsonResponse
+from rest_framework import exceptions
+
+from .authentication import KeycloakJWTAuthentication
+from .metrics import metrics
+from .views import weather_response_data
+from .weather import WeatherUpstreamError, weather_cache
+
+
+def _error(status, data, headers=None):
+    response = JsonResponse(data, status=status)
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+async def _authenticate(request):
+    """
+    Return ``(user, None)`` or ``(None, error_response)``
+    """
+    authenticator = KeycloakJWTAuthentication()
+    challenge = {'WWW-Authenticate': authenticator.authenticate_header(request)}
+    try:
+        result = await authenticator.aauthenticate(request)
+    except exceptions.AuthenticationFailed as e:
+        return None, _error(401, {'detail': str(e.detail)}, challenge)
+    if result is None:
+        return None, _error(401, {'detail': 'Authentication credentials were not provided.'}, challenge)
+    return result[0], None
+
+
+async def _weather_response(request, city):
+    if request.method not in ('GET', 'HEAD'):
+        return _error(405, {'detail': f'Method "{request.method}" not allowed.'}, {'Allow': 'GET, HEAD'})
+
+    user, error = await _authenticate(request)
+    if error is not None:
+        return error
+
+    try:
+        weather_data, cache_state = await weather_cache.aget(city)
+        metrics.inc('weather_cache_requests_total', result=cache_state)
+    except WeatherUpstreamError as e:
+        return _error(503, {'error': 'Failed to fetch weather data', 'detail': str(e)})
+    except Exception as e:
+        return _error(500, {'error': 'Internal server error', 'detail': str(e)})
+
+    response = JsonResponse(weather_response_data(user, city, weather_data))
+    response['X-Cache'] = cache_state.upper()
+    return response
+
+
+async def weather_bangkok(request):
+    """
+    Get weather information for Bangkok (async)
+    """
+    return await _weather_response(request, 'bangkok')
+
+
+async def weather_city(request, city):
+    """
+    Get weather information for any city (async)
+    """
+    return await _weather_response(request, city.lower())
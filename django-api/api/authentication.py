@@ -1,26 +1,85 @@
-import jwt
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib.auth.models import AnonymousUser, User
 from rest_framework import authentication, exceptions
-from jose import jwt as jose_jwt
-from jose.exceptions import JWTError, ExpiredSignatureError, JWTClaimsError
-import json
+
+from .jwks import JWKSError, UnknownKeyError, key_store
+from .jwt_backends import ClaimsError, ExpiredTokenError, TokenError, get_backend
+from .metrics import metrics, timed
+from .shared_cache import get_shared_cache
+from .token_cache import SharedClaims, token_cache
+
+
+# Payloads verified with a key that has since been withdrawn must not outlive it
+key_store.add_rotation_listener(token_cache.clear)
 
 
 class KeycloakUser:
-    """Custom user class for Keycloak JWT token"""
-    def __init__(self, token_payload):
-        self.token_payload = token_payload
-        self.username = token_payload.get('preferred_username', '')
-        self.email = token_payload.get('email', '')
-        self.first_name = token_payload.get('given_name', '')
-        self.last_name = token_payload.get('family_name', '')
-        self.is_authenticated = True
-        self.is_active = True
-        self.is_anonymous = False
-        self.pk = token_payload.get('sub', '')
-        self.id = self.pk
+    """
+    Custom user class for Keycloak JWT token
+
+    Wraps the verified payload without copying it (the same dict is shared
+    with the verified-token cache) and resolves user attributes from it on
+    access. Claims listed in KEYCLOAK_USER_OMIT_CLAIMS (e.g. the large
+    realm/resource access maps) are left out of ``token_payload``; views that
+    need them ask for them with ``get_claim()``.
+
+    A payload from the shared token cache holds only the shared claims;
+    ``load_payload`` then returns the full one, and is called the first time
+    ``token_payload`` or a claim missing from it is read.
+    """
+    __slots__ = ('_payload', '_load_payload')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, token_payload, load_payload=None):
+        self._payload = token_payload
+        self._load_payload = load_payload
+
+    def _full_payload(self):
+        if self._load_payload is not None:
+            self._payload, self._load_payload = self._load_payload(), None
+        return self._payload
+
+    @property
+    def username(self):
+        return self._payload.get('preferred_username', '')
+
+    @property
+    def email(self):
+        return self._payload.get('email', '')
+
+    @property
+    def first_name(self):
+        return self._payload.get('given_name', '')
+
+    @property
+    def last_name(self):
+        return self._payload.get('family_name', '')
+
+    @property
+    def pk(self):
+        return self._payload.get('sub', '')
+
+    id = pk
+
+    @property
+    def token_payload(self):
+        payload = self._full_payload()
+        omitted = getattr(settings, 'KEYCLOAK_USER_OMIT_CLAIMS', ())
+        if not omitted:
+            return payload
+        return {claim: value for claim, value in payload.items() if claim not in omitted}
+
+    def get_claim(self, name, default=None):
+        """
+        Return any claim of the token, including omitted ones
+        """
+        payload = self._payload
+        if name not in payload:
+            payload = self._full_payload()
+        return payload.get(name, default)
 
     def __str__(self):
         return self.username
@@ -31,49 +90,76 @@ class KeycloakJWTAuthentication(authentication.BaseAuthentication):
     JWT authentication using Keycloak public key
     """
     
-    def __init__(self):
-        self.keycloak_public_key = None
-        self.key_cache_timeout = 3600  # Cache for 1 hour
-        self.last_key_fetch = 0
+    # JWT verification backend ('pyjwt' or 'jose'); None uses KEYCLOAK_JWT_BACKEND
+    verification_backend = None
     
-    def get_keycloak_public_key(self):
+    def get_backend(self):
+        return get_backend(self.verification_backend)
+    
+    def get_keycloak_public_key(self, token, backend=None):
+        """
+        Return the Keycloak public key that signed ``token``.
+
+        Keys come from the process-wide JWKS store, so the certs endpoint is
+        only contacted when the key set expires or a new ``kid`` shows up.
+        """
+        if backend is None:
+            backend = self.get_backend()
+        try:
+            kid = backend.get_kid(token)
+        except TokenError as e:
+            raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
+
+        try:
+            return key_store.get_key(kid, backend)
+        except UnknownKeyError as e:
+            raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
+        except JWKSError as e:
+            raise exceptions.AuthenticationFailed(str(e))
+    
+    async def aget_keycloak_public_key(self, token, backend=None):
         """
-        Fetch and cache Keycloak public key
+        Async variant of get_keycloak_public_key()
         """
-        import time
-        current_time = time.time()
+        if backend is None:
+            backend = self.get_backend()
+        try:
+            kid = backend.get_kid(token)
+        except TokenError as e:
+            raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
+
+        try:
+            return await key_store.aget_key(kid, backend)
+        except UnknownKeyError as e:
+            raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
+        except JWKSError as e:
+            raise exceptions.AuthenticationFailed(str(e))
+    
+    def verify_token(self, token):
+        """
+        Verify the token signature and claims and return its payload
+        """
+        backend = self.get_backend()
         
-        # Return cached key if still valid
-        if (self.keycloak_public_key and 
-            current_time - self.last_key_fetch < self.key_cache_timeout):
-            return self.keycloak_public_key
+        # Get the Keycloak public key matching the token's kid
+        public_key = self.get_keycloak_public_key(token, backend)
         
-        try:
-            # Fetch JWKS from Keycloak
-            response = requests.get(settings.KEYCLOAK_CERT_URL, timeout=10)
-            response.raise_for_status()
-            jwks = response.json()
-            
-            # Get the first key (usually there's only one)
-            if 'keys' in jwks and len(jwks['keys']) > 0:
-                key_data = jwks['keys'][0]
-                
-                # Store the JWKS for use with python-jose
-                self.keycloak_public_key = jwks
-                self.last_key_fetch = current_time
-                
-                return self.keycloak_public_key
-            else:
-                raise exceptions.AuthenticationFailed('No keys found in JWKS')
-                
-        except requests.RequestException as e:
-            raise exceptions.AuthenticationFailed(f'Failed to fetch Keycloak public key: {str(e)}')
-        except Exception as e:
-            raise exceptions.AuthenticationFailed(f'Error processing Keycloak public key: {str(e)}')
+        # Decode and verify JWT token using the public key
+        with timed('verify'):
+            return backend.decode(token, public_key)
     
-    def authenticate(self, request):
+    async def averify_token(self, token):
         """
-        Authenticate the request and return a two-tuple of (user, token).
+        Async variant of verify_token(); only the JWKS fetch awaits
+        """
+        backend = self.get_backend()
+        public_key = await self.aget_keycloak_public_key(token, backend)
+        with timed('verify'):
+            return backend.decode(token, public_key)
+    
+    def get_token(self, request):
+        """
+        Return the bearer token from the Authorization header, or None
         """
         auth_header = request.META.get('HTTP_AUTHORIZATION')
         
@@ -88,37 +174,105 @@ class KeycloakJWTAuthentication(authentication.BaseAuthentication):
         except ValueError:
             return None
         
+        return token
+    
+    def authenticate(self, request):
+        """
+        Authenticate the request and return a two-tuple of (user, token).
+        """
+        token = self.get_token(request)
+        if token is None:
+            return None
+        
+        with timed('auth'):
+            return self._authenticate(token)
+    
+    def _authenticate(self, token, shared_only=False):
         try:
-            # Get Keycloak JWKS
-            jwks = self.get_keycloak_public_key()
-            
-            # Decode and verify JWT token using JWKS
-            payload = jose_jwt.decode(
-                token,
-                jwks,  # Pass JWKS directly
-                algorithms=['RS256'],
-                audience=None,  # Skip audience validation for now
-                options={
-                    'verify_aud': False,  # Skip audience verification
-                    'verify_exp': True,   # Verify expiration
-                    'verify_iat': True,   # Verify issued at
-                    'verify_nbf': True,   # Verify not before
-                }
-            )
+            # Repeat requests with the same token skip verification entirely;
+            # shared_only when the caller already missed in this worker's cache
+            payload = token_cache.get_shared(token) if shared_only else token_cache.get(token)
+            if payload is None:
+                payload = self.verify_token(token)
+                token_cache.set(token, payload)
             
             # Create user from token payload
-            user = KeycloakUser(payload)
+            user = self.get_user(token, payload)
             
             return (user, token)
             
-        except ExpiredSignatureError:
-            raise exceptions.AuthenticationFailed('Token has expired')
-        except JWTClaimsError as e:
-            raise exceptions.AuthenticationFailed(f'Invalid token claims: {str(e)}')
-        except JWTError as e:
-            raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
         except Exception as e:
-            raise exceptions.AuthenticationFailed(f'Authentication failed: {str(e)}')
+            raise self.authentication_failed(e)
+    
+    def get_user(self, token, payload):
+        """
+        Return the KeycloakUser for a verified or cached ``payload``
+        """
+        if isinstance(payload, SharedClaims):
+            return KeycloakUser(payload, lambda: self._verify_full(token))
+        return KeycloakUser(payload)
+    
+    def _verify_full(self, token):
+        """
+        Verify ``token`` again for the claims the shared cache left out
+        """
+        try:
+            payload = self.verify_token(token)
+        except Exception as e:
+            raise self.authentication_failed(e)
+        token_cache.set(token, payload, local_only=True)
+        return payload
+    
+    async def aauthenticate(self, request):
+        """
+        Async variant of authenticate() for ASGI views.
+
+        Cached tokens and signature checks are handled on the event loop and
+        the JWKS fetch awaits the async HTTP client. With a shared cache
+        configured, misses fall back to authenticate() in a worker thread,
+        since Django cache backends are blocking.
+        """
+        token = self.get_token(request)
+        if token is None:
+            return None
+        
+        with timed('auth'):
+            return await self._aauthenticate(token)
+    
+    async def _aauthenticate(self, token):
+        payload = token_cache.get(token, local_only=True)
+        if payload is not None:
+            return (self.get_user(token, payload), token)
+        
+        if get_shared_cache() is not None:
+            return await sync_to_async(self._authenticate, thread_sensitive=False)(token, shared_only=True)
+        
+        try:
+            payload = await self.averify_token(token)
+        except Exception as e:
+            raise self.authentication_failed(e)
+        token_cache.set(token, payload)
+        return (KeycloakUser(payload), token)
+    
+    def authentication_failed(self, error):
+        """
+        Map an error raised while verifying a token to AuthenticationFailed
+        (and count it by reason)
+        """
+        if isinstance(error, exceptions.AuthenticationFailed):
+            metrics.inc('auth_failures_total', reason='rejected')
+            return error
+        if isinstance(error, ExpiredTokenError):
+            metrics.inc('auth_failures_total', reason='expired')
+            return exceptions.AuthenticationFailed('Token has expired')
+        if isinstance(error, ClaimsError):
+            metrics.inc('auth_failures_total', reason='claims')
+            return exceptions.AuthenticationFailed(f'Invalid token claims: {str(error)}')
+        if isinstance(error, TokenError):
+            metrics.inc('auth_failures_total', reason='invalid')
+            return exceptions.AuthenticationFailed(f'Invalid token: {str(error)}')
+        metrics.inc('auth_failures_total', reason='error')
+        return exceptions.AuthenticationFailed(f'Authentication failed: {str(error)}')
     
     def authenticate_header(self, request):
         """
@@ -0,0 +1,187 @@
+"""
+Worker warm-up and the liveness/readiness probes.
+
+A fresh worker has an empty JWKS key store, no pooled connections and no
+cached weather, so whichever requests reach it first pay for all of that.
+``warmup.start()`` runs the warm-up steps in a background thread instead: the
+URLconf and the views it imports, the Keycloak key set (which also opens the
+pooled connection to Keycloak) and the cities in WARMUP_WEATHER_CITIES (the
+connection to the weather API). gunicorn.conf.py starts it in every worker
+once it has forked; other servers start it on the first readiness probe.
+Steps that fail are retried every WARMUP_RETRY_INTERVAL seconds.
+
+HealthMiddleware answers the probes before anything else in the stack runs:
+no authentication, sessions, CORS or database, and no entry in /metrics.
+
+- ``/healthz``  liveness: 200 whenever the process can answer
+- ``/readyz``   readiness: 200 once the warm-up ran and the key set is
+  loaded, otherwise 503; lists each step's outcome and duration
+
+The weather prefetch is best effort: a failing weather API does not keep the
+worker out of the load balancer. With WARMUP_ENABLED off nothing is
+prefetched and ``/readyz`` answers like ``/healthz``.
+"""
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import get_resolver
+
+from .jwks import key_store
+from .weather import weather_cache
+
+
+logger = logging.getLogger(__name__)
+
+LIVENESS_PATH = '/healthz'
+READINESS_PATH = '/readyz'
+
+
+def _load_urls():
+    get_resolver().url_patterns
+
+
+def _load_jwks():
+    key_store.refresh()
+
+
+def _load_weather():
+    for city in getattr(settings, 'WARMUP_WEATHER_CITIES', ()):
+        weather_cache.get(city)
+
+
+def _jwks_loaded():
+    return key_store.fingerprint is not None
+
+
+# (name, step, check that its cache is still populated), in the order they run
+STEPS = (
+    ('urls', _load_urls, None),
+    ('jwks', _load_jwks, _jwks_loaded),
+    ('weather', _load_weather, None),
+)
+
+# Steps that have to succeed before the worker reports ready
+REQUIRED = ('urls', 'jwks')
+
+
+class Warmup:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._thread = None
+        self.results = {}   # step name -> {'ok': bool, 'seconds': float[, 'error': str]}
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'WARMUP_ENABLED', True)
+
+    @property
+    def retry_interval(self):
+        return getattr(settings, 'WARMUP_RETRY_INTERVAL', 10)
+
+    def run(self):
+        """
+        Run the steps that have not succeeded yet, in this thread; returns
+        ready()
+        """
+        for name, step, check in STEPS:
+            if self._done(name, check):
+                continue
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.warning('Warm-up step %s failed: %s', name, e)
+                result = {'ok': False, 'error': str(e)}
+            else:
+                result = {'ok': True}
+            result['seconds'] = round(time.perf_counter() - started, 4)
+            self.results[name] = result
+        return self.ready()
+
+    def start(self):
+        """
+        Warm up in a background thread, unless one is running or the worker
+        is ready already
+        """
+        if not self.enabled or self.ready():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run_until_ready, name='warmup', daemon=True)
+            self._thread.start()
+
+    def _run_until_ready(self):
+        started = time.perf_counter()
+        while not self.run():
+            time.sleep(self.retry_interval)
+        logger.info('Worker %s warmed up in %.2fs', os.getpid(), time.perf_counter() - started)
+
+    def ready(self):
+        """
+        Whether every required step ran and its cache is still populated
+        """
+        if not self.enabled:
+            return True
+        return all(self._done(name, check) for name, _, check in STEPS if name in REQUIRED)
+
+    def _done(self, name, check):
+        # A cache warmed earlier can have been cleared since
+        return self.results.get(name, {}).get('ok', False) and (check is None or check())
+
+    def status(self):
+        return {'status': 'ready' if self.ready() else 'warming', 'checks': dict(self.results)}
+
+    def _reset_after_fork(self):
+        # A warm-up thread does not survive into a forked worker
+        self._thread = None
+
+
+warmup = Warmup()
+os.register_at_fork(after_in_child=warmup._reset_after_fork)
+
+
+def _probe(path):
+    if path == LIVENESS_PATH:
+        response = JsonResponse({'status': 'alive'})
+    else:
+        warmup.start()
+        status = warmup.status()
+        response = JsonResponse(status, status=200 if status['status'] == 'ready' else 503)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+class HealthMiddleware:
+    """
+    Answer the liveness and readiness probes; first in MIDDLEWARE
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.path_info in (LIVENESS_PATH, READINESS_PATH):
+            return _probe(request.path_info)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.path_info in (LIVENESS_PATH, READINESS_PATH):
+            return _probe(request.path_info)
+        return await self.get_response(request)
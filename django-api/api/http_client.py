@@ -0,0 +1,255 @@
+"""
+Shared, pooled HTTP client for outbound calls (Keycloak JWKS, weather API).
+
+Module-level ``requests.get`` opens a new TCP (and TLS) connection per call.
+The client below keeps one ``requests.Session`` per process with a
+keep-alive connection pool per host, retries idempotent requests that
+could not connect or got a 502/503/504 with exponential backoff (never after
+a read timeout, so a slow upstream costs one timeout, not one per attempt),
+applies a default timeout, and counts connections created versus requests
+served so pool reuse can be monitored.
+
+Configured with HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_RETRIES,
+HTTP_RETRY_BACKOFF and HTTP_TIMEOUT. ``async_http_client`` is the httpx-based
+equivalent used by the async views in ASGI mode; httpx is only imported
+there, so WSGI workers never load it.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from .metrics import metrics
+
+
+def _timed_pool_classes(record_connection):
+    """
+    urllib3 pool classes whose connections report each new connection and
+    its setup time (TCP connect plus TLS handshake) to ``record_connection``
+    """
+    def timed(connection_class):
+        class TimedConnection(connection_class):
+            def connect(self):
+                started = time.perf_counter()
+                super().connect()
+                record_connection(self.host, time.perf_counter() - started)
+        return TimedConnection
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = timed(HTTPConnection)
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = timed(HTTPSConnection)
+
+    return {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class _PooledAdapter(HTTPAdapter):
+    def __init__(self, record_connection, **kwargs):
+        self._pool_classes = _timed_pool_classes(record_connection)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class _HostStats:
+    __slots__ = ('requests', 'connections', 'connect_time', 'connect_time_max')
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.connect_time = 0.0
+        self.connect_time_max = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'pool_hits': max(self.requests - self.connections, 0),
+            'pool_misses': self.connections,
+            'connect_time_total': self.connect_time,
+            'connect_time_max': self.connect_time_max,
+        }
+
+
+class PooledHTTPClient:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self._stats = defaultdict(_HostStats)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'HTTP_TIMEOUT', 10)
+
+    @property
+    def session(self):
+        session = self._session
+        if session is None:
+            with self._lock:
+                session = self._session
+                if session is None:
+                    session = self._session = self._build_session()
+        return session
+
+    def _build_session(self):
+        retries = Retry(
+            total=getattr(settings, 'HTTP_RETRIES', 2),
+            backoff_factor=getattr(settings, 'HTTP_RETRY_BACKOFF', 0.2),
+            # A read timeout is not retried: the upstream got the request and
+            # is slow, so another attempt would only multiply the wait.
+            read=False,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # idempotent methods only
+            raise_on_status=False,
+        )
+        adapter = _PooledAdapter(
+            self._record_connection,
+            pool_connections=getattr(settings, 'HTTP_POOL_CONNECTIONS', 10),
+            pool_maxsize=getattr(settings, 'HTTP_POOL_MAXSIZE', 10),
+            max_retries=retries,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        Send a request through the shared session. ``timeout`` defaults to
+        HTTP_TIMEOUT; pass it explicitly for calls with their own budget.
+        """
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            self._stats[host].requests += 1
+        if timeout is None:
+            timeout = self.timeout
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _record_connection(self, host, seconds):
+        with self._lock:
+            stats = self._stats[host or '']
+            stats.connections += 1
+            stats.connect_time += seconds
+            stats.connect_time_max = max(stats.connect_time_max, seconds)
+
+    def stats(self):
+        """
+        Per-host request counts, pool hits/misses and connection setup time
+        """
+        with self._lock:
+            return {host: stats.as_dict() for host, stats in self._stats.items()}
+
+    def close(self):
+        """
+        Close pooled connections; the session is rebuilt on next use
+        """
+        with self._lock:
+            session, self._session = self._session, None
+            self._stats.clear()
+        if session is not None:
+            session.close()
+
+    def _reset_after_fork(self):
+        # Sockets inherited from a preloading parent must not be shared.
+        self._lock = threading.Lock()
+        self._session = None
+        self._stats = defaultdict(_HostStats)
+
+
+class AsyncPooledHTTPClient:
+    """
+    ``httpx.AsyncClient`` counterpart of PooledHTTPClient for async (ASGI)
+    views, so a worker can hold thousands of upstream waits on one event
+    loop instead of one per thread. Connection failures are retried
+    (HTTP_RETRIES); pool limits come from HTTP_ASYNC_MAX_CONNECTIONS and
+    HTTP_ASYNC_MAX_KEEPALIVE.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._loop = None
+        self._requests = defaultdict(int)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'HTTP_TIMEOUT', 10)
+
+    def _get_client(self):
+        # An AsyncClient is bound to the loop it was first used on.
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            import httpx
+
+            limits = httpx.Limits(
+                max_connections=getattr(settings, 'HTTP_ASYNC_MAX_CONNECTIONS', 1000),
+                max_keepalive_connections=getattr(settings, 'HTTP_ASYNC_MAX_KEEPALIVE', 100),
+            )
+            transport = httpx.AsyncHTTPTransport(
+                retries=getattr(settings, 'HTTP_RETRIES', 2),
+                limits=limits,
+            )
+            self._client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+            self._loop = loop
+        return self._client
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        self._requests[urlsplit(url).hostname or ''] += 1
+        if timeout is None:
+            timeout = self.timeout
+        return await self._get_client().request(method, url, timeout=timeout, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def stats(self):
+        return {host: {'requests': count} for host, count in self._requests.items()}
+
+    async def aclose(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+http_client = PooledHTTPClient()
+async_http_client = AsyncPooledHTTPClient()
+
+
+def _collect_metrics():
+    stats = http_client.stats()
+    requests_total = [({'client': 'sync', 'host': host}, s['requests']) for host, s in stats.items()]
+    requests_total += [
+        ({'client': 'async', 'host': host}, s['requests']) for host, s in async_http_client.stats().items()
+    ]
+    return [
+        ('http_client_requests_total', 'counter', 'Outbound HTTP requests, by client and host', requests_total),
+        ('http_client_connections_total', 'counter', 'Connections opened by the pooled client (pool misses)',
+         [({'host': host}, s['pool_misses']) for host, s in stats.items()]),
+        ('http_client_connect_seconds_total', 'counter', 'Time the pooled client spent opening connections',
+         [({'host': host}, s['connect_time_total']) for host, s in stats.items()]),
+    ]
+
+
+metrics.add_collector(_collect_metrics)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=http_client._reset_after_fork)
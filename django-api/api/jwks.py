@@ -0,0 +1,457 @@
+"""
+Process-wide Keycloak JWKS key store.
+
+DRF instantiates authenticators for every request, so caching the key set on
+the authenticator instance never survives past a single call. The store below
+lives at module level and is shared by every request handled by the worker.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+
+import requests
+from django.conf import settings
+
+from .http_client import async_http_client, http_client
+from .jwt_backends import get_backend
+from .metrics import metrics, timed
+from .shared_cache import make_key, shared_get, shared_set
+
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class JWKSError(Exception):
+    """Raised when the JWKS endpoint cannot be fetched or has no usable keys."""
+
+
+class UnknownKeyError(JWKSError):
+    """Raised when a token references a ``kid`` that is not in the key set."""
+
+
+def parse_max_age(cache_control):
+    """
+    Return the ``max-age`` directive of a Cache-Control header, or None
+    """
+    if not cache_control:
+        return None
+    match = _MAX_AGE_RE.search(cache_control)
+    if not match:
+        return None
+    return int(match.group(1))
+
+
+class JWKSKeyStore:
+    """
+    Public keys from the Keycloak certs endpoint, indexed by ``kid``.
+
+    The key set is refetched when its TTL expires or when a token references
+    an unknown ``kid`` (key rotation). Forced refreshes for unknown keys are
+    rate limited so a stream of forged ``kid`` values cannot turn every
+    request into a round-trip to Keycloak.
+
+    With KEYCLOAK_JWKS_BACKGROUND_REFRESH enabled, a key set that is about to
+    expire is refreshed by a single background thread while requests keep
+    validating against the current keys. Expired keys stay usable for
+    KEYCLOAK_JWKS_STALE_GRACE seconds if Keycloak cannot be reached, so a
+    short IdP outage does not fail every in-flight request.
+
+    With KEYCLOAK_SHARED_CACHE configured, a key set fetched by one worker is
+    published there and picked up by the other workers until it expires.
+
+    ``aget_key()`` is the async equivalent for ASGI views; its fetches go
+    through the async HTTP client and are coalesced on the event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spawn_lock = threading.Lock()
+        self._refresh_thread = None
+        self._arefresh_task = None
+        self._rotation_listeners = []
+        self.clear()
+
+    def clear(self):
+        """
+        Drop all cached keys so the next lookup fetches the key set again
+        """
+        self._key_data = {}
+        self._keys = {}
+        self._fingerprint = None
+        self._expires_at = 0
+        self._last_fetch = 0
+        self._last_attempt = 0
+        self._last_error = None
+
+    @property
+    def cert_url(self):
+        return settings.KEYCLOAK_CERT_URL
+
+    @property
+    def default_ttl(self):
+        return getattr(settings, 'KEYCLOAK_JWKS_CACHE_TTL', 3600)
+
+    @property
+    def min_ttl(self):
+        return getattr(settings, 'KEYCLOAK_JWKS_MIN_TTL', 60)
+
+    @property
+    def min_refresh_interval(self):
+        return getattr(settings, 'KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL', 30)
+
+    @property
+    def background_refresh(self):
+        return getattr(settings, 'KEYCLOAK_JWKS_BACKGROUND_REFRESH', True)
+
+    @property
+    def refresh_ahead(self):
+        return getattr(settings, 'KEYCLOAK_JWKS_REFRESH_AHEAD', 60)
+
+    @property
+    def stale_grace(self):
+        return getattr(settings, 'KEYCLOAK_JWKS_STALE_GRACE', 300)
+
+    def get_key(self, kid, backend=None):
+        """
+        Return the public key for ``kid``, parsed for the given verification
+        backend (the KEYCLOAK_JWT_BACKEND one by default).
+
+        ``kid`` may be None for tokens without a key id; that only resolves
+        when the key set contains exactly one key.
+        """
+        if backend is None:
+            backend = get_backend()
+        now = time.time()
+        if not self._key_data:
+            # Nothing to serve yet; every caller has to wait for the fetch.
+            self.refresh(now)
+        elif now >= self._expires_at - self.refresh_ahead:
+            self._refresh_expiring(now)
+
+        key = self._lookup(kid, backend)
+        if key is not None:
+            return key
+
+        # Unknown kid: the realm keys may have been rotated since our last
+        # fetch. Refetch, but not more often than min_refresh_interval.
+        if now - self._last_attempt >= self.min_refresh_interval:
+            self.refresh(now, force=True)
+            key = self._lookup(kid, backend)
+            if key is not None:
+                return key
+
+        raise UnknownKeyError(f'No signing key found for kid {kid!r}')
+
+    async def aget_key(self, kid, backend=None):
+        """
+        Async variant of get_key()
+        """
+        if backend is None:
+            backend = get_backend()
+        now = time.time()
+        if not self._key_data:
+            await self.arefresh(now)
+        elif now >= self._expires_at - self.refresh_ahead and not self._keep_current(now):
+            try:
+                await self.arefresh(now)
+            except JWKSError:
+                if now >= self._expires_at + self.stale_grace:
+                    raise
+
+        key = self._lookup(kid, backend)
+        if key is not None:
+            return key
+
+        if now - self._last_attempt >= self.min_refresh_interval:
+            await self.arefresh(now, force=True)
+            key = self._lookup(kid, backend)
+            if key is not None:
+                return key
+
+        raise UnknownKeyError(f'No signing key found for kid {kid!r}')
+
+    def _lookup(self, kid, backend):
+        key_data = self._key_data
+        if kid is None:
+            if len(key_data) != 1:
+                return None
+            kid = next(iter(key_data))
+        data = key_data.get(kid)
+        if data is None:
+            return None
+
+        # Keys are parsed once per key set and backend, not once per token.
+        keys = self._keys
+        cache_key = (backend.name, kid)
+        key = keys.get(cache_key)
+        if key is None:
+            try:
+                key = backend.load_key(data)
+            except Exception as e:
+                raise JWKSError(f'Error processing Keycloak public key {kid!r}: {str(e)}')
+            keys[cache_key] = key
+        return key
+
+    def _refresh_expiring(self, now):
+        if self._keep_current(now):
+            return
+        try:
+            self.refresh(now)
+        except JWKSError:
+            if now >= self._expires_at + self.stale_grace:
+                raise
+
+    def _keep_current(self, now):
+        """
+        True when requests may keep using the current (expiring or stale)
+        keys instead of refreshing in the foreground
+        """
+        stale_deadline = self._expires_at + self.stale_grace
+        if self.background_refresh and now < stale_deadline:
+            self._start_background_refresh(now)
+            return True
+        if now < self._expires_at:
+            return True
+        # After a failed fetch, keep serving stale keys instead of retrying
+        # on every request.
+        return now < stale_deadline and self._backing_off(now)
+
+    def _backing_off(self, now):
+        return (
+            self._last_error is not None
+            and now - self._last_attempt < self.min_refresh_interval
+        )
+
+    def _start_background_refresh(self, now):
+        with self._spawn_lock:
+            thread = self._refresh_thread
+            if thread is not None and thread.is_alive():
+                return
+            if self._backing_off(now):
+                return
+            self._refresh_thread = threading.Thread(
+                target=self._background_refresh,
+                name='jwks-refresh',
+                daemon=True,
+            )
+            self._refresh_thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh(force=True)
+        except JWKSError:
+            # Recorded in _last_error; requests keep using the current keys
+            # until the stale grace window runs out.
+            pass
+
+    def refresh(self, now=None, force=False):
+        """
+        Fetch the key set from Keycloak, unless another thread already did
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            # Another thread fetched while we waited for the lock; share its
+            # outcome instead of hitting Keycloak again.
+            if self._last_attempt > now:
+                self._raise_last_error()
+                return
+            if not force and now < self._expires_at:
+                return
+
+            self._last_attempt = time.time()
+            shared = self._load_shared(force)
+            if shared is not None:
+                key_data, fetched_at, expires_at = shared
+            else:
+                key_data, fetched_at, expires_at = self._fetch()
+
+            rotated = self._install(key_data, fetched_at, expires_at)
+
+        if rotated:
+            self._notify_rotation()
+
+    async def arefresh(self, now=None, force=False):
+        """
+        Async variant of refresh(). Concurrent callers on the same event
+        loop share one request to Keycloak.
+        """
+        if now is None:
+            now = time.time()
+        if self._last_attempt > now:
+            self._raise_last_error()
+            return
+        if not force and now < self._expires_at:
+            return
+
+        loop = asyncio.get_running_loop()
+        task = self._arefresh_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = self._arefresh_task = loop.create_task(self._arefresh(force))
+        # One waiter being cancelled must not cancel the shared fetch.
+        await asyncio.shield(task)
+
+    async def _arefresh(self, force):
+        self._last_attempt = time.time()
+        shared = self._load_shared(force)
+        if shared is not None:
+            key_data, fetched_at, expires_at = shared
+        else:
+            key_data, fetched_at, expires_at = await self._afetch()
+
+        # Not under self._lock: a sync refresh may hold it across a blocking
+        # fetch, and both would install an equally fresh key set anyway.
+        if self._install(key_data, fetched_at, expires_at):
+            self._notify_rotation()
+
+    def _install(self, key_data, fetched_at, expires_at):
+        """
+        Replace the current key set; return True when it was a rotation
+        """
+        rotated = self._is_rotation(key_data)
+        self._key_data = key_data
+        self._keys = {}
+        self._fingerprint = None
+        self._last_fetch = fetched_at
+        self._expires_at = expires_at
+        self._last_error = None
+        return rotated
+
+    def _notify_rotation(self):
+        for listener in list(self._rotation_listeners):
+            listener()
+
+    def _fetch(self):
+        """
+        Fetch the key set from Keycloak and publish it to the shared cache
+        """
+        try:
+            with timed('jwks'):
+                response = http_client.get(self.cert_url, timeout=10)
+            response.raise_for_status()
+            jwks = response.json()
+        except requests.RequestException as e:
+            raise self._failed(f'Failed to fetch Keycloak public key: {str(e)}')
+        except ValueError as e:
+            raise self._failed(f'Invalid JWKS response: {str(e)}')
+        return self._load_response(response, jwks)
+
+    async def _afetch(self):
+        """
+        Async variant of _fetch()
+        """
+        import httpx  # async views only; see config/asgi.py
+
+        try:
+            with timed('jwks'):
+                response = await async_http_client.get(self.cert_url, timeout=10)
+            response.raise_for_status()
+            jwks = response.json()
+        except httpx.HTTPError as e:
+            raise self._failed(f'Failed to fetch Keycloak public key: {str(e)}')
+        except ValueError as e:
+            raise self._failed(f'Invalid JWKS response: {str(e)}')
+        return self._load_response(response, jwks)
+
+    def _failed(self, message):
+        metrics.inc('upstream_errors_total', upstream='jwks')
+        self._last_error = JWKSError(message)
+        return self._last_error
+
+    def _load_response(self, response, jwks):
+        """
+        Return (key_data, fetched_at, expires_at) for a fetched JWKS
+        document and publish it to the shared cache
+        """
+        key_data = self._parse_keys(jwks)
+        if not key_data:
+            raise self._failed('No keys found in JWKS')
+
+        fetched_at = time.time()
+        expires_at = fetched_at + self._ttl_for(response)
+        shared_set(
+            make_key('jwks'),
+            {'keys': key_data, 'fetched_at': fetched_at, 'expires_at': expires_at},
+            expires_at - fetched_at,
+        )
+        return key_data, fetched_at, expires_at
+
+    def _load_shared(self, force):
+        """
+        Return (key_data, fetched_at, expires_at) from the shared cache when
+        another worker already holds a usable key set there
+        """
+        document = shared_get(make_key('jwks'))
+        if not document or not document.get('keys'):
+            return None
+        if document['expires_at'] <= time.time():
+            return None
+        # A forced refresh is looking for keys we do not have yet; only a
+        # key set newer than ours can contain them.
+        if force and document['fetched_at'] <= self._last_fetch:
+            return None
+        return document['keys'], document['fetched_at'], document['expires_at']
+
+    @property
+    def fingerprint(self):
+        """
+        Short digest identifying the current key set. Identical in every
+        worker holding the same keys, so it can namespace shared entries.
+        None until a key set has been loaded.
+        """
+        fingerprint = self._fingerprint
+        if fingerprint is None and self._key_data:
+            material = sorted(
+                (str(kid), data.get('n', ''), data.get('e', ''))
+                for kid, data in self._key_data.items()
+            )
+            fingerprint = hashlib.sha256(repr(material).encode('utf-8')).hexdigest()[:16]
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    def _is_rotation(self, key_data):
+        """
+        True when a previously published key was withdrawn or replaced.
+        Newly added keys do not invalidate anything signed with the old ones.
+        """
+        return any(
+            key_data.get(kid) != data for kid, data in self._key_data.items()
+        )
+
+    def add_rotation_listener(self, callback):
+        """
+        Call ``callback()`` whenever the refreshed key set withdraws or
+        replaces a key, so caches derived from the old keys can be dropped.
+        """
+        self._rotation_listeners.append(callback)
+
+    def _raise_last_error(self):
+        if self._last_error is not None:
+            raise self._last_error
+
+    def _parse_keys(self, jwks):
+        key_data = {}
+        for data in jwks.get('keys', []):
+            # Keycloak also publishes encryption keys; only signing keys matter.
+            if data.get('use', 'sig') != 'sig':
+                continue
+            if data.get('alg', 'RS256') != 'RS256' or data.get('kty') != 'RSA':
+                continue
+            key_data[data.get('kid')] = data
+        return key_data
+
+    def _ttl_for(self, response):
+        """
+        Cache lifetime for a JWKS response: its Cache-Control ``max-age``
+        clamped to [KEYCLOAK_JWKS_MIN_TTL, KEYCLOAK_JWKS_CACHE_TTL], or the
+        configured TTL when the header carries no max-age.
+        """
+        max_age = parse_max_age(response.headers.get('Cache-Control'))
+        if max_age is None:
+            return self.default_ttl
+        return max(self.min_ttl, min(max_age, self.default_ttl))
+
+
+key_store = JWKSKeyStore()
@@ -0,0 +1,128 @@
+"""
+JWT verification backends for KeycloakJWTAuthentication.
+
+The backend is selected with the KEYCLOAK_JWT_BACKEND setting:
+
+- ``pyjwt`` (default) verifies with PyJWT against ``cryptography`` public key
+  objects that are built once per key set and kept in the key store.
+- ``jose`` verifies with python-jose, kept for compatibility with the
+  original implementation. python-jose is only imported when this backend
+  is first used.
+
+Both backends raise the exceptions below so the authenticator does not need
+to know which library did the work.
+"""
+import jwt
+from django.conf import settings
+
+
+class TokenError(Exception):
+    """The token is malformed or its signature does not verify."""
+
+
+class ExpiredTokenError(TokenError):
+    """The token's ``exp`` claim is in the past."""
+
+
+class ClaimsError(TokenError):
+    """A registered claim (``iat``, ``nbf``, ...) failed validation."""
+
+
+class PyJWTBackend:
+    name = 'pyjwt'
+
+    def get_kid(self, token):
+        try:
+            return jwt.get_unverified_header(token).get('kid')
+        except jwt.InvalidTokenError as e:
+            raise TokenError(str(e))
+
+    def load_key(self, key_data):
+        # PyJWK parses the JWK into a cryptography RSAPublicKey once, so
+        # decode() does not redo the JWK -> RSA conversion per token.
+        return jwt.PyJWK(key_data, algorithm=key_data.get('alg', 'RS256'))
+
+    def decode(self, token, key):
+        try:
+            return jwt.decode(
+                token,
+                key.key,
+                algorithms=['RS256'],
+                options={
+                    'verify_aud': False,  # Skip audience verification
+                    'verify_exp': True,
+                    'verify_iat': True,
+                    'verify_nbf': True,
+                },
+            )
+        except jwt.ExpiredSignatureError:
+            raise ExpiredTokenError('Token has expired')
+        except (jwt.ImmatureSignatureError, jwt.InvalidIssuedAtError, jwt.MissingRequiredClaimError) as e:
+            raise ClaimsError(str(e))
+        except jwt.InvalidTokenError as e:
+            raise TokenError(str(e))
+
+
+class JoseBackend:
+    name = 'jose'
+
+    def __init__(self):
+        from jose import exceptions, jwk, jwt as jose_jwt
+        self.jwt = jose_jwt
+        self.jwk = jwk
+        self.errors = exceptions
+
+    def get_kid(self, token):
+        try:
+            return self.jwt.get_unverified_header(token).get('kid')
+        except self.errors.JWTError as e:
+            raise TokenError(str(e))
+
+    def load_key(self, key_data):
+        return self.jwk.construct(key_data, key_data.get('alg', 'RS256'))
+
+    def decode(self, token, key):
+        try:
+            return self.jwt.decode(
+                token,
+                key,
+                algorithms=['RS256'],
+                audience=None,  # Skip audience validation for now
+                options={
+                    'verify_aud': False,  # Skip audience verification
+                    'verify_exp': True,   # Verify expiration
+                    'verify_iat': True,   # Verify issued at
+                    'verify_nbf': True,   # Verify not before
+                }
+            )
+        except self.errors.ExpiredSignatureError:
+            raise ExpiredTokenError('Token has expired')
+        except self.errors.JWTClaimsError as e:
+            raise ClaimsError(str(e))
+        except self.errors.JWTError as e:
+            raise TokenError(str(e))
+
+
+BACKENDS = {
+    PyJWTBackend.name: PyJWTBackend,
+    JoseBackend.name: JoseBackend,
+}
+
+_instances = {}
+
+
+def get_backend(name=None):
+    """
+    Return the (shared) backend instance named by ``name`` or by the
+    KEYCLOAK_JWT_BACKEND setting
+    """
+    if name is None:
+        name = getattr(settings, 'KEYCLOAK_JWT_BACKEND', 'pyjwt')
+    backend = _instances.get(name)
+    if backend is None:
+        try:
+            backend_class = BACKENDS[name]
+        except KeyError:
+            raise ValueError(f'Unknown KEYCLOAK_JWT_BACKEND {name!r}; expected one of {sorted(BACKENDS)}')
+        backend = _instances[name] = backend_class()
+    return backend
@@ -0,0 +1,243 @@
+"""
+In-process request metrics: per-phase timings, Server-Timing and /metrics.
+
+Code on the request path wraps its expensive steps in ``timed(phase)``
+(JWT authentication, JWKS fetch, signature check, weather upstream call).
+Each duration goes into a latency histogram for the phase and, while a
+request is being handled, into that request's timings, which
+MetricsMiddleware returns in a ``Server-Timing`` header together with the
+time spent in the middleware before the view (``mw``) and in total. The
+request's own latency is recorded per view, and counters are kept for
+cache results, upstream errors and authentication failures.
+
+``metrics_view`` serves everything in the Prometheus text format, plus the
+counters of components that keep their own (HTTP client pool, verified-token
+cache) through collectors registered with ``metrics.add_collector``. Numbers
+are per worker process: with several gunicorn workers each scrape reports
+the worker that answered it.
+
+METRICS_ENABLED turns the middleware and endpoint off; SERVER_TIMING only
+the response header.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help) of every metric recorded with inc()/observe()
+METRICS = {
+    'http_requests_total': ('counter', 'Requests answered, by view, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Request latency inside Django, by view'),
+    'phase_duration_seconds': ('histogram', 'Time spent in instrumented phases of request handling'),
+    'auth_failures_total': ('counter', 'Rejected bearer tokens, by reason'),
+    'upstream_errors_total': ('counter', 'Failed calls to Keycloak and the weather API'),
+    'weather_cache_requests_total': ('counter', 'Weather lookups by cache result (hit, miss, stale)'),
+}
+
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+# Phase durations of the request being handled (None outside requests)
+_timings = ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)       # (name, labels) -> value
+        self._histograms = defaultdict(Histogram)  # (name, labels) -> Histogram
+        self._collectors = []
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._histograms[key].observe(seconds)
+
+    def add_collector(self, collector):
+        """
+        Register ``collector()``, called on every scrape, returning
+        ``(name, type, help, [(labels dict, value), ...])`` tuples
+        """
+        self._collectors.append(collector)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """
+        Everything recorded, in the Prometheus text exposition format
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(h.counts), h.sum) for key, h in self._histograms.items())
+
+        families = defaultdict(list)
+        for (name, labels), value in counters:
+            families[name].append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for (name, labels), counts, total in histograms:
+            lines = families[name]
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total!r}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+        output = []
+        for name, lines in families.items():
+            kind, help_text = METRICS.get(name, ('untyped', name))
+            output += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', *lines]
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                output += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                output += [
+                    f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}'
+                    for labels, value in samples
+                ]
+        return '\n'.join(output) + '\n'
+
+
+metrics = Registry()
+
+
+def record(phase, seconds):
+    """
+    Add ``seconds`` to the histogram of ``phase`` and to the current
+    request's Server-Timing
+    """
+    metrics.observe('phase_duration_seconds', seconds, phase=phase)
+    timings = _timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def server_timing(timings):
+    return ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in timings.items())
+
+
+class MetricsMiddleware:
+    """
+    Time every request and attach its phase timings as Server-Timing.
+
+    Placed first in MIDDLEWARE (after the health probes) so ``total`` covers
+    the whole chain; ``mw`` is the time from entering it to the view being
+    called. Works under WSGI and ASGI without a thread hop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            self.process_view = self._aprocess_view
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = {}
+        token = _timings.set(timings)
+        request._metrics_started = started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings = {}
+        token = _timings.set(timings)
+        request._metrics_started = started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.view_started(request)
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.view_started(request)
+
+    @staticmethod
+    def view_started(request):
+        timings = _timings.get()
+        if timings is not None:
+            timings['mw'] = time.perf_counter() - request._metrics_started
+
+    def finish(self, request, response, timings, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        method = request.method if request.method in METHODS else 'other'
+        metrics.observe('http_request_duration_seconds', elapsed, view=view)
+        metrics.inc('http_requests_total', view=view, method=method, status=response.status_code)
+        if getattr(settings, 'SERVER_TIMING', True):
+            timings['total'] = elapsed
+            response['Server-Timing'] = server_timing(timings)
+        return response
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint; unauthenticated, like the health check
+    """
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
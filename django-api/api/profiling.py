@@ -0,0 +1,300 @@
+"""
+On-demand profiling of a sample of requests.
+
+ProfilingMiddleware profiles a request when it is picked by
+PROFILE_SAMPLE_RATE (fraction of requests, 0 = none) or, with PROFILE_HEADER
+enabled, when it carries an ``X-Profile`` header signed with PROFILE_SECRET
+(``profile_header_value()`` makes one, valid for PROFILE_HEADER_MAX_AGE
+seconds). PROFILE_SECRET has to be a dedicated key of at least 32 characters:
+SECRET_KEY and the development keys in this repository are public, and a
+forged header would let anyone make the server profile requests. Without one
+the header is ignored. With both off the middleware removes itself from the chain;
+otherwise an unsampled request costs one random number and a dict lookup.
+
+PROFILER picks the profiler:
+
+- ``cprofile``  deterministic; per-endpoint ``.pstats`` files (``python -m
+  pstats``, snakeviz)
+- ``stack``     a thread sampling the request's stack every
+  PROFILE_STACK_INTERVAL seconds; per-endpoint ``.collapsed`` files
+  (flamegraph.pl, speedscope), far lower overhead
+
+Profiles are aggregated per endpoint (view name) in memory and written to
+PROFILE_DIR/<endpoint>/ every PROFILE_FLUSH_INTERVAL seconds and at exit,
+keeping the newest PROFILE_KEEP files per endpoint. One request per process
+is profiled at a time; others are served unprofiled meanwhile. Under ASGI the
+profile covers the event loop thread, so coroutines of other requests
+running at the same time show up in it too.
+"""
+import atexit
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_X_PROFILE'
+SALT = 'api.profiling'
+
+# Development keys checked into this repository; never fit to sign headers
+PUBLIC_SECRETS = frozenset({'django-insecure-your-secret-key-here', 'dev-secret'})
+MIN_SECRET_LENGTH = 32
+
+
+def profile_secret():
+    """
+    PROFILE_SECRET, or None when it is missing or not a dedicated secret
+    """
+    secret = getattr(settings, 'PROFILE_SECRET', '')
+    if (
+        not secret or len(secret) < MIN_SECRET_LENGTH
+        or secret in PUBLIC_SECRETS or secret == settings.SECRET_KEY
+    ):
+        return None
+    return secret
+
+
+def _signer():
+    return signing.TimestampSigner(key=profile_secret(), salt=SALT)
+
+
+def profile_header_value():
+    """
+    A value for the ``X-Profile`` request header
+    """
+    if profile_secret() is None:
+        raise ImproperlyConfigured('Set PROFILE_SECRET to a dedicated key of at least 32 characters')
+    return _signer().sign('profile')
+
+
+def collapse(frame):
+    """
+    ``frame``'s stack in collapsed format: outermost first, ``;``-separated
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """Counts the stacks of one thread until stopped"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+class _Endpoint:
+    __slots__ = ('stats', 'stacks', 'requests', 'since')
+
+    def __init__(self):
+        self.stats = None
+        self.stacks = Counter()
+        self.requests = 0
+        self.since = time.time()
+
+
+class RequestProfiler:
+    def __init__(self):
+        self._active = threading.Lock()   # held while a request is profiled
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    @property
+    def sample_rate(self):
+        return getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+
+    @property
+    def header_enabled(self):
+        return getattr(settings, 'PROFILE_HEADER', False) and profile_secret() is not None
+
+    @property
+    def mode(self):
+        return getattr(settings, 'PROFILER', 'cprofile')
+
+    @property
+    def directory(self):
+        return str(getattr(settings, 'PROFILE_DIR', 'profiles'))
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'PROFILE_FLUSH_INTERVAL', 60)
+
+    @property
+    def keep(self):
+        return getattr(settings, 'PROFILE_KEEP', 20)
+
+    def wanted(self, request):
+        """
+        Whether ``request`` is picked by the sample rate or a valid header
+        """
+        rate = self.sample_rate
+        if rate and random.random() < rate:
+            return True
+        value = request.META.get(HEADER)
+        if value is None or not self.header_enabled:
+            return False
+        try:
+            _signer().unsign(
+                value, max_age=getattr(settings, 'PROFILE_HEADER_MAX_AGE', 3600),
+            )
+        except signing.BadSignature:
+            return False
+        return True
+
+    def start(self):
+        """
+        Start profiling the current thread; None when another request is
+        being profiled
+        """
+        if not self._active.acquire(blocking=False):
+            return None
+        try:
+            if self.mode == 'stack':
+                session = StackSampler(threading.get_ident(), getattr(settings, 'PROFILE_STACK_INTERVAL', 0.005))
+                session.start()
+            else:
+                session = cProfile.Profile()
+                session.enable()
+        except BaseException:
+            self._active.release()
+            raise
+        return session
+
+    def stop(self, session, endpoint):
+        """
+        Stop ``session`` and add it to the profile of ``endpoint``
+        """
+        try:
+            if isinstance(session, StackSampler):
+                stacks, stats = session.stop(), None
+            else:
+                session.disable()
+                stacks, stats = None, pstats.Stats(session)
+        finally:
+            self._active.release()
+
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            if entry is None:
+                entry = self._endpoints[endpoint] = _Endpoint()
+            entry.requests += 1
+            if stacks is not None:
+                entry.stacks.update(stacks)
+            elif entry.stats is None:
+                entry.stats = stats
+            else:
+                entry.stats.add(stats)
+            due = time.time() - entry.since >= self.flush_interval
+        if due:
+            self.flush(endpoint)
+
+    def flush(self, endpoint=None):
+        """
+        Write the aggregated profiles (of ``endpoint``, or all) to PROFILE_DIR
+        """
+        with self._lock:
+            names = [endpoint] if endpoint is not None else list(self._endpoints)
+            entries = [(name, self._endpoints.pop(name)) for name in names if name in self._endpoints]
+        for name, entry in entries:
+            self._write(name, entry)
+
+    def _write(self, endpoint, entry):
+        directory = os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]', '_', endpoint))
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f'{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}-{entry.requests}req')
+        if entry.stats is not None:
+            entry.stats.dump_stats(base + '.pstats')
+        if entry.stacks:
+            with open(base + '.collapsed', 'w') as f:
+                for stack, count in entry.stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+        self._rotate(directory)
+
+    def _rotate(self, directory):
+        # Names start with the time they were written
+        for name in sorted(os.listdir(directory))[:-self.keep] if self.keep else []:
+            os.remove(os.path.join(directory, name))
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+profiler = RequestProfiler()
+atexit.register(profiler.flush)
+
+
+def _endpoint(request):
+    match = request.resolver_match
+    return match.view_name if match is not None else 'unmatched'
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if getattr(settings, 'PROFILE_HEADER', False) and not profiler.header_enabled:
+            logger.warning('PROFILE_HEADER ignored: PROFILE_SECRET is unset, too short or not a dedicated key')
+        if not profiler.sample_rate and not profiler.header_enabled:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        session = profiler.start() if profiler.wanted(request) else None
+        if session is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop(session, _endpoint(request))
+        response['X-Profiled'] = profiler.mode
+        return response
+
+    async def __acall__(self, request):
+        session = profiler.start() if profiler.wanted(request) else None
+        if session is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.stop(session, _endpoint(request))
+        response['X-Profiled'] = profiler.mode
+        return response
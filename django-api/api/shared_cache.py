@@ -0,0 +1,53 @@
+"""
+Optional cross-worker cache for the JWKS document and verified tokens.
+
+Each gunicorn worker keeps its own in-process key store and token cache. When
+KEYCLOAK_SHARED_CACHE names an alias from ``CACHES`` (file-based, Memcached,
+Redis, ...), those per-worker caches act as an L1 in front of that shared
+cache so a key set fetched or a token verified by one worker is reused by the
+others. Shared cache failures are treated as misses: the worker falls back to
+fetching and verifying on its own.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_shared_cache():
+    """
+    Return the configured shared cache, or None when sharing is disabled
+    """
+    alias = getattr(settings, 'KEYCLOAK_SHARED_CACHE', None)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def make_key(*parts):
+    prefix = getattr(settings, 'KEYCLOAK_SHARED_CACHE_PREFIX', 'keycloak')
+    return ':'.join((prefix,) + parts)
+
+
+def shared_get(key):
+    cache = get_shared_cache()
+    if cache is None:
+        return None
+    try:
+        return cache.get(key)
+    except Exception:
+        logger.warning('Shared cache read failed for %s', key, exc_info=True)
+        return None
+
+
+def shared_set(key, value, timeout):
+    cache = get_shared_cache()
+    if cache is None or timeout <= 0:
+        return
+    try:
+        cache.set(key, value, timeout)
+    except Exception:
+        logger.warning('Shared cache write failed for %s', key, exc_info=True)
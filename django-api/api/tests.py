@@ -1,3 +1,1131 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
\ No newline at end of file
+import jwt
+import requests
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.test import AsyncRequestFactory, SimpleTestCase, override_settings
+from jose import jwk as jose_jwk
+from jose import jwt as jose_jwt
+from rest_framework import exceptions
+from rest_framework.test import APIRequestFactory
+
+from . import async_views
+from .authentication import KeycloakJWTAuthentication, KeycloakUser
+from .health import warmup
+from .http_client import PooledHTTPClient, async_http_client
+from .jwks import JWKSError, JWKSKeyStore, UnknownKeyError, key_store, parse_max_age
+from .jwt_backends import PyJWTBackend, get_backend
+from .metrics import metrics
+from .profiling import SALT, ProfilingMiddleware, StackSampler, profile_header_value, profiler
+from .token_cache import VerifiedTokenCache, token_cache
+from .weather import WeatherCache, WeatherUpstreamError, weather_cache
+
+
+def make_signing_key(kid):
+    """Generate an RSA key pair and return (private PEM, public JWK dict)"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    public_jwk = jose_jwk.construct(public_pem, 'RS256').to_dict()
+    public_jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+    return private_pem, public_jwk
+
+
+def mint_token(private_pem, kid, **claims):
+    now = int(time.time())
+    payload = {
+        'sub': 'user-1',
+        'preferred_username': 'alice',
+        'email': 'alice@example.com',
+        'iat': now,
+        'exp': now + 300,
+    }
+    payload.update(claims)
+    return jose_jwt.encode(payload, private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+def jwks_response(*jwks, cache_control=None):
+    response = mock.Mock()
+    response.json.return_value = {'keys': list(jwks)}
+    response.headers = {'Cache-Control': cache_control} if cache_control else {}
+    response.raise_for_status.return_value = None
+    return response
+
+
+class JWKSKeyStoreTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_a, cls.jwk_a = make_signing_key('key-a')
+        cls.private_b, cls.jwk_b = make_signing_key('key-b')
+
+    def setUp(self):
+        self.store = JWKSKeyStore()
+        self.jose = get_backend('jose')
+
+    def test_parse_max_age(self):
+        self.assertEqual(parse_max_age('public, max-age=300'), 300)
+        self.assertIsNone(parse_max_age('no-cache'))
+        self.assertIsNone(parse_max_age(None))
+
+    def test_keys_are_fetched_once_and_indexed_by_kid(self):
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.jwk_a, self.jwk_b)) as get:
+            key_a = self.store.get_key('key-a', self.jose)
+            key_b = self.store.get_key('key-b', self.jose)
+            self.store.get_key('key-a')
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(key_a.to_dict()['n'], self.jwk_a['n'])
+        self.assertEqual(key_b.to_dict()['n'], self.jwk_b['n'])
+
+    @override_settings(KEYCLOAK_JWKS_CACHE_TTL=3600, KEYCLOAK_JWKS_MIN_TTL=60)
+    def test_cache_control_max_age_is_clamped(self):
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.jwk_a, cache_control='max-age=5')):
+            self.store.get_key('key-a')
+        self.assertAlmostEqual(self.store._expires_at - self.store._last_fetch, 60)
+
+        self.store.clear()
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.jwk_a, cache_control='max-age=600')):
+            self.store.get_key('key-a')
+        self.assertAlmostEqual(self.store._expires_at - self.store._last_fetch, 600)
+
+    @override_settings(KEYCLOAK_JWKS_BACKGROUND_REFRESH=False)
+    def test_expired_key_set_is_refetched(self):
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.jwk_a)) as get:
+            self.store.get_key('key-a')
+            self.store._expires_at = time.time() - 1
+            self.store.get_key('key-a')
+        self.assertEqual(get.call_count, 2)
+
+    @override_settings(KEYCLOAK_JWKS_BACKGROUND_REFRESH=True, KEYCLOAK_JWKS_REFRESH_AHEAD=60)
+    def test_expiring_key_set_is_refreshed_in_background(self):
+        release = threading.Event()
+        fetched = []
+
+        def slow_get(url, timeout):
+            if fetched:
+                release.wait(5)
+            fetched.append(url)
+            return jwks_response(self.jwk_a)
+
+        with mock.patch('api.jwks.http_client.get', side_effect=slow_get):
+            self.store.get_key('key-a')
+            self.store._expires_at = time.time() + 10
+            # The refresh is still blocked, yet lookups keep being served
+            # and no second refresh is started.
+            for _ in range(5):
+                self.assertIsNotNone(self.store.get_key('key-a'))
+            release.set()
+            self.store._refresh_thread.join(5)
+        self.assertEqual(len(fetched), 2)
+        self.assertGreater(self.store._expires_at, time.time() + 60)
+
+    @override_settings(KEYCLOAK_JWKS_BACKGROUND_REFRESH=False, KEYCLOAK_JWKS_STALE_GRACE=300)
+    def test_stale_keys_are_served_while_keycloak_is_down(self):
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.jwk_a)):
+            self.store.get_key('key-a')
+
+        outage = requests.ConnectionError('connection refused')
+        with mock.patch('api.jwks.http_client.get', side_effect=outage) as get:
+            self.store._expires_at = time.time() - 10
+            for _ in range(3):
+                self.assertIsNotNone(self.store.get_key('key-a'))
+            # Failed refreshes back off instead of retrying per request.
+            self.assertEqual(get.call_count, 1)
+
+            self.store._expires_at = time.time() - 301
+            self.store._last_attempt -= 60
+            with self.assertRaises(JWKSError):
+                self.store.get_key('key-a')
+
+    def test_unknown_kid_forces_refresh(self):
+        responses = [jwks_response(self.jwk_a), jwks_response(self.jwk_a, self.jwk_b)]
+        with mock.patch('api.jwks.http_client.get', side_effect=responses) as get:
+            self.store.get_key('key-a')
+            self.store._last_attempt -= 60
+            key_b = self.store.get_key('key-b', self.jose)
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(key_b.to_dict()['n'], self.jwk_b['n'])
+
+    @override_settings(KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL=30)
+    def test_forced_refresh_is_rate_limited(self):
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.jwk_a)) as get:
+            self.store.get_key('key-a')
+            for _ in range(5):
+                with self.assertRaises(UnknownKeyError):
+                    self.store.get_key('forged')
+        self.assertEqual(get.call_count, 1)
+
+
+class KeycloakJWTAuthenticationTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_pem, cls.public_jwk = make_signing_key('key-a')
+
+    def setUp(self):
+        key_store.clear()
+        token_cache.clear()
+        self.addCleanup(key_store.clear)
+        self.addCleanup(token_cache.clear)
+        self.factory = APIRequestFactory()
+
+    def authenticate(self, token):
+        request = self.factory.get('/api/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return KeycloakJWTAuthentication().authenticate(request)
+
+    def test_valid_token(self):
+        token = mint_token(self.private_pem, 'key-a')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            user, raw = self.authenticate(token)
+        self.assertEqual(raw, token)
+        self.assertEqual(user.username, 'alice')
+        self.assertEqual(user.pk, 'user-1')
+
+    def test_both_backends_verify_tokens(self):
+        valid = mint_token(self.private_pem, 'key-a')
+        expired = mint_token(self.private_pem, 'key-a', exp=int(time.time()) - 60)
+        tampered = valid[:-4] + ('AAAA' if not valid.endswith('AAAA') else 'BBBB')
+        for backend in ('pyjwt', 'jose'):
+            with self.subTest(backend=backend), override_settings(KEYCLOAK_JWT_BACKEND=backend):
+                token_cache.clear()
+                with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+                    user, _ = self.authenticate(valid)
+                    self.assertEqual(user.username, 'alice')
+                    with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Token has expired'):
+                        self.authenticate(expired)
+                    with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Invalid token'):
+                        self.authenticate(tampered)
+
+    def test_pyjwt_keys_are_parsed_once_per_key_set(self):
+        token = mint_token(self.private_pem, 'key-a')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            with mock.patch.object(PyJWTBackend, 'load_key', autospec=True, side_effect=PyJWTBackend.load_key) as load_key:
+                for _ in range(3):
+                    token_cache.clear()
+                    self.authenticate(token)
+        self.assertEqual(load_key.call_count, 1)
+
+    def test_key_set_is_shared_between_authenticator_instances(self):
+        token = mint_token(self.private_pem, 'key-a')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)) as get:
+            for _ in range(3):
+                self.authenticate(token)
+        self.assertEqual(get.call_count, 1)
+
+    def test_expired_token(self):
+        token = mint_token(self.private_pem, 'key-a', exp=int(time.time()) - 60)
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Token has expired'):
+                self.authenticate(token)
+
+    def test_token_signed_with_unknown_key(self):
+        other_pem, _ = make_signing_key('key-x')
+        token = mint_token(other_pem, 'key-x')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                self.authenticate(token)
+
+    def test_repeat_requests_skip_verification(self):
+        token = mint_token(self.private_pem, 'key-a')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            with mock.patch('api.jwt_backends.jwt.decode', wraps=jwt.decode) as decode:
+                for _ in range(3):
+                    user, _ = self.authenticate(token)
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(user.username, 'alice')
+
+    def test_key_rotation_invalidates_cached_tokens(self):
+        token = mint_token(self.private_pem, 'key-a')
+        _, rotated_jwk = make_signing_key('key-b')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            self.authenticate(token)
+        self.assertEqual(token_cache.stats()['entries'], 1)
+
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(rotated_jwk)):
+            key_store.refresh(force=True)
+        self.assertEqual(token_cache.stats()['entries'], 0)
+
+    def test_missing_header(self):
+        request = self.factory.get('/api/profile/')
+        self.assertIsNone(KeycloakJWTAuthentication().authenticate(request))
+
+
+class VerifiedTokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = VerifiedTokenCache()
+
+    def test_hit_and_miss(self):
+        payload = {'sub': 'user-1', 'exp': time.time() + 300}
+        self.assertIsNone(self.cache.get('token-1'))
+        self.cache.set('token-1', payload)
+        self.assertIs(self.cache.get('token-1'), payload)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_raw_token_is_not_kept(self):
+        self.cache.set('secret-token', {'exp': time.time() + 300})
+        self.assertNotIn('secret-token', self.cache._entries)
+
+    @override_settings(KEYCLOAK_TOKEN_CACHE_LEEWAY=30)
+    def test_entries_expire_before_the_token(self):
+        self.cache.set('token-1', {'exp': time.time() + 20})
+        self.assertIsNone(self.cache.get('token-1'))
+
+        self.cache.set('token-2', {'exp': time.time() + 300})
+        self.cache._entries[self.cache.digest('token-2')] = (
+            {'exp': 0}, time.time() - 1, len('token-2') + 256,
+        )
+        self.assertIsNone(self.cache.get('token-2'))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    @override_settings(KEYCLOAK_TOKEN_CACHE_MAX_AGE=60)
+    def test_max_age_bounds_cache_lifetime(self):
+        self.cache.set('token-1', {'exp': time.time() + 3600})
+        _, expires_at, _ = self.cache._entries[self.cache.digest('token-1')]
+        self.assertLessEqual(expires_at, time.time() + 60)
+
+    @override_settings(KEYCLOAK_TOKEN_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entry_is_evicted(self):
+        exp = time.time() + 300
+        self.cache.set('token-1', {'exp': exp})
+        self.cache.set('token-2', {'exp': exp})
+        self.cache.get('token-1')
+        self.cache.set('token-3', {'exp': exp})
+        self.assertIsNotNone(self.cache.get('token-1'))
+        self.assertIsNone(self.cache.get('token-2'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    @override_settings(KEYCLOAK_TOKEN_CACHE_MAX_BYTES=1000)
+    def test_memory_cap(self):
+        exp = time.time() + 300
+        for i in range(10):
+            self.cache.set(f'token-{i}' + 'x' * 200, {'exp': exp})
+        stats = self.cache.stats()
+        self.assertLessEqual(stats['bytes'], 1000)
+        self.assertGreater(stats['evictions'], 0)
+
+    @override_settings(KEYCLOAK_TOKEN_CACHE_MAX_BYTES=4000)
+    def test_memory_cap_counts_the_payload(self):
+        exp = time.time() + 300
+        roles = {'realm_access': {'roles': ['role-%d' % i for i in range(100)]}}
+        self.cache.set('token-1', {'exp': exp, **roles})
+        size = self.cache.stats()['bytes']
+        self.assertGreater(size, len(json.dumps(roles)))
+        # Small tokens with large payloads still hit the cap.
+        for i in range(2, 6):
+            self.cache.set(f'token-{i}', {'exp': exp, **roles})
+        stats = self.cache.stats()
+        self.assertLessEqual(stats['bytes'], 4000)
+        self.assertEqual(stats['entries'], 4000 // size)
+
+    @override_settings(KEYCLOAK_TOKEN_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self.cache.set('token-1', {'exp': time.time() + 300})
+        self.assertIsNone(self.cache.get('token-1'))
+
+
+SHARED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'keycloak': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'keycloak-tests'},
+}
+
+
+@override_settings(CACHES=SHARED_CACHES, KEYCLOAK_SHARED_CACHE='keycloak')
+class SharedCacheTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_pem, cls.public_jwk = make_signing_key('key-a')
+
+    def setUp(self):
+        caches['keycloak'].clear()
+        key_store.clear()
+        token_cache.clear()
+        self.addCleanup(key_store.clear)
+        self.addCleanup(token_cache.clear)
+
+    def test_key_set_fetched_by_one_worker_is_reused_by_another(self):
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)) as get:
+            worker_a = JWKSKeyStore()
+            worker_b = JWKSKeyStore()
+            worker_a.get_key('key-a')
+            worker_b.get_key('key-a')
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(worker_a.fingerprint, worker_b.fingerprint)
+
+    def test_verified_claims_are_shared_compactly(self):
+        token = mint_token(self.private_pem, 'key-a', realm_access={'roles': ['a'] * 50})
+        request = APIRequestFactory().get('/api/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        shared_hits = token_cache.stats()['shared_hits']
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            KeycloakJWTAuthentication().authenticate(request)
+            # Another worker: empty L1, same shared cache.
+            token_cache.clear()
+            with mock.patch('api.jwt_backends.jwt.decode') as decode:
+                user, _ = KeycloakJWTAuthentication().authenticate(request)
+        decode.assert_not_called()
+        self.assertEqual(user.username, 'alice')
+        self.assertEqual(user.email, 'alice@example.com')
+        self.assertEqual(token_cache.stats()['shared_hits'], shared_hits + 1)
+        values = caches['keycloak'].get(token_cache._shared_key(token_cache.digest(token)))
+        self.assertEqual(len(values), len(token_cache.shared_claims) + 1)
+
+    def test_claims_outside_the_shared_set_after_a_shared_hit(self):
+        token = mint_token(self.private_pem, 'key-a', realm_access={'roles': ['admin']})
+        request = APIRequestFactory().get('/api/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            first, _ = KeycloakJWTAuthentication().authenticate(request)
+            token_cache.clear()
+            user, _ = KeycloakJWTAuthentication().authenticate(request)
+            # The same claims whichever worker verified the token first
+            self.assertEqual(user.get_claim('realm_access'), {'roles': ['admin']})
+            self.assertEqual(user.token_payload, first.token_payload)
+            # The full payload replaced the shared claims in this worker
+            with mock.patch('api.jwt_backends.jwt.decode') as decode:
+                again, _ = KeycloakJWTAuthentication().authenticate(request)
+                self.assertEqual(again.get_claim('realm_access'), {'roles': ['admin']})
+        decode.assert_not_called()
+
+    def test_async_miss_is_counted_once(self):
+        token = mint_token(self.private_pem, 'key-a')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            key_store.get_key('key-a')
+            before = token_cache.stats()
+            user, _ = run_async(KeycloakJWTAuthentication()._aauthenticate(token))
+        after = token_cache.stats()
+        self.assertEqual(user.username, 'alice')
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['shared_misses'] - before['shared_misses'], 1)
+
+    def test_shared_cache_failure_falls_back_to_verification(self):
+        token = mint_token(self.private_pem, 'key-a')
+        request = APIRequestFactory().get('/api/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            with mock.patch.object(caches['keycloak'], 'get', side_effect=ConnectionError):
+                with self.assertLogs('api.shared_cache', 'WARNING'):
+                    user, _ = KeycloakJWTAuthentication().authenticate(request)
+        self.assertEqual(user.username, 'alice')
+
+
+class KeycloakUserTests(SimpleTestCase):
+    payload = {
+        'sub': 'user-1',
+        'preferred_username': 'alice',
+        'email': 'alice@example.com',
+        'given_name': 'Alice',
+        'family_name': 'Liddell',
+        'realm_access': {'roles': ['offline_access', 'uma_authorization']},
+    }
+
+    def test_attributes_resolve_from_payload(self):
+        user = KeycloakUser(self.payload)
+        self.assertEqual(
+            (user.pk, user.id, user.username, user.email, user.first_name, user.last_name),
+            ('user-1', 'user-1', 'alice', 'alice@example.com', 'Alice', 'Liddell'),
+        )
+        self.assertTrue(user.is_authenticated)
+        self.assertEqual(str(user), 'alice')
+
+    def test_payload_is_shared_not_copied(self):
+        user = KeycloakUser(self.payload)
+        self.assertFalse(hasattr(user, '__dict__'))
+        self.assertIs(user.token_payload, self.payload)
+
+    @override_settings(KEYCLOAK_USER_OMIT_CLAIMS=('realm_access', 'resource_access'))
+    def test_omitted_claims(self):
+        user = KeycloakUser(self.payload)
+        self.assertNotIn('realm_access', user.token_payload)
+        self.assertEqual(user.get_claim('realm_access'), self.payload['realm_access'])
+        self.assertIn('realm_access', self.payload)
+
+    @override_settings(KEYCLOAK_USER_OMIT_CLAIMS=('realm_access',))
+    def test_profile_view_leaves_out_omitted_claims(self):
+        private_pem, public_jwk = make_signing_key('key-a')
+        token = mint_token(private_pem, 'key-a', realm_access={'roles': ['admin']})
+        key_store.clear()
+        token_cache.clear()
+        self.addCleanup(key_store.clear)
+        self.addCleanup(token_cache.clear)
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(public_jwk)):
+            response = self.client.get('/api/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        user = response.json()['user']
+        self.assertEqual(user['username'], 'alice')
+        self.assertNotIn('realm_access', user['token_payload'])
+        self.assertEqual(user['token_payload']['sub'], 'user-1')
+
+
+class StubWeatherServer:
+    """Local stand-in for the weather API, counting requests per path"""
+
+    def __init__(self):
+        self.requests = []
+        self.documents = {}  # path -> JSON body served instead of weather data
+        self.delay = 0
+        self.status = 200
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.do_GET()
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                time.sleep(stub.delay)
+                document = stub.documents.get(self.path, {'temperature': '+31 °C', 'path': self.path})
+                body = json.dumps(document).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.url = f'{self.base_url}/weather/{{city}}'
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_async(coro):
+    """Run ``coro`` on a fresh event loop, closing the async client it used"""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await async_http_client.aclose()
+    return asyncio.run(main())
+
+
+class WeatherCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubWeatherServer()
+        self.addCleanup(self.stub.close)
+        settings_override = override_settings(
+            WEATHER_API_URL=self.stub.url,
+            WEATHER_CACHE_TTL=300,
+            WEATHER_STALE_WHILE_REVALIDATE=300,
+            WEATHER_STALE_IF_ERROR=3600,
+            WEATHER_RETRY_AFTER=30,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.cache = WeatherCache()
+
+    def age_entry(self, city, seconds):
+        data, fetched_at = self.cache._entries[city]
+        self.cache._entries[city] = (data, fetched_at - seconds)
+
+    def test_responses_are_cached_per_city(self):
+        self.assertEqual(self.cache.get('bangkok')[1], WeatherCache.MISS)
+        data, state = self.cache.get('bangkok')
+        self.assertEqual(state, WeatherCache.HIT)
+        self.assertEqual(data['path'], '/weather/bangkok')
+        self.assertEqual(self.cache.get('tokyo')[0]['path'], '/weather/tokyo')
+        self.assertEqual(self.stub.requests, ['/weather/bangkok', '/weather/tokyo'])
+
+    def test_concurrent_misses_share_one_upstream_request(self):
+        self.stub.delay = 0.2
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.cache.get('bangkok')))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_concurrent_async_misses_share_one_upstream_request(self):
+        self.stub.delay = 0.2
+
+        async def fetch_all():
+            return await asyncio.gather(*(self.cache.aget('bangkok') for _ in range(10)))
+
+        results = run_async(fetch_all())
+        self.assertEqual([state for _, state in results], [WeatherCache.MISS] * 10)
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(self.cache.get('bangkok')[1], WeatherCache.HIT)
+
+    def test_stale_entry_is_served_while_revalidating(self):
+        self.cache.get('bangkok')
+        self.age_entry('bangkok', 301)
+        self.stub.delay = 0.2
+        started = time.perf_counter()
+        _, state = self.cache.get('bangkok')
+        self.assertEqual(state, WeatherCache.STALE)
+        self.assertLess(time.perf_counter() - started, 0.2)
+        # A second stale read does not start another refresh.
+        self.cache.get('bangkok')
+        deadline = time.time() + 5
+        while self.cache._inflight and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(self.cache.get('bangkok')[1], WeatherCache.HIT)
+
+    def test_stale_entry_is_served_if_upstream_fails(self):
+        self.cache.get('bangkok')
+        self.age_entry('bangkok', 1000)
+        self.stub.status = 500
+        data, state = self.cache.get('bangkok')
+        self.assertEqual(state, WeatherCache.STALE)
+        self.assertEqual(data['path'], '/weather/bangkok')
+
+        self.age_entry('bangkok', 5000)
+        with self.assertRaises(WeatherUpstreamError):
+            self.cache.get('bangkok')
+
+    def test_failed_async_revalidation_is_not_logged(self):
+        self.cache.get('bangkok')
+        self.age_entry('bangkok', 301)
+        self.stub.status = 503
+
+        async def stale_read():
+            _, state = await self.cache.aget('bangkok')
+            # Let the background revalidation fail
+            await asyncio.gather(*self.cache._tasks)
+            await asyncio.sleep(0)
+            return state
+
+        with self.assertNoLogs('asyncio', 'ERROR'):
+            self.assertEqual(run_async(stale_read()), WeatherCache.STALE)
+            gc.collect()
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_upstream_failure_without_cache(self):
+        self.stub.status = 503
+        with self.assertRaises(WeatherUpstreamError):
+            self.cache.get('bangkok')
+
+    def test_upstream_is_not_asked_again_during_an_outage(self):
+        self.cache.get('bangkok')
+        self.age_entry('bangkok', 1000)
+        self.stub.status = 500
+        self.assertEqual(self.cache.get('bangkok')[1], WeatherCache.STALE)
+        # Inside the retry-after window the stale entry is served directly.
+        data, state = self.cache.get('bangkok')
+        self.assertEqual(state, WeatherCache.STALE)
+        self.assertEqual(data['path'], '/weather/bangkok')
+        self.assertEqual(run_async(self.cache.aget('bangkok'))[1], WeatherCache.STALE)
+        with self.assertRaises(WeatherUpstreamError):
+            self.cache.get('tokyo')
+        with self.assertRaises(WeatherUpstreamError):
+            self.cache.get('tokyo')
+        self.assertEqual(self.stub.requests, ['/weather/bangkok'] * 2 + ['/weather/tokyo'])
+
+        # Once the window has passed the upstream is tried again.
+        self.stub.status = 200
+        with override_settings(WEATHER_RETRY_AFTER=0):
+            self.assertEqual(self.cache.get('tokyo')[1], WeatherCache.MISS)
+        self.assertEqual(self.cache.get('tokyo')[1], WeatherCache.HIT)
+
+    @override_settings(WEATHER_CACHE_MAX_ENTRIES=2)
+    def test_cache_is_bounded(self):
+        for city in ('bangkok', 'tokyo', 'paris'):
+            self.cache.get(city)
+        self.assertEqual(list(self.cache._entries), ['tokyo', 'paris'])
+
+
+class WeatherViewTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_pem, cls.public_jwk = make_signing_key('key-a')
+
+    def setUp(self):
+        self.stub = StubWeatherServer()
+        self.addCleanup(self.stub.close)
+        settings_override = override_settings(WEATHER_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for cache in (key_store, token_cache, weather_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        token = mint_token(self.private_pem, 'key-a')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        # Load the key set up front: patching the shared HTTP client would
+        # also intercept the calls to the stub weather server.
+        with mock.patch('api.jwks.http_client.get', return_value=jwks_response(self.public_jwk)):
+            key_store.refresh()
+
+    def test_bangkok_weather_is_cached(self):
+        first = self.client.get('/api/weather/bangkok/', **self.auth)
+        second = self.client.get('/api/weather/bangkok/', **self.auth)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.json()['location'], 'Bangkok')
+        self.assertEqual(second.json()['user']['username'], 'alice')
+        self.assertEqual(self.stub.requests, ['/weather/bangkok'])
+
+    def test_weather_for_other_cities(self):
+        response = self.client.get('/api/weather/Tokyo/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['location'], 'Tokyo')
+        self.assertEqual(self.stub.requests, ['/weather/tokyo'])
+
+    def test_upstream_failure(self):
+        self.stub.status = 502
+        response = self.client.get('/api/weather/bangkok/', **self.auth)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['error'], 'Failed to fetch weather data')
+
+    def test_requires_authentication(self):
+        response = self.client.get('/api/weather/bangkok/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stub.requests, [])
+
+
+class AsyncWeatherViewTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_pem, cls.public_jwk = make_signing_key('key-a')
+
+    def setUp(self):
+        self.stub = StubWeatherServer()
+        self.addCleanup(self.stub.close)
+        self.stub.documents['/certs'] = {'keys': [self.public_jwk]}
+        settings_override = override_settings(
+            WEATHER_API_URL=self.stub.url,
+            KEYCLOAK_CERT_URL=f'{self.stub.base_url}/certs',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for cache in (key_store, token_cache, weather_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        self.factory = AsyncRequestFactory()
+        self.token = mint_token(self.private_pem, 'key-a')
+
+    def get(self, city, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        request = self.factory.get(f'/api/weather/{city}/', headers=headers)
+        return async_views.weather_city(request, city)
+
+    def test_weather_is_served_without_blocking_the_loop(self):
+        async def requests():
+            first = await asyncio.gather(*(self.get('bangkok', self.token) for _ in range(5)))
+            return first, await self.get('bangkok', self.token)
+
+        first, second = run_async(requests())
+        self.assertEqual([response.status_code for response in first], [200] * 5)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        body = json.loads(second.content)
+        self.assertEqual(body['location'], 'Bangkok')
+        self.assertEqual(body['user']['username'], 'alice')
+        # Concurrent first requests share one JWKS fetch and one upstream call.
+        self.assertEqual(self.stub.requests, ['/certs', '/weather/bangkok'])
+
+    def test_requires_authentication(self):
+        response = run_async(self.get('bangkok'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="keycloak"')
+        self.assertEqual(self.stub.requests, [])
+
+    def test_invalid_token(self):
+        response = run_async(self.get('bangkok', 'not-a-token'))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Invalid token', json.loads(response.content)['detail'])
+
+
+@override_settings(HTTP_RETRY_BACKOFF=0)
+class MetricsTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_pem, cls.public_jwk = make_signing_key('key-a')
+
+    def setUp(self):
+        self.stub = StubWeatherServer()
+        self.addCleanup(self.stub.close)
+        self.stub.documents['/certs'] = {'keys': [self.public_jwk]}
+        settings_override = override_settings(
+            WEATHER_API_URL=self.stub.url,
+            KEYCLOAK_CERT_URL=f'{self.stub.base_url}/certs',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for cache in (key_store, token_cache, weather_cache, metrics):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {mint_token(self.private_pem, "key-a")}'}
+
+    def phases(self, response):
+        return [item.split(';')[0] for item in response['Server-Timing'].split(', ')]
+
+    def test_server_timing_breaks_down_the_request(self):
+        first = self.client.get('/api/weather/bangkok/', **self.auth)
+        # DRF authenticates inside the view, after the middleware
+        self.assertEqual(self.phases(first), ['mw', 'jwks', 'verify', 'auth', 'weather', 'total'])
+        second = self.client.get('/api/weather/bangkok/', **self.auth)
+        self.assertEqual(self.phases(second), ['mw', 'auth', 'total'])
+
+    async def test_server_timing_under_asgi(self):
+        headers = {'Authorization': self.auth['HTTP_AUTHORIZATION']}
+        response = await self.async_client.get('/api/profile/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.phases(response), ['mw', 'jwks', 'verify', 'auth', 'total'])
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        response = self.client.get('/api/health/')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_prometheus_endpoint(self):
+        self.client.get('/api/weather/bangkok/', **self.auth)
+        self.client.get('/api/weather/bangkok/', **self.auth)
+        self.stub.status = 502
+        self.client.get('/api/weather/tokyo/', **self.auth)
+        self.client.get('/api/profile/', HTTP_AUTHORIZATION='Bearer not-a-token')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        for line in (
+            '# TYPE phase_duration_seconds histogram',
+            'phase_duration_seconds_count{phase="verify"} 1',
+            'phase_duration_seconds_bucket{phase="jwks",le="+Inf"} 1',
+            'http_requests_total{method="GET",status="200",view="weather_bangkok"} 2',
+            'http_requests_total{method="GET",status="503",view="weather_city"} 1',
+            'http_request_duration_seconds_count{view="weather_bangkok"} 2',
+            'weather_cache_requests_total{result="hit"} 1',
+            'weather_cache_requests_total{result="miss"} 1',
+            'upstream_errors_total{upstream="weather"} 1',
+            'auth_failures_total{reason="rejected"} 1',
+        ):
+            self.assertIn(line + '\n', body)
+        # Components' own counters are collected at scrape time
+        self.assertIn('token_cache_requests_total{result="hits"} ', body)
+        self.assertIn('http_client_requests_total{client="sync",host="127.0.0.1"} ', body)
+
+
+PROFILE_SECRET = 'profile-secret-for-tests-' + 'x' * 16
+
+
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        settings_override = override_settings(PROFILE_DIR=self.directory, PROFILE_SECRET=PROFILE_SECRET)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        profiler.clear()
+        self.addCleanup(profiler.clear)
+
+    def files(self, endpoint):
+        return sorted(os.listdir(os.path.join(self.directory, endpoint)))
+
+    def test_off_by_default(self):
+        response = self.client.get('/api/health/', HTTP_X_PROFILE=profile_header_value())
+        self.assertNotIn('X-Profiled', response)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0)
+    def test_sampled_requests_are_aggregated_per_endpoint(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/health/')['X-Profiled'], 'cprofile')
+        self.assertEqual(os.listdir(self.directory), [])  # written on flush
+
+        profiler.flush()
+        [name] = self.files('health_check')
+        self.assertTrue(name.endswith('-3req.pstats'))
+        stats = pstats.Stats(os.path.join(self.directory, 'health_check', name))
+        self.assertTrue(any(func[2] == 'health_check' for func in stats.stats))
+
+    @override_settings(PROFILE_HEADER=True)
+    def test_signed_header(self):
+        self.assertNotIn('X-Profiled', self.client.get('/api/health/'))
+        self.assertNotIn('X-Profiled', self.client.get('/api/health/', HTTP_X_PROFILE='profile'))
+        response = self.client.get('/api/health/', HTTP_X_PROFILE=profile_header_value())
+        self.assertEqual(response['X-Profiled'], 'cprofile')
+
+    @override_settings(PROFILER='stack', PROFILE_STACK_INTERVAL=0.001)
+    def test_stack_sampler_writes_collapsed_stacks(self):
+        session = profiler.start()
+        self.assertIsInstance(session, StackSampler)
+        self.assertIsNone(profiler.start())  # one profiled request at a time
+        time.sleep(0.05)
+        profiler.stop(session, 'sleepy')
+        profiler.flush()
+
+        [name] = self.files('sleepy')
+        with open(os.path.join(self.directory, 'sleepy', name)) as f:
+            lines = f.read().splitlines()
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertIn(';test_stack_sampler_writes_collapsed_stacks (tests.py:', stack)
+        self.assertGreater(int(count), 0)
+
+    @override_settings(PROFILE_HEADER=True)
+    def test_header_needs_a_dedicated_secret(self):
+        # Signed with SECRET_KEY, which is public in development
+        forged = signing.TimestampSigner(salt=SALT).sign('profile')
+        self.assertNotIn('X-Profiled', self.client.get('/api/health/', HTTP_X_PROFILE=forged))
+        for secret in ('', 'short', settings.SECRET_KEY, 'django-insecure-your-secret-key-here'):
+            with self.subTest(secret=secret), override_settings(PROFILE_SECRET=secret):
+                self.assertFalse(profiler.header_enabled)
+                with self.assertRaises(ImproperlyConfigured):
+                    profile_header_value()
+                with self.assertLogs('api.profiling', 'WARNING'), self.assertRaises(MiddlewareNotUsed):
+                    ProfilingMiddleware(lambda request: None)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_KEEP=2, PROFILE_FLUSH_INTERVAL=0)
+    def test_files_are_rotated(self):
+        for _ in range(4):
+            self.client.get('/api/health/')
+        names = self.files('health_check')
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[-1].endswith('-1req.pstats'))
+
+
+class HealthTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_pem, cls.public_jwk = make_signing_key('key-a')
+
+    def setUp(self):
+        self.stub = StubWeatherServer()
+        self.addCleanup(self.stub.close)
+        self.stub.documents['/certs'] = {'keys': [self.public_jwk]}
+        settings_override = override_settings(
+            WEATHER_API_URL=self.stub.url,
+            KEYCLOAK_CERT_URL=f'{self.stub.base_url}/certs',
+            WARMUP_WEATHER_CITIES=['bangkok'],
+            WARMUP_RETRY_INTERVAL=0.05,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for cache in (warmup, key_store, token_cache, weather_cache, metrics):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        self.addCleanup(self.wait_for_warmup)
+
+    def wait_for_warmup(self):
+        if warmup._thread is not None:
+            warmup._thread.join(5)
+
+    def test_liveness_skips_the_stack(self):
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'alive'})
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertNotIn('Server-Timing', response)
+        self.assertIsNone(warmup._thread)
+        self.assertNotIn('http_requests_total', self.client.get('/metrics').content.decode())
+
+    def test_ready_once_warmed_up(self):
+        self.stub.delay = 0.2
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'warming')
+
+        self.wait_for_warmup()
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        checks = response.json()['checks']
+        self.assertEqual(list(checks), ['urls', 'jwks', 'weather'])
+        self.assertTrue(all(check['ok'] for check in checks.values()))
+        self.assertEqual(self.stub.requests, ['/certs', '/weather/bangkok'])
+
+        # The first requests find the key set and the weather cached
+        self.stub.delay = 0
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {mint_token(self.private_pem, "key-a")}'}
+        self.assertEqual(self.client.get('/api/weather/bangkok/', **auth).status_code, 200)
+        self.assertEqual(self.stub.requests, ['/certs', '/weather/bangkok'])
+
+    def test_not_ready_when_the_key_set_is_dropped(self):
+        self.assertTrue(warmup.run())
+        key_store.clear()
+        self.assertFalse(warmup.ready())
+        self.assertEqual(self.client.get('/readyz').status_code, 503)
+        self.wait_for_warmup()
+        self.assertEqual(self.client.get('/readyz').status_code, 200)
+        self.assertEqual(self.stub.requests, ['/certs', '/weather/bangkok', '/certs'])
+
+    def test_failed_steps_are_retried(self):
+        self.stub.status = 502
+        with self.assertLogs('api.health', 'WARNING'):
+            self.assertFalse(warmup.run())
+        self.assertFalse(warmup.results['jwks']['ok'])
+        self.assertIn('error', warmup.results['jwks'])
+
+        self.stub.status = 200
+        self.assertTrue(warmup.run())
+        self.assertTrue(warmup.results['jwks']['ok'])
+
+    def test_weather_is_best_effort(self):
+        with override_settings(WEATHER_API_URL='http://127.0.0.1:9/weather/{city}'), self.assertLogs('api.health'):
+            self.assertTrue(warmup.run())
+        self.assertFalse(warmup.results['weather']['ok'])
+
+    @override_settings(WARMUP_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/readyz').status_code, 200)
+        self.assertIsNone(warmup._thread)
+        self.assertEqual(self.stub.requests, [])
+
+    async def test_probes_under_asgi(self):
+        self.assertEqual((await self.async_client.get('/healthz')).status_code, 200)
+        response = await self.async_client.get('/readyz')
+        self.assertIn(response.status_code, (200, 503))
+        self.assertIn(response.json()['status'], ('ready', 'warming'))
+
+
+class StartupTests(SimpleTestCase):
+    def worker_modules(self, server):
+        # What a worker imports before its first request (benchmarks/startup.py)
+        code = (
+            f'import sys, config.{server}\n'
+            'from django.urls import get_resolver\n'
+            'get_resolver().url_patterns\n'
+            'print(" ".join(sys.modules))\n'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='config.settings')
+        env.pop('DJANGO_API_ASYNC', None)
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        return set(result.stdout.split())
+
+    def test_wsgi_workers_do_not_import_jose_or_httpx(self):
+        modules = self.worker_modules('wsgi')
+        self.assertIn('jwt', modules)
+        self.assertNotIn('jose', modules)
+        self.assertNotIn('httpx', modules)
+
+    def test_asgi_workers_import_httpx_at_boot(self):
+        modules = self.worker_modules('asgi')
+        self.assertIn('httpx', modules)
+        self.assertNotIn('jose', modules)
+
+
+class StatelessProfileTests(SimpleTestCase):
+    """The API_STATELESS settings profile, booted in a fresh process"""
+
+    SCRIPT = (
+        'import json, os, django\n'
+        'django.setup()\n'
+        'from django.conf import settings\n'
+        'from django.db import connection\n'
+        'from django.test import Client\n'
+        'queries = []\n'
+        'def count(execute, sql, params, many, context):\n'
+        '    queries.append(sql)\n'
+        '    return execute(sql, params, many, context)\n'
+        'client = Client(HTTP_AUTHORIZATION=f"Bearer {os.environ[\'TEST_TOKEN\']}")\n'
+        'with connection.execute_wrapper(count):\n'
+        '    statuses = [client.get(path).status_code for path in\n'
+        '                ("/api/profile/", "/api/weather/bangkok/", "/api/profile/", "/api/weather/bangkok/")]\n'
+        '    statuses.append(Client().get("/api/profile/").status_code)\n'
+        'print(json.dumps({"statuses": statuses, "queries": queries, "apps": settings.INSTALLED_APPS,\n'
+        '                  "database": settings.DATABASES["default"]["ENGINE"], "middleware": settings.MIDDLEWARE}))\n'
+    )
+
+    def test_requests_make_no_database_queries(self):
+        stub = StubWeatherServer()
+        self.addCleanup(stub.close)
+        private_pem, public_jwk = make_signing_key('key-a')
+        stub.documents['/certs'] = {'keys': [public_jwk]}
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='config.settings',
+            DJANGO_API_STATELESS='1',
+            KEYCLOAK_CERT_URL=f'{stub.base_url}/certs',
+            WEATHER_API_URL=stub.url,
+            TEST_TOKEN=mint_token(private_pem, 'key-a'),
+        )
+        env.pop('DJANGO_API_ASYNC', None)
+        result = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT], cwd=settings.BASE_DIR, env=env,
+            capture_output=True, text=True, check=True,
+        )
+        outcome = json.loads(result.stdout)
+
+        self.assertEqual(outcome['statuses'], [200, 200, 200, 200, 401])
+        self.assertEqual(outcome['queries'], [])
+        self.assertEqual(outcome['database'], 'django.db.backends.dummy')  # any query would raise
+        self.assertNotIn('django.contrib.sessions', outcome['apps'])
+        self.assertNotIn('django.contrib.sessions.middleware.SessionMiddleware', outcome['middleware'])
+        self.assertNotIn('django.middleware.csrf.CsrfViewMiddleware', outcome['middleware'])
+
+
+class PooledHTTPClientTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubWeatherServer()
+        self.addCleanup(self.stub.close)
+        self.url = self.stub.url.format(city='bangkok')
+        self.client = PooledHTTPClient()
+        self.addCleanup(self.client.close)
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        stats = self.client.stats()['127.0.0.1']
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['pool_misses'], 1)
+        self.assertEqual(stats['pool_hits'], 2)
+        self.assertGreater(stats['connect_time_total'], 0)
+
+    @override_settings(HTTP_RETRIES=2, HTTP_RETRY_BACKOFF=0)
+    def test_idempotent_requests_are_retried(self):
+        self.stub.status = 503
+        self.assertEqual(self.client.get(self.url).status_code, 503)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    @override_settings(HTTP_RETRIES=2, HTTP_RETRY_BACKOFF=0)
+    def test_post_is_not_retried(self):
+        self.stub.status = 503
+        self.assertEqual(self.client.post(self.url, data={'a': 'b'}).status_code, 503)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    @override_settings(HTTP_RETRIES=2, HTTP_RETRY_BACKOFF=0)
+    def test_read_timeouts_are_not_retried(self):
+        self.stub.delay = 1
+        started = time.perf_counter()
+        with self.assertRaises(requests.Timeout):
+            self.client.get(self.url, timeout=0.3)
+        self.assertLess(time.perf_counter() - started, 0.9)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    @override_settings(HTTP_TIMEOUT=0.05)
+    def test_default_timeout(self):
+        self.stub.delay = 0.5
+        with self.assertRaises(requests.RequestException):
+            self.client.get(self.url)
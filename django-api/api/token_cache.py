@@ -0,0 +1,262 @@
+"""
+Per-worker cache of verified token payloads.
+
+Clients reuse the same access token for its whole lifetime, so the RS256
+signature check and claim validation only need to run on first sight. Entries
+are keyed by a SHA-256 digest of the raw token (the token itself is never kept
+as a key) and expire at the token's ``exp`` minus a leeway, or earlier when
+KEYCLOAK_TOKEN_CACHE_MAX_AGE is set to bound how long a revoked token can
+keep working.
+
+With KEYCLOAK_SHARED_CACHE configured the in-process LRU is an L1 in front of
+the shared cache. Only the claims listed in KEYCLOAK_SHARED_CACHE_CLAIMS are
+written there, as a compact tuple, and entries are namespaced by the JWKS
+fingerprint so a key rotation orphans them in every worker at once. A payload
+rebuilt from such an entry is a ``SharedClaims``: KeycloakUser verifies the
+token again (locally, against the cached keys) the first time something
+outside those claims is asked for.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .jwks import key_store
+from .metrics import metrics
+from .shared_cache import get_shared_cache, make_key, shared_get, shared_set
+
+
+# Claims KeycloakUser reads, plus the timestamps needed to re-derive expiry.
+DEFAULT_SHARED_CLAIMS = (
+    'sub', 'preferred_username', 'email', 'given_name', 'family_name', 'exp', 'iat',
+)
+
+# Rough per-entry overhead (digest key, tuple, OrderedDict node) on top of
+# the payload's serialised size, used for the memory cap.
+ENTRY_OVERHEAD = 256
+
+
+class SharedClaims(dict):
+    """A payload rebuilt from the shared cache: only the shared claims"""
+
+    __slots__ = ()
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of token digest -> verified payload.
+
+    The cache is capped both by entry count and by an estimate of the memory
+    held by cached payloads (their serialised JSON size, measured once on
+    insert, plus ENTRY_OVERHEAD); the least recently used entries are
+    evicted first. Hit/miss/eviction counters are exposed via ``stats()``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'KEYCLOAK_TOKEN_CACHE_ENABLED', True)
+
+    @property
+    def max_entries(self):
+        return getattr(settings, 'KEYCLOAK_TOKEN_CACHE_MAX_ENTRIES', 10000)
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'KEYCLOAK_TOKEN_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'KEYCLOAK_TOKEN_CACHE_MAX_AGE', 300)
+
+    @property
+    def leeway(self):
+        return getattr(settings, 'KEYCLOAK_TOKEN_CACHE_LEEWAY', 30)
+
+    @property
+    def shared_claims(self):
+        return tuple(getattr(settings, 'KEYCLOAK_SHARED_CACHE_CLAIMS', DEFAULT_SHARED_CLAIMS))
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def _shared_key(self, key):
+        fingerprint = key_store.fingerprint
+        if fingerprint is None:
+            return None
+        return make_key('token', fingerprint, key.hex())
+
+    def get(self, token, local_only=False):
+        """
+        Return the cached payload for ``token``, or None on a miss.
+
+        ``local_only`` skips the shared cache, for callers (async views)
+        that must not block on cache I/O.
+        """
+        if not self.enabled:
+            return None
+        key = self.digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at, size = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                self._remove(key, size)
+                self.expirations += 1
+            self.misses += 1
+
+        if local_only:
+            return None
+        return self._get_shared(token, key, now)
+
+    def get_shared(self, token):
+        """
+        Return the payload for ``token`` from the shared cache only, for
+        callers that already missed with ``get(token, local_only=True)``
+        """
+        if not self.enabled:
+            return None
+        return self._get_shared(token, self.digest(token), time.time())
+
+    def _get_shared(self, token, key, now):
+        """
+        L1 miss: look the token up in the shared cache and keep a local copy
+        """
+        if get_shared_cache() is None:
+            return None
+        shared_key = self._shared_key(key)
+        if shared_key is None:
+            return None
+        values = shared_get(shared_key)
+        claims = self.shared_claims
+        # Stored as (expires_at, *claims) so max age holds across workers.
+        if not isinstance(values, tuple) or len(values) != len(claims) + 1 or values[0] <= now:
+            self.shared_misses += 1
+            return None
+        payload = SharedClaims((claim, value) for claim, value in zip(claims, values[1:]) if value is not None)
+        self.shared_hits += 1
+        self._set_local(token, key, payload, now, values[0])
+        return payload
+
+    def set(self, token, payload, local_only=False):
+        """
+        Cache a payload that has just passed signature and claim checks.
+
+        ``local_only`` leaves the shared cache alone, e.g. when a full
+        payload replaces the shared claims that were already there.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        key = self.digest(token)
+        expires_at = self._set_local(token, key, payload, now)
+        if expires_at is None or local_only or get_shared_cache() is None:
+            return
+        shared_key = self._shared_key(key)
+        if shared_key is not None:
+            values = (expires_at,) + tuple(payload.get(claim) for claim in self.shared_claims)
+            shared_set(shared_key, values, expires_at - now)
+
+    def _set_local(self, token, key, payload, now, expires_at=None):
+        if expires_at is None:
+            expires_at = self._expiry_for(payload, now)
+        else:
+            expires_at = min(expires_at, self._expiry_for(payload, now))
+        if expires_at <= now:
+            return None
+
+        size = self._payload_size(payload) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return None
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (payload, expires_at, size)
+            self._bytes += size
+
+            max_entries = self.max_entries
+            max_bytes = self.max_bytes
+            while len(self._entries) > max_entries or self._bytes > max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return expires_at
+
+    @staticmethod
+    def _payload_size(payload):
+        return len(json.dumps(payload, separators=(',', ':'), default=str))
+
+    def _expiry_for(self, payload, now):
+        expires_at = now + self.max_age
+        exp = payload.get('exp')
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp - self.leeway)
+        return expires_at
+
+    def _remove(self, key, size):
+        del self._entries[key]
+        self._bytes -= size
+
+    def clear(self):
+        """
+        Drop every cached payload, e.g. after the signing keys rotated
+        """
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'shared_hits': self.shared_hits,
+                'shared_misses': self.shared_misses,
+            }
+
+
+token_cache = VerifiedTokenCache()
+
+
+def _collect_metrics():
+    stats = token_cache.stats()
+    return [
+        ('token_cache_requests_total', 'counter', 'Verified-token cache lookups, by result', [
+            ({'result': result}, stats[result])
+            for result in ('hits', 'misses', 'shared_hits', 'shared_misses')
+        ]),
+        ('token_cache_evictions_total', 'counter', 'Verified tokens dropped for space',
+         [({}, stats['evictions'])]),
+        ('token_cache_entries', 'gauge', 'Verified tokens cached in this worker', [({}, stats['entries'])]),
+    ]
+
+
+metrics.add_collector(_collect_metrics)
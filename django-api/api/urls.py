@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Under ASGI the weather endpoints run as async views (see config/asgi.py)
+weather_views = async_views if getattr(settings, 'API_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
     path('health/', views.health_check, name='health_check'),
     path('profile/', views.user_profile, name='user_profile'),
-    path('weather/bangkok/', views.weather_bangkok, name='weather_bangkok'),
-]
\ No newline at end of file
+    path('weather/bangkok/', weather_views.weather_bangkok, name='weather_bangkok'),
+    path('weather/<slug:city>/', weather_views.weather_city, name='weather_city'),
+]
@@ -1,45 +1,45 @@
-import requests
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.http import JsonResponse
 
+from .metrics import metrics
+from .weather import WeatherUpstreamError, weather_cache
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def weather_bangkok(request):
+
+def weather_response_data(user, city, weather_data):
     """
-    Get weather information for Bangkok from goweather.xyz API
-    Requires JWT authentication from Keycloak
+    Combine weather data for ``city`` with user information from the JWT token
+    """
+    user_info = {
+        'username': user.username,
+        'email': user.email,
+        'user_id': user.pk,
+    }
+    
+    return {
+        'user': user_info,
+        'weather': weather_data,
+        'location': city.title(),
+        'message': 'Weather data retrieved successfully'
+    }
+
+
+def _weather_response(request, city):
+    """
+    Build the weather response for ``city``, served from the weather cache
     """
     try:
-        # Call external weather API
-        weather_response = requests.get(
-            'https://goweather.xyz/weather/bangkok',
-            timeout=10
-        )
-        weather_response.raise_for_status()
-        weather_data = weather_response.json()
+        # Cached upstream weather API call (see api.weather)
+        weather_data, cache_state = weather_cache.get(city)
+        metrics.inc('weather_cache_requests_total', result=cache_state)
         
-        # Add user information from JWT token
-        user_info = {
-            'username': request.user.username,
-            'email': request.user.email,
-            'user_id': request.user.pk,
-        }
+        response_data = weather_response_data(request.user, city, weather_data)
         
-        # Combine weather data with user info
-        response_data = {
-            'user': user_info,
-            'weather': weather_data,
-            'location': 'Bangkok',
-            'message': 'Weather data retrieved successfully'
-        }
+        return Response(response_data, status=status.HTTP_200_OK, headers={'X-Cache': cache_state.upper()})
         
-        return Response(response_data, status=status.HTTP_200_OK)
-        
-    except requests.RequestException as e:
+    except WeatherUpstreamError as e:
         return Response(
             {
                 'error': 'Failed to fetch weather data',
@@ -57,6 +57,26 @@ def weather_bangkok(request):
         )
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def weather_bangkok(request):
+    """
+    Get weather information for Bangkok from goweather.xyz API
+    Requires JWT authentication from Keycloak
+    """
+    return _weather_response(request, 'bangkok')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def weather_city(request, city):
+    """
+    Get weather information for any city from goweather.xyz API
+    Requires JWT authentication from Keycloak
+    """
+    return _weather_response(request, city.lower())
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_profile(request):
@@ -0,0 +1,282 @@
+"""
+Cached, coalesced access to the upstream weather API.
+
+The upstream data changes at most every few minutes, so responses are cached
+per city for WEATHER_CACHE_TTL seconds. Concurrent misses for the same city
+share a single upstream request. Once an entry is past its TTL it is still
+served for WEATHER_STALE_WHILE_REVALIDATE seconds while one background thread
+refreshes it, and for WEATHER_STALE_IF_ERROR seconds when the upstream fails.
+After a failed upstream request the city is not asked for again for
+WEATHER_RETRY_AFTER seconds: requests in that window get the stale entry, or
+the error when there is none, without waiting on an upstream that is down.
+
+``aget()`` is the async equivalent for ASGI views: the same cache entries,
+with misses coalesced on the event loop and fetched with the async client.
+"""
+import asyncio
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+
+from .http_client import async_http_client, http_client
+from .metrics import metrics, timed
+
+
+class WeatherUpstreamError(Exception):
+    """Raised when the weather API cannot be reached or returns bad data."""
+
+
+class _Flight:
+    """A single upstream request that concurrent callers wait on"""
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WeatherCache:
+    # Cache states reported alongside the data
+    HIT = 'hit'
+    MISS = 'miss'
+    STALE = 'stale'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # city -> (data, fetched_at)
+        self._inflight = {}  # city -> _Flight
+        self._ainflight = {}  # city -> asyncio.Future
+        self._failures = {}  # city -> (error message, failed_at)
+        self._tasks = set()
+
+    @property
+    def url(self):
+        return getattr(settings, 'WEATHER_API_URL', 'https://goweather.xyz/weather/{city}')
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'WEATHER_API_TIMEOUT', 10)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'WEATHER_CACHE_TTL', 300)
+
+    @property
+    def stale_while_revalidate(self):
+        return getattr(settings, 'WEATHER_STALE_WHILE_REVALIDATE', 300)
+
+    @property
+    def stale_if_error(self):
+        return getattr(settings, 'WEATHER_STALE_IF_ERROR', 3600)
+
+    @property
+    def retry_after(self):
+        return getattr(settings, 'WEATHER_RETRY_AFTER', 30)
+
+    @property
+    def max_entries(self):
+        return getattr(settings, 'WEATHER_CACHE_MAX_ENTRIES', 256)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._failures.clear()
+
+    def get(self, city):
+        """
+        Return ``(data, state)`` for ``city``, where state is one of
+        ``HIT``, ``MISS`` or ``STALE``.
+
+        Raises WeatherUpstreamError when there is nothing cached that may
+        still be served and the upstream request fails.
+        """
+        now = time.time()
+        entry, state = self._lookup(city, now)
+        if state == self.HIT:
+            return entry[0], state
+        error = self._backing_off(city, now)
+        if state == self.STALE:
+            if error is None:
+                self._fetch(city, background=True)
+            return entry[0], state
+        if error is not None:
+            return self._stale_if_error(entry, now, error)
+
+        try:
+            return self._fetch(city), self.MISS
+        except WeatherUpstreamError as e:
+            return self._stale_if_error(entry, now, e)
+
+    async def aget(self, city):
+        """
+        Async variant of get() for ASGI views
+        """
+        now = time.time()
+        entry, state = self._lookup(city, now)
+        if state == self.HIT:
+            return entry[0], state
+        error = self._backing_off(city, now)
+        if state == self.STALE:
+            if error is None:
+                # Revalidate in the background; nobody awaits the result
+                self._afetch(city)
+            return entry[0], state
+        if error is not None:
+            return self._stale_if_error(entry, now, error)
+
+        try:
+            # One waiter being cancelled must not cancel the shared request.
+            return await asyncio.shield(self._afetch(city)), self.MISS
+        except WeatherUpstreamError as e:
+            return self._stale_if_error(entry, now, e)
+
+    def _lookup(self, city, now):
+        """
+        Return ``(entry, state)``: HIT while fresh, STALE while it may be
+        served during revalidation, otherwise None
+        """
+        entry = self._entries.get(city)
+        if entry is None:
+            return None, None
+        age = now - entry[1]
+        if age < self.ttl:
+            return entry, self.HIT
+        if age < self.ttl + self.stale_while_revalidate:
+            return entry, self.STALE
+        return entry, None
+
+    def _backing_off(self, city, now):
+        """
+        Return a WeatherUpstreamError while ``city`` failed less than
+        WEATHER_RETRY_AFTER seconds ago, otherwise None
+        """
+        failure = self._failures.get(city)
+        if failure is None or now - failure[1] >= self.retry_after:
+            return None
+        return WeatherUpstreamError(failure[0])
+
+    def _record_failure(self, city, error):
+        with self._lock:
+            failures = self._failures
+            failures.pop(city, None)
+            failures[city] = (str(error), time.time())
+            while len(failures) > self.max_entries:
+                del failures[next(iter(failures))]
+
+    def _stale_if_error(self, entry, now, error):
+        if entry is not None and now - entry[1] < self.ttl + self.stale_if_error:
+            return entry[0], self.STALE
+        raise error
+
+    def _fetch(self, city, background=False):
+        """
+        Fetch ``city`` from upstream, joining a request already in flight
+        """
+        with self._lock:
+            flight = self._inflight.get(city)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[city] = _Flight()
+
+        if background:
+            if leader:
+                threading.Thread(
+                    target=self._run_flight,
+                    args=(city, flight),
+                    name=f'weather-refresh-{city}',
+                    daemon=True,
+                ).start()
+            return None
+
+        if leader:
+            self._run_flight(city, flight)
+        else:
+            # Bounded by the leader's own request timeout.
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _run_flight(self, city, flight):
+        try:
+            with timed('weather'):
+                flight.result = self._request(city)
+            self._store(city, flight.result)
+        except WeatherUpstreamError as e:
+            metrics.inc('upstream_errors_total', upstream='weather')
+            self._record_failure(city, e)
+            flight.error = e
+        finally:
+            with self._lock:
+                self._inflight.pop(city, None)
+            flight.done.set()
+
+    def _afetch(self, city):
+        """
+        Return the shared future for ``city``, joining an upstream request
+        already in flight on this event loop. Awaiting callers shield it.
+        """
+        loop = asyncio.get_running_loop()
+        future = self._ainflight.get(city)
+        if future is None or future.get_loop() is not loop:
+            future = self._ainflight[city] = loop.create_future()
+            # Background revalidations may finish with nobody awaiting them.
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            task = loop.create_task(self._arun_flight(city, future))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return future
+
+    async def _arun_flight(self, city, future):
+        try:
+            with timed('weather'):
+                data = await self._arequest(city)
+            self._store(city, data)
+            future.set_result(data)
+        except Exception as e:
+            metrics.inc('upstream_errors_total', upstream='weather')
+            self._record_failure(city, e)
+            future.set_exception(e)
+        finally:
+            if self._ainflight.get(city) is future:
+                del self._ainflight[city]
+
+    async def _arequest(self, city):
+        import httpx  # async views only; see config/asgi.py
+
+        try:
+            response = await async_http_client.get(self.url.format(city=quote(city)), timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            raise WeatherUpstreamError(str(e))
+        except ValueError as e:
+            raise WeatherUpstreamError(f'Invalid weather response: {str(e)}')
+
+    def _request(self, city):
+        try:
+            response = http_client.get(self.url.format(city=quote(city)), timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            raise WeatherUpstreamError(str(e))
+        except ValueError as e:
+            raise WeatherUpstreamError(f'Invalid weather response: {str(e)}')
+
+    def _store(self, city, data):
+        with self._lock:
+            entries = self._entries
+            entries.pop(city, None)
+            entries[city] = (data, time.time())
+            self._failures.pop(city, None)
+            # Cities come from the URL; keep the cache bounded.
+            while len(entries) > self.max_entries:
+                del entries[next(iter(entries))]
+
+
+weather_cache = WeatherCache()
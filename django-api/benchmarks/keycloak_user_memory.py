@@ -0,0 +1,100 @@
+"""
+Memory benchmark: KeycloakUser objects for N concurrent identities.
+
+Compares the original eager user class (eight attributes copied into an
+instance __dict__ per request) with the slotted, lazy KeycloakUser, using
+tracemalloc to measure the memory retained while N users are alive and the
+number of allocations made constructing them. Payloads are built up front and
+shared, as they are when served from the verified-token cache.
+
+    python benchmarks/keycloak_user_memory.py [--identities 10000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from api.authentication import KeycloakUser  # noqa: E402
+
+
+class EagerKeycloakUser:
+    """The original KeycloakUser, kept here as the baseline"""
+    def __init__(self, token_payload):
+        self.token_payload = token_payload
+        self.username = token_payload.get('preferred_username', '')
+        self.email = token_payload.get('email', '')
+        self.first_name = token_payload.get('given_name', '')
+        self.last_name = token_payload.get('family_name', '')
+        self.is_authenticated = True
+        self.is_active = True
+        self.is_anonymous = False
+        self.pk = token_payload.get('sub', '')
+        self.id = self.pk
+
+
+def make_payloads(count):
+    now = int(time.time())
+    return [
+        {
+            'exp': now + 300,
+            'iat': now,
+            'jti': f'jti-{i}',
+            'iss': 'https://keycloak.example/realms/master',
+            'sub': f'00000000-0000-0000-0000-{i:012d}',
+            'typ': 'Bearer',
+            'azp': 'customer-portal',
+            'preferred_username': f'user{i}',
+            'email': f'user{i}@example.com',
+            'given_name': f'Given{i}',
+            'family_name': f'Family{i}',
+            'realm_access': {'roles': ['offline_access', 'uma_authorization', f'default-roles-{i % 7}']},
+            'resource_access': {'account': {'roles': ['manage-account', 'view-profile']}},
+        }
+        for i in range(count)
+    ]
+
+
+def measure(label, user_class, payloads):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    snapshot_before = tracemalloc.take_snapshot()
+    users = [user_class(payload) for payload in payloads]
+    # Touch the attributes a view reads, as user_profile does.
+    for user in users:
+        user.username, user.email, user.pk
+    after, _ = tracemalloc.get_traced_memory()
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocations = sum(
+        stat.count_diff for stat in snapshot_after.compare_to(snapshot_before, 'filename')
+        if stat.count_diff > 0
+    )
+    retained = after - before
+    count = len(users)
+    print(f'{label:<28} {retained / 1024:>9.0f} KiB retained  {retained / count:>6.0f} B/user  '
+          f'{allocations / count:>5.1f} allocs/user')
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--identities', type=int, default=10000)
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.identities)
+    print(f'{args.identities} concurrent identities')
+    measure('eager (original)', EagerKeycloakUser, payloads)
+    measure('slotted, lazy', KeycloakUser, payloads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Startup time and requests/sec of the development and production run modes.
+
+Each mode is started through docker-entrypoint.sh, as in the container:
+
+- dev       migrate + collectstatic + runserver (the previous behaviour)
+- stateful  DJANGO_SERVER=gunicorn with the full Django stack (admin,
+            sessions, CSRF, auth middleware, SQLite), migrations skipped
+- gunicorn  DJANGO_SERVER=gunicorn, stateless profile (the default)
+- asgi      DJANGO_SERVER=asgi, stateless profile (the default)
+
+Startup time is measured from spawning the entrypoint to the first answer
+from /api/health/. Throughput is measured on /api/profile/ with a valid token
+(JWKS served by a local stub), so authentication is exercised.
+
+    python benchmarks/server_profiles.py [--concurrency 50] [--seconds 10]
+
+Needs bash, gunicorn and uvicorn installed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from wsgi_vs_asgi import PROJECT_DIR, free_port, make_token_and_jwks, wait_for
+
+
+MODES = {
+    'dev': {'DJANGO_SERVER': 'runserver', 'DJANGO_MIGRATE': '1', 'DJANGO_COLLECTSTATIC': '1'},
+    'stateful': {'DJANGO_SERVER': 'gunicorn', 'DJANGO_API_STATELESS': '0', 'DJANGO_MIGRATE': '0',
+                 'DJANGO_COLLECTSTATIC': 'auto'},
+    'gunicorn': {'DJANGO_SERVER': 'gunicorn', 'DJANGO_MIGRATE': '0', 'DJANGO_COLLECTSTATIC': 'auto'},
+    'asgi': {'DJANGO_SERVER': 'asgi', 'DJANGO_MIGRATE': '0', 'DJANGO_COLLECTSTATIC': 'auto'},
+}
+
+
+def start(mode, port, upstream):
+    env = {name: value for name, value in os.environ.items() if name not in ('DEBUG', 'DJANGO_API_STATELESS')}
+    env.update(
+        DJANGO_SETTINGS_MODULE='config.settings',
+        DJANGO_BIND=f'127.0.0.1:{port}',
+        KEYCLOAK_CERT_URL=f'{upstream}/certs',
+        GUNICORN_LOGLEVEL='warning',
+        **MODES[mode],
+    )
+    # Own process group: runserver's autoreloader forks a child process.
+    return subprocess.Popen(
+        ['bash', 'docker-entrypoint.sh'],
+        cwd=PROJECT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def stop(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+async def load(base_url, token, concurrency, seconds):
+    latencies = []
+    errors = 0
+    headers = {'Authorization': f'Bearer {token}'}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=30) as client:
+        await client.get('/api/profile/')  # JWKS fetch, token verification
+        deadline = time.perf_counter() + seconds
+
+        async def user():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    ok = (await client.get('/api/profile/')).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=int, default=50, help='simultaneous clients')
+    parser.add_argument('--seconds', type=float, default=10.0, help='duration of each load run')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    token, jwks = make_token_and_jwks()
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(jwks, f)
+    stub_port = free_port()
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(PROJECT_DIR, 'benchmarks', 'wsgi_vs_asgi.py'),
+        '--stub', str(stub_port), f.name,
+    ])
+    upstream = f'http://127.0.0.1:{stub_port}'
+    try:
+        wait_for(f'{upstream}/certs')
+        print(f'{"mode":<9} {"startup":>9} {"req/s":>9} {"p50":>9} {"p99":>9}  errors')
+        for mode in args.modes:
+            port = free_port()
+            base_url = f'http://127.0.0.1:{port}'
+            started = time.perf_counter()
+            process = start(mode, port, upstream)
+            try:
+                wait_for(f'{base_url}/api/health/', timeout=120)
+                startup = time.perf_counter() - started
+                latencies, errors, elapsed = asyncio.run(load(base_url, token, args.concurrency, args.seconds))
+            finally:
+                stop(process)
+            if len(latencies) < 2:
+                print(f'{mode:<9} {startup:>8.2f}s  no successful requests ({errors} errors)')
+                continue
+            quantiles = statistics.quantiles(latencies, n=100)
+            print(
+                f'{mode:<9} {startup:>8.2f}s {len(latencies) / elapsed:>9.1f}'
+                f' {quantiles[49] * 1000:>7.1f}ms {quantiles[98] * 1000:>7.1f}ms  {errors}'
+            )
+    finally:
+        stub.terminate()
+        stub.wait()
+        os.remove(f.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Load test: weather endpoint throughput under WSGI (gunicorn, sync DRF views)
+versus ASGI (uvicorn, async views) against a slow local upstream.
+
+A stub upstream serves the JWKS document and answers every weather request
+after --delay seconds. Each request asks for a different city so the weather
+cache never hits and every request waits on the upstream; the WSGI server can
+only hold as many of those waits as it has threads, the ASGI one as many as
+its event loop has open requests.
+
+    python benchmarks/wsgi_vs_asgi.py [--concurrency 200] [--seconds 10] [--delay 0.2]
+
+Needs gunicorn and uvicorn installed.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_token_and_jwks():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    public_jwk.update({'kid': 'bench', 'use': 'sig', 'alg': 'RS256'})
+    now = int(time.time())
+    token = jwt.encode(
+        {'sub': 'bench-user', 'preferred_username': 'bench', 'iat': now, 'exp': now + 3600},
+        private_key,
+        algorithm='RS256',
+        headers={'kid': 'bench'},
+    )
+    return token, {'keys': [public_jwk]}
+
+
+def run_stub(port, delay, jwks_path):
+    """Slow upstream: an asyncio HTTP/1.1 server, so it is never the bottleneck"""
+    with open(jwks_path) as f:
+        jwks = f.read().encode()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                path = request_line.split()[1]
+                if path == b'/certs':
+                    body = jwks
+                else:
+                    await asyncio.sleep(delay)
+                    body = b'{"temperature": "+31 \\u00b0C"}'
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: %d\r\n\r\n%s' % (len(body), body)
+                )
+                await writer.drain()
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_server(name, port, upstream, threads):
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE='config.settings',
+        KEYCLOAK_CERT_URL=f'{upstream}/certs',
+        WEATHER_API_URL=f'{upstream}/weather/{{city}}',
+    )
+    bind = f'127.0.0.1:{port}'
+    if name == 'wsgi':
+        env['DJANGO_API_ASYNC'] = '0'
+        command = [
+            sys.executable, '-m', 'gunicorn', 'config.wsgi:application',
+            '--bind', bind, '--workers', '1', '--threads', str(threads), '--log-level', 'warning',
+        ]
+    else:
+        command = [
+            sys.executable, '-m', 'uvicorn', 'config.asgi:application',
+            '--host', '127.0.0.1', '--port', str(port), '--workers', '1', '--log-level', 'warning',
+        ]
+    return subprocess.Popen(command, cwd=PROJECT_DIR, env=env)
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f'{url} did not come up')
+
+
+async def load(base_url, token, concurrency, seconds):
+    latencies = []
+    errors = 0
+    cities = itertools.count()
+    headers = {'Authorization': f'Bearer {token}'}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        # Warm up: JWKS fetch and token verification happen once per worker.
+        await client.get('/api/weather/warmup/')
+        deadline = time.perf_counter() + seconds
+
+        async def user():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(f'/api/weather/city-{next(cities)}/')
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def report(label, latencies, errors, elapsed):
+    if not latencies:
+        print(f'{label:<6} no successful requests ({errors} errors)')
+        return
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f'{label:<6} {len(latencies) / elapsed:>9.1f} req/s'
+        f'  p50 {quantiles[49] * 1000:>7.1f} ms'
+        f'  p95 {quantiles[94] * 1000:>7.1f} ms'
+        f'  p99 {quantiles[98] * 1000:>7.1f} ms'
+        f'  errors {errors}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=int, default=200, help='simultaneous clients')
+    parser.add_argument('--seconds', type=float, default=10.0, help='duration of each run')
+    parser.add_argument('--delay', type=float, default=0.2, help='upstream latency in seconds')
+    parser.add_argument('--threads', type=int, default=32, help='gunicorn threads for the WSGI run')
+    parser.add_argument('--stub', nargs=2, metavar=('PORT', 'JWKS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stub:
+        run_stub(int(args.stub[0]), args.delay, args.stub[1])
+        return
+
+    token, jwks = make_token_and_jwks()
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(jwks, f)
+    jwks_path = f.name
+
+    stub_port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--delay', str(args.delay), '--stub', str(stub_port), jwks_path]
+    )
+    upstream = f'http://127.0.0.1:{stub_port}'
+    try:
+        wait_for(f'{upstream}/certs')
+        print(f'{args.concurrency} clients, {args.seconds:.0f}s per run, upstream delay {args.delay * 1000:.0f} ms')
+        for name in ('wsgi', 'asgi'):
+            port = free_port()
+            server = start_server(name, port, upstream, args.threads)
+            try:
+                base_url = f'http://127.0.0.1:{port}'
+                wait_for(f'{base_url}/api/health/')
+                report(name, *asyncio.run(load(base_url, token, args.concurrency, args.seconds)))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+        os.remove(jwks_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Route the weather endpoints to the async views (api/async_views.py)
+os.environ.setdefault('DJANGO_API_ASYNC', '1')
 
-application = get_asgi_application()
\ No newline at end of file
+application = get_asgi_application()
+
+# WSGI workers never load httpx; the async views' client needs it, so import
+# it with the app rather than on the first request.
+import httpx  # noqa: E402,F401
\ No newline at end of file
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,7 +24,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-your-secret-key-here'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# The production run modes in docker-entrypoint.sh default DEBUG to 0; with
+# DEBUG on, Django also keeps every SQL query of a request in memory.
+DEBUG = os.environ.get('DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = ['*']
 
@@ -43,6 +46,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Liveness/readiness probes, answered before metrics, auth and the database
+    'api.health.HealthMiddleware',
+    # Next, so Server-Timing and the request histograms cover the whole chain
+    'api.metrics.MetricsMiddleware',
+    # Inert unless PROFILE_SAMPLE_RATE or PROFILE_HEADER is set
+    'api.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -142,5 +151,148 @@ CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 
 # Keycloak settings
-KEYCLOAK_URL = 'https://s02.iampm.online/realms/master'
-KEYCLOAK_CERT_URL = f'{KEYCLOAK_URL}/protocol/openid-connect/certs'
\ No newline at end of file
+KEYCLOAK_URL = os.environ.get('KEYCLOAK_URL', 'https://s02.iampm.online/realms/master')
+KEYCLOAK_CERT_URL = os.environ.get('KEYCLOAK_CERT_URL', f'{KEYCLOAK_URL}/protocol/openid-connect/certs')
+# JWKS key store: keys are cached per worker for KEYCLOAK_JWKS_CACHE_TTL seconds
+# (or the certs endpoint's Cache-Control max-age, clamped to the min/max TTL).
+# An unknown kid forces a refetch at most every KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL seconds.
+KEYCLOAK_JWKS_CACHE_TTL = 3600
+KEYCLOAK_JWKS_MIN_TTL = 60
+KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL = 30
+
+# Refresh the key set from a single background thread once it is within
+# KEYCLOAK_JWKS_REFRESH_AHEAD seconds of expiry, and keep validating against
+# expired keys for up to KEYCLOAK_JWKS_STALE_GRACE seconds while Keycloak is unreachable.
+KEYCLOAK_JWKS_BACKGROUND_REFRESH = True
+KEYCLOAK_JWKS_REFRESH_AHEAD = 60
+KEYCLOAK_JWKS_STALE_GRACE = 300
+
+# Verified-token cache: payloads of tokens that passed verification are reused
+# until exp - KEYCLOAK_TOKEN_CACHE_LEEWAY, but never for longer than
+# KEYCLOAK_TOKEN_CACHE_MAX_AGE seconds (bounds how long a revoked token keeps working).
+# KEYCLOAK_TOKEN_CACHE_MAX_BYTES caps the serialised size of the cached claims.
+KEYCLOAK_TOKEN_CACHE_ENABLED = True
+KEYCLOAK_TOKEN_CACHE_MAX_ENTRIES = 10000
+KEYCLOAK_TOKEN_CACHE_MAX_BYTES = 16 * 1024 * 1024
+KEYCLOAK_TOKEN_CACHE_MAX_AGE = 300
+KEYCLOAK_TOKEN_CACHE_LEEWAY = 30
+
+# JWT verification backend: 'pyjwt' (cryptography keys parsed once per key set)
+# or 'jose' (python-jose, the original implementation).
+KEYCLOAK_JWT_BACKEND = 'pyjwt'
+
+# Cross-worker cache: name a CACHES alias to share the JWKS document and the
+# verified-token claims between gunicorn workers (the in-process caches stay
+# in front as an L1). None keeps both caches per worker. For example:
+#   CACHES['keycloak'] = {
+#       'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#       'LOCATION': '/tmp/django-api-keycloak-cache',
+#   }
+#   KEYCLOAK_SHARED_CACHE = 'keycloak'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+KEYCLOAK_SHARED_CACHE = None
+KEYCLOAK_SHARED_CACHE_PREFIX = 'keycloak'
+# Claims kept for tokens served from the shared cache (what KeycloakUser reads);
+# reading any other claim of such a token verifies it again in that worker.
+KEYCLOAK_SHARED_CACHE_CLAIMS = (
+    'sub', 'preferred_username', 'email', 'given_name', 'family_name', 'exp', 'iat',
+)
+
+# Claims left out of KeycloakUser.token_payload (and so of /api/profile/), e.g.
+# ('realm_access', 'resource_access'). Views can still read them with
+# request.user.get_claim(name).
+KEYCLOAK_USER_OMIT_CLAIMS = ()
+
+# Weather API: responses are cached per city for WEATHER_CACHE_TTL seconds, then
+# served stale while one background refresh runs (WEATHER_STALE_WHILE_REVALIDATE)
+# or while the upstream is failing (WEATHER_STALE_IF_ERROR). After a failed
+# request the city is not fetched again for WEATHER_RETRY_AFTER seconds.
+WEATHER_API_URL = os.environ.get('WEATHER_API_URL', 'https://goweather.xyz/weather/{city}')
+WEATHER_API_TIMEOUT = 10
+WEATHER_CACHE_TTL = 300
+WEATHER_STALE_WHILE_REVALIDATE = 300
+WEATHER_STALE_IF_ERROR = 3600
+WEATHER_RETRY_AFTER = 30
+WEATHER_CACHE_MAX_ENTRIES = 256
+
+# Shared outbound HTTP client (api.http_client): keep-alive pool per host,
+# retries with backoff for idempotent requests that failed to connect or got a
+# 502/503/504 (not read timeouts), default timeout in seconds.
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 10
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.2
+HTTP_TIMEOUT = 10
+
+# Async HTTP client used by the async views (ASGI mode)
+HTTP_ASYNC_MAX_CONNECTIONS = 1000
+HTTP_ASYNC_MAX_KEEPALIVE = 100
+
+# Request metrics (api/metrics.py): per-phase latency histograms and counters
+# served unauthenticated on /metrics, and a Server-Timing header on every
+# response (it shows clients how long auth and upstream calls took; turn it
+# off with SERVER_TIMING=0 where that should stay internal).
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+
+# Request profiling (api/profiling.py): profile a PROFILE_SAMPLE_RATE fraction of
+# requests, and with PROFILE_HEADER=1 those carrying an X-Profile header signed
+# with PROFILE_SECRET (a dedicated key of 32+ characters, not SECRET_KEY;
+# without one the header is ignored). PROFILER is cprofile (.pstats) or stack
+# (sampled .collapsed stacks); results are aggregated per endpoint under PROFILE_DIR,
+# written every PROFILE_FLUSH_INTERVAL seconds, newest PROFILE_KEEP kept.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_HEADER = os.environ.get('PROFILE_HEADER', '0') == '1'
+PROFILE_HEADER_MAX_AGE = int(os.environ.get('PROFILE_HEADER_MAX_AGE', '3600'))
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+PROFILE_STACK_INTERVAL = float(os.environ.get('PROFILE_STACK_INTERVAL', '0.005'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_FLUSH_INTERVAL = int(os.environ.get('PROFILE_FLUSH_INTERVAL', '60'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '20'))
+
+# Worker warm-up (api/health.py): gunicorn workers fetch the Keycloak key set and
+# the weather of WARMUP_WEATHER_CITIES (comma-separated) before /readyz reports
+# them ready; failed steps are retried every WARMUP_RETRY_INTERVAL seconds.
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', '1') == '1'
+WARMUP_WEATHER_CITIES = [city for city in os.environ.get('WARMUP_WEATHER_CITIES', 'bangkok').split(',') if city]
+WARMUP_RETRY_INTERVAL = int(os.environ.get('WARMUP_RETRY_INTERVAL', '10'))
+
+# Serve the weather endpoints with async views. config/asgi.py turns this on,
+# so it follows the server type: runserver/gunicorn keep the DRF views.
+API_ASYNC_VIEWS = os.environ.get('DJANGO_API_ASYNC', '0') == '1'
+
+# Stateless profile (DJANGO_API_STATELESS=1, the default of the production run
+# modes in docker-entrypoint.sh): the API only ever authenticates bearer
+# tokens, so drop the admin, sessions, messages, CSRF and auth middleware and
+# the database. Requests never touch the ORM and workers boot without a
+# (writable) SQLite file; /admin/ and the browsable API are not served.
+API_STATELESS = os.environ.get('DJANGO_API_STATELESS', '0') == '1'
+
+if API_STATELESS:
+    INSTALLED_APPS = [
+        'rest_framework',
+        'corsheaders',
+        'api',
+    ]
+    MIDDLEWARE = [
+        'api.health.HealthMiddleware',
+        'api.metrics.MetricsMiddleware',
+        'api.profiling.ProfilingMiddleware',
+        'corsheaders.middleware.CorsMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'django.middleware.common.CommonMiddleware',
+    ]
+    TEMPLATES = []
+    DATABASES = {}
+    REST_FRAMEWORK = {
+        **REST_FRAMEWORK,
+        'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+        'DEFAULT_PARSER_CLASSES': ['rest_framework.parsers.JSONParser'],
+        # No django.contrib.auth: unauthenticated requests get request.user None
+        'UNAUTHENTICATED_USER': None,
+    }
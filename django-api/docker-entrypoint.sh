@@ -1,13 +1,49 @@
 #!/bin/bash
 
+# DJANGO_SERVER selects how the API is served:
+#   runserver (default)  Django development server
+#   gunicorn             production: gunicorn threaded workers (config.wsgi)
+#   asgi                 production: gunicorn with uvicorn workers (config.asgi,
+#                        async weather views, non-blocking upstream calls)
+# Worker/thread counts and other knobs are read in gunicorn.conf.py.
+DJANGO_SERVER="${DJANGO_SERVER:-runserver}"
+DJANGO_BIND="${DJANGO_BIND:-0.0.0.0:8000}"
+export DJANGO_SERVER DJANGO_BIND
+
+# Production modes run with DEBUG off and the stateless profile (no admin,
+# sessions or database; see API_STATELESS in config/settings.py) unless they
+# are set explicitly
+if [ "$DJANGO_SERVER" != "runserver" ]; then
+    export DEBUG="${DEBUG:-0}"
+    export DJANGO_API_STATELESS="${DJANGO_API_STATELESS:-1}"
+fi
+
 # Wait for database to be ready (if using external DB)
 # sleep 5
 
-# Run database migrations
-python manage.py migrate --noinput
+# The stateless profile has no database and no static files to collect
+if [ "${DJANGO_API_STATELESS:-0}" = "1" ]; then
+    DJANGO_MIGRATE=0
+    DJANGO_COLLECTSTATIC=0
+fi
+
+# Run database migrations (DJANGO_MIGRATE=0 skips them once they are applied)
+if [ "${DJANGO_MIGRATE:-1}" != "0" ]; then
+    python manage.py migrate --noinput
+fi
 
-# Collect static files
-python manage.py collectstatic --noinput --clear
+# Collect static files: DJANGO_COLLECTSTATIC=1 always, 0 never, auto (default)
+# only when STATIC_ROOT has not been populated yet
+DJANGO_COLLECTSTATIC="${DJANGO_COLLECTSTATIC:-auto}"
+if [ "$DJANGO_COLLECTSTATIC" = "1" ] || { [ "$DJANGO_COLLECTSTATIC" = "auto" ] && [ -z "$(ls -A staticfiles 2>/dev/null)" ]; }; then
+    python manage.py collectstatic --noinput
+fi
 
-# Start Django development server
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+case "$DJANGO_SERVER" in
+    gunicorn|asgi)
+        exec gunicorn -c gunicorn.conf.py
+        ;;
+    *)
+        exec python manage.py runserver "$DJANGO_BIND"
+        ;;
+esac
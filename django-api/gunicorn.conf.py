@@ -0,0 +1,54 @@
+"""
+gunicorn settings for the production run mode (see docker-entrypoint.sh).
+
+DJANGO_SERVER picks the worker class: ``gunicorn`` serves config.wsgi with
+threaded workers, ``asgi`` serves config.asgi with uvicorn workers (async
+weather views). Worker and thread counts follow the CPUs available to the
+container unless GUNICORN_WORKERS / GUNICORN_THREADS are set. Every worker
+warms its caches once it has forked (see api/health.py).
+"""
+import os
+
+
+def _cpu_count():
+    # Honours CPU affinity/cpusets, unlike os.cpu_count()
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+_asgi = os.environ.get('DJANGO_SERVER') == 'asgi'
+_cpus = _cpu_count()
+
+wsgi_app = 'config.asgi:application' if _asgi else 'config.wsgi:application'
+bind = os.environ.get('DJANGO_BIND', '0.0.0.0:8000')
+
+if _asgi:
+    # One event loop per core holds any number of upstream waits.
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    workers = int(os.environ.get('GUNICORN_WORKERS', _cpus))
+else:
+    # Requests mostly wait on Keycloak/the weather API, so threads overlap
+    # those waits while the processes use every core.
+    worker_class = 'gthread'
+    workers = int(os.environ.get('GUNICORN_WORKERS', 2 * _cpus + 1))
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import Django once in the master and fork workers from it: faster worker
+# boot and copy-on-write sharing of the loaded modules.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def post_worker_init(worker):
+    # In the worker, after the fork: caches and connections are per process
+    from api.health import warmup
+    warmup.start()
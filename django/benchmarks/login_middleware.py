@@ -0,0 +1,84 @@
+"""
+Microbenchmark: LoginRequiredMiddleware overhead per request, and the full
+middleware chain for exempt versus protected paths.
+
+The first table compares the previous exemption check (one ``re.match`` per
+LOGIN_EXEMPT_URLS pattern) with the compiled matcher. The second sends
+requests with a logged-in session cookie through the whole stack and counts
+database queries, using an in-memory SQLite database.
+
+    python benchmarks/login_middleware.py [--seconds 1]
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+settings.DEBUG = False  # production error pages, no query log growth
+django.setup()
+logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from config.middleware import compile_exempt_matcher  # noqa: E402
+
+
+PATHS = ['/static/vendor/mermaid.min.js', '/auth/callback/', '/loggedout', '/private', '/']
+
+
+def timed(fn, seconds):
+    fn()  # warm up
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            fn()
+        count += 100
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=1.0, help='duration of each run')
+    args = parser.parse_args()
+
+    patterns = settings.LOGIN_EXEMPT_URLS
+    legacy = [re.compile(p) for p in patterns]
+    is_exempt = compile_exempt_matcher(patterns)
+
+    print(f'{"exemption check":<34} {"regex list":>12} {"compiled":>12}')
+    for path in PATHS:
+        before = timed(lambda: any(p.match(path) for p in legacy), args.seconds / 4)
+        after = timed(lambda: is_exempt(path), args.seconds / 4)
+        print(f'{path:<34} {before * 1e9:>9.0f} ns {after * 1e9:>9.0f} ns')
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    client = Client()
+    client.force_login(get_user_model().objects.create(username='bench'))
+
+    print(f'\n{"full stack, logged-in cookie":<34} {"per request":>12} {"queries":>8}')
+    for path in PATHS:
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *rest: queries.append(sql) or execute(sql, *rest)):
+            client.get(path)
+        per_request = timed(lambda: client.get(path), args.seconds)
+        print(f'{path:<34} {per_request * 1e6:>9.1f} us {len(queries):>8}')
+
+
+if __name__ == '__main__':
+    main()
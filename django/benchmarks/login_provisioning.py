@@ -0,0 +1,120 @@
+"""
+Logins per second of the callback's user handling: the previous
+get_or_create + per-login last_login save versus config.provisioning.
+
+Each login provisions the user for one of --users subjects, calls
+``auth_login`` and saves the new session, as the callback does after the
+token exchange. Runs against a throwaway test database of the configured
+backend: a temporary SQLite file by default, Postgres when POSTGRES_HOST
+(and POSTGRES_DB/USER/PASSWORD/PORT) are set as for the app.
+
+    python benchmarks/login_provisioning.py [--users 1000] [--seconds 3]
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+database = None
+if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+    database = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+    settings.DATABASES['default']['TEST'] = {'NAME': database.name}
+settings.DEBUG = False
+django.setup()
+
+from django.contrib.auth import get_user_model, login as auth_login  # noqa: E402
+from django.contrib.auth.models import update_last_login  # noqa: E402
+from django.contrib.auth.signals import user_logged_in  # noqa: E402
+from django.contrib.sessions.backends.db import SessionStore  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from config import provisioning  # noqa: E402
+
+
+def previous_user(sub, username, email):
+    User = get_user_model()
+    try:
+        user, created = User.objects.get_or_create(username=username, defaults={'email': email})
+    except Exception:
+        user, created = User.objects.get_or_create(username=sub)
+    return user
+
+
+@contextlib.contextmanager
+def per_login_last_login():
+    """Django's default: save last_login on every login"""
+    user_logged_in.disconnect(provisioning._record_login, dispatch_uid='oidc_record_login')
+    user_logged_in.connect(update_last_login, dispatch_uid='update_last_login')
+    try:
+        yield
+    finally:
+        user_logged_in.disconnect(update_last_login, dispatch_uid='update_last_login')
+        user_logged_in.connect(provisioning._record_login, dispatch_uid='oidc_record_login')
+
+
+def run(get_user, subjects, seconds):
+    factory = RequestFactory()
+    queries = []
+
+    def login():
+        sub = random.choice(subjects)
+        request = factory.get('/auth/callback/')
+        request.session = SessionStore()
+        user = get_user(sub, f'user-{sub}', f'{sub}@example.com')
+        auth_login(request, user)
+        request.session.save()
+
+    with connection.execute_wrapper(lambda execute, sql, *rest: queries.append(sql) or execute(sql, *rest)):
+        count = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            login()
+            count += 1
+        provisioning.last_logins.flush()
+        elapsed = time.perf_counter() - started
+    return count / elapsed, len(queries) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1000, help='distinct subjects logging in')
+    parser.add_argument('--seconds', type=float, default=3.0, help='duration of each run')
+    args = parser.parse_args()
+
+    subjects = [f'{n:08x}' for n in range(args.users)]
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        vendor = connection.vendor
+        # Create every user first so both runs measure returning users
+        for sub in subjects:
+            previous_user(sub, f'user-{sub}', f'{sub}@example.com')
+
+        print(f'{"database":<11} {"provisioning":<26} {"logins/s":>9} {"queries/login":>14}')
+        with per_login_last_login():
+            rate, per_login = run(previous_user, subjects, args.seconds)
+        print(f'{vendor:<11} {"get_or_create, last_login":<26} {rate:>9.0f} {per_login:>14.2f}')
+        # Returning users within OIDC_USER_CACHE_TTL: the mapping is cached
+        for sub in subjects:
+            provisioning.users.provision(sub, f'user-{sub}', f'{sub}@example.com')
+        rate, per_login = run(provisioning.users.provision, subjects, args.seconds)
+        print(f'{vendor:<11} {"cached by sub, batched":<26} {rate:>9.0f} {per_login:>14.2f}')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if database is not None and os.path.exists(database.name):
+            os.remove(database.name)
+
+
+if __name__ == '__main__':
+    main()
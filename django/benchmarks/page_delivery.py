@@ -0,0 +1,92 @@
+"""
+Bytes on the wire and latency of the home, logged-out and private pages:
+uncompressed, compressed, and revalidated with If-None-Match (304).
+
+Requests go through the whole middleware stack with a logged-in session
+(tokens and claims as after a login), using an in-memory SQLite database.
+
+    python benchmarks/page_delivery.py [--seconds 1]
+"""
+import argparse
+import logging
+import os
+import secrets
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+settings.DEBUG = False
+django.setup()
+logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from config import pages  # noqa: E402
+from config.oidc_session import store_login  # noqa: E402
+from config.static_files import brotli  # noqa: E402
+
+
+PATHS = ['/', '/loggedout', '/private']
+
+TOKENS = {
+    'access_token': secrets.token_urlsafe(940),
+    'expires_in': 3600,
+    'refresh_token': secrets.token_urlsafe(490),
+    'refresh_expires_in': 7200,
+}
+USERINFO = {'sub': '6f1c1f7e', 'preferred_username': 'alice', 'email': 'alice@example.com', 'name': 'Alice Example'}
+
+
+def timed(fn, seconds):
+    fn()  # warm up
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(20):
+            fn()
+        count += 20
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=1.0, help='duration of each run')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    client = Client()
+    client.force_login(get_user_model().objects.create(username='bench'))
+    session = client.session
+    store_login(session, TOKENS, USERINFO)
+    session.save()
+    pages.warm()
+
+    variants = [('identity', {}), ('gzip', {'Accept-Encoding': 'gzip'})]
+    if brotli is not None:
+        variants.append(('br', {'Accept-Encoding': 'br, gzip'}))
+
+    print(f'{"page":<11} {"response":<10} {"status":>6} {"body":>9} {"latency":>11}')
+    for path in PATHS:
+        for label, headers in variants:
+            response = client.get(path, headers=headers)
+            per_request = timed(lambda: client.get(path, headers=headers), args.seconds / 4)
+            print(f'{path:<11} {label:<10} {response.status_code:>6} {len(response.content):>7} B {per_request * 1e6:>8.1f} us')
+        headers = dict(variants[-1][1], **{'If-None-Match': response['ETag']})
+        revalidated = client.get(path, headers=headers)
+        per_request = timed(lambda: client.get(path, headers=headers), args.seconds / 4)
+        print(f'{path:<11} {"304":<10} {revalidated.status_code:>6} {len(revalidated.content):>7} B {per_request * 1e6:>8.1f} us')
+
+
+if __name__ == '__main__':
+    main()
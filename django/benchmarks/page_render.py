@@ -0,0 +1,67 @@
+"""
+Microbenchmark: per-request render time of the home, logged-out and private
+pages, rebuilding everything per request (previous behaviour) versus the
+pre-rendered shells in config.pages.
+
+    python benchmarks/page_render.py [--seconds 2]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from config import pages  # noqa: E402
+
+
+USERINFO = {
+    'sub': '0f1c2d3e-4b5a-6978-8a9b-0c1d2e3f4a5b',
+    'preferred_username': 'alice',
+    'email': 'alice@example.com',
+    'email_verified': True,
+    'name': 'Alice Example',
+}
+ACCESS_TOKEN = 'eyJhbGciOiJSUzI1NiJ9.' + 'x' * 1200 + '.signature'
+
+
+def run(label, render, seconds):
+    render()  # warm up
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(20):
+            render()
+        count += 20
+    elapsed = time.perf_counter() - start
+    print(f'{label:<36} {elapsed / count * 1e6:>9.1f} us/request')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each run')
+    args = parser.parse_args()
+
+    def private_rebuilt():
+        prefix, suffix = pages.build_private_shell()
+        return prefix + pages.render_private_user(USERINFO, ACCESS_TOKEN).encode('utf-8') + suffix
+
+    run('index (anonymous), rebuilt', lambda: pages.build_index(False).encode('utf-8'), args.seconds)
+    run('index (anonymous), pre-rendered', lambda: pages.render_index(False), args.seconds)
+    run('index (logged in), rebuilt', lambda: pages.build_index(True).encode('utf-8'), args.seconds)
+    run('index (logged in), pre-rendered', lambda: pages.render_index(True), args.seconds)
+    run('loggedout, rebuilt', lambda: pages.build_loggedout().encode('utf-8'), args.seconds)
+    run('loggedout, pre-rendered', pages.render_loggedout, args.seconds)
+    run('private, rebuilt', private_rebuilt, args.seconds)
+    run('private, pre-rendered shell', lambda: pages.render_private(USERINFO, ACCESS_TOKEN), args.seconds)
+    run('private, ETag only (304)', lambda: pages.private_page(USERINFO, ACCESS_TOKEN).etag, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Session size and read/write time: the previous login payload versus the
+compact one, for each DJANGO_SESSION_STORE engine.
+
+The previous callback stored the whole token response, the ID token a second
+time, the userinfo claims and the leftover PKCE verifier and state. The
+compact payload is what config.oidc_session.store_login keeps. Session data
+is compressed, so tokens are random strings sized like Keycloak's RS256 JWTs
+(about 1.3 kB). The database is a temporary SQLite file and the cache is the
+in-process memory cache, so the numbers show serialization and storage cost
+without network round trips.
+
+    python benchmarks/session_storage.py [--seconds 1]
+"""
+import argparse
+import importlib
+import os
+import secrets
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+database = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+settings.DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': database.name}
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from config.oidc_session import store_login  # noqa: E402
+
+
+ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+}
+
+TOKENS = {
+    'access_token': secrets.token_urlsafe(940),
+    'expires_in': 300,
+    'refresh_expires_in': 1800,
+    'refresh_token': secrets.token_urlsafe(490),
+    'token_type': 'Bearer',
+    'id_token': secrets.token_urlsafe(975),
+    'not-before-policy': 0,
+    'session_state': '6f1c1f7e-5b52-4f44-9a55-2f0c1d6f9e1a',
+    'scope': 'openid email profile',
+}
+
+USERINFO = {
+    'sub': '6f1c1f7e-5b52-4f44-9a55-2f0c1d6f9e1a',
+    'email_verified': True,
+    'name': 'Alice Example',
+    'preferred_username': 'alice',
+    'given_name': 'Alice',
+    'family_name': 'Example',
+    'email': 'alice@example.com',
+}
+
+
+def previous_payload(session):
+    session['pkce_code_verifier'] = 'v' * 43
+    session['oidc_auth_state'] = 's' * 22
+    session['oidc_tokens'] = TOKENS
+    session['oidc_id_token'] = TOKENS['id_token']
+    session['oidc_userinfo'] = USERINFO
+    session['_auth_user_id'] = '1'
+    session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+    session['_auth_user_hash'] = 'h' * 64
+
+
+def compact_payload(session):
+    session['pkce_code_verifier'] = 'v' * 43
+    session['oidc_auth_state'] = 's' * 22
+    session['_auth_user_id'] = '1'
+    session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+    session['_auth_user_hash'] = 'h' * 64
+    store_login(session, TOKENS, USERINFO)
+
+
+def timed(fn, seconds):
+    fn()  # warm up
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(20):
+            fn()
+        count += 20
+    return (time.perf_counter() - start) / count
+
+
+def measure(store_class, fill, seconds):
+    def write():
+        session = store_class()
+        fill(session)
+        session.save()
+        return session.session_key
+
+    key = write()
+    size = len(store_class().encode(store_class(key).load()))
+
+    def read():
+        store_class(key).load()
+
+    return size, timed(write, seconds), timed(read, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=1.0, help='duration of each run')
+    args = parser.parse_args()
+
+    try:
+        call_command('migrate', verbosity=0)
+        print(f'{"engine":<10} {"payload":<9} {"stored":>9} {"write":>11} {"read":>11}')
+        for name, engine in ENGINES.items():
+            store_class = importlib.import_module(engine).SessionStore
+            for label, fill in (('previous', previous_payload), ('compact', compact_payload)):
+                size, write, read = measure(store_class, fill, args.seconds / 2)
+                print(f'{name:<10} {label:<9} {size:>7} B {write * 1e6:>8.1f} us {read * 1e6:>8.1f} us')
+    finally:
+        os.remove(database.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Worker startup time: how long a fresh process takes to be ready to serve.
+
+Each run starts a new interpreter that does what a gunicorn worker does
+before its first request (django.setup(), the WSGI application, the URLconf
+and the views it imports) and exits. Reports the median wall time against
+the target and, from one more run under ``-X importtime``, where the import
+time goes by top-level package; checks that modules imported on first use
+(requests and PyJWT, needed only for calls to Keycloak; markdown) stay out
+of the boot path.
+
+    python benchmarks/startup.py [--runs 10] [--target-ms TARGET]
+
+Exits with status 1 when the median is over the target or a deferred module
+was imported, so it can gate CI.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median worker-ready time to stay under, in milliseconds
+TARGET_MS = 600
+
+# Heavy modules imported on first use rather than at boot
+DEFERRED = {
+    'requests': 'HTTP client, imported with the first call to Keycloak',
+    'urllib3': 'imported by requests',
+    'jwt': 'PyJWT, only used to verify ID tokens at login',
+    'markdown': 'only used when the home page is first built',
+    'dotenv': 'config/env.py reads .env',
+}
+
+BOOT = {
+    'python': 'pass',
+    'wsgi': (
+        "import config.wsgi\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns\n"
+    ),
+}
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def boot(mode, importtime=False):
+    """
+    One worker boot; returns (wall seconds, stderr)
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='config.settings')
+    command = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', BOOT[mode]]
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - started, result.stderr
+
+
+def import_times(stderr):
+    """
+    Self import time in microseconds per top-level package
+    """
+    packages = defaultdict(int)
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            packages[match.group(4).split('.')[0]] += int(match.group(1))
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10, help='worker boots to measure')
+    parser.add_argument('--target-ms', type=float, default=TARGET_MS, help='median worker-ready time to stay under')
+    parser.add_argument('--top', type=int, default=12, help='packages to list')
+    args = parser.parse_args()
+    mode = 'wsgi'
+
+    boot(mode)  # warm the filesystem cache and bytecode
+    times = [boot(mode)[0] for _ in range(args.runs)]
+    interpreter = statistics.median(boot('python')[0] for _ in range(args.runs))
+    packages = import_times(boot(mode, importtime=True)[1])
+
+    median_ms = statistics.median(times) * 1000
+    print(f'{mode} worker ready: median {median_ms:.0f} ms, min {min(times) * 1000:.0f} ms'
+          f' over {args.runs} runs (target {args.target_ms:.0f} ms; bare interpreter {interpreter * 1000:.0f} ms)')
+    print(f'\n{"package":<28} {"import ms":>10}')
+    for package, total in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'{package:<28} {total / 1000:>10.1f}')
+
+    failed = median_ms > args.target_ms
+    for name, why in DEFERRED.items():
+        if name in packages:
+            print(f'\n{name} is imported at boot; it should load on first use ({why})')
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""
+The one place a local ``.env`` file is read.
+
+settings.py calls ``load_env()`` before reading any setting, so everything
+that reads ``os.environ`` afterwards (settings, the HTTP client, the pages)
+sees the file's values. Variables already set in the environment win. The
+file is parsed once per process; later calls are no-ops.
+"""
+import functools
+import os
+
+
+@functools.lru_cache(maxsize=None)
+def load_env(path):
+    """
+    Copy ``KEY=value`` lines of ``path`` into ``os.environ``; returns the
+    variables it set
+    """
+    loaded = {}
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return loaded
+    for raw in lines:
+        line = raw.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, val = line.split('=', 1)
+        key = key.strip().removeprefix('export ').strip()
+        val = val.strip().strip('"').strip("'")
+        # don't overwrite an already-set environment variable
+        if key and key not in os.environ:
+            os.environ[key] = loaded[key] = val
+    return loaded
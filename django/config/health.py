@@ -0,0 +1,173 @@
+"""
+Worker warm-up and the liveness/readiness probes.
+
+A fresh worker has no discovery document or signing keys in memory, no
+pooled connection to Keycloak and no pre-rendered pages, so whichever logins
+reach it first pay for all of that. ``warmup.start()`` runs the warm-up steps
+in a background thread instead: the URLconf and the views it imports, the
+discovery document (from OIDC_DISCOVERY_CACHE_FILE or Keycloak), the JWKS
+(which also opens the pooled connection to Keycloak; skipped when
+OIDC_LOCAL_ID_TOKEN is off) and the page shells in config.pages.
+gunicorn.conf.py starts it in every worker once it has forked; other servers
+start it on the first readiness probe. Steps that fail are retried every
+WARMUP_RETRY_INTERVAL seconds.
+
+HealthMiddleware answers the probes before anything else in the stack runs:
+no sessions, login requirement or database, and no entry in /metrics.
+
+- ``/healthz``  liveness: 200 whenever the process can answer
+- ``/readyz``   readiness: 200 once every step succeeded and the discovery
+  document and keys are still loaded, otherwise 503; lists each step's
+  outcome and duration
+
+With WARMUP_ENABLED off nothing is prefetched and ``/readyz`` answers like
+``/healthz``.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import get_resolver
+
+from . import pages
+from .id_token import jwks
+from .oidc_discovery import discovery
+
+
+logger = logging.getLogger(__name__)
+
+LIVENESS_PATH = '/healthz'
+READINESS_PATH = '/readyz'
+
+
+def _load_urls():
+    get_resolver().url_patterns
+
+
+def _load_discovery():
+    discovery.get()
+
+
+def _load_jwks():
+    if getattr(settings, 'OIDC_LOCAL_ID_TOKEN', True):
+        jwks.refresh()
+
+
+def _discovery_loaded():
+    return discovery.loaded
+
+
+def _jwks_loaded():
+    return jwks.loaded or not getattr(settings, 'OIDC_LOCAL_ID_TOKEN', True)
+
+
+# (name, step, check that its cache is still populated), in the order they run
+STEPS = (
+    ('urls', _load_urls, None),
+    ('discovery', _load_discovery, _discovery_loaded),
+    ('jwks', _load_jwks, _jwks_loaded),
+    ('pages', pages.warm, None),
+)
+
+
+class Warmup:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._thread = None
+        self.results = {}   # step name -> {'ok': bool, 'seconds': float[, 'error': str]}
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'WARMUP_ENABLED', True)
+
+    @property
+    def retry_interval(self):
+        return getattr(settings, 'WARMUP_RETRY_INTERVAL', 10)
+
+    def run(self):
+        """
+        Run the steps that have not succeeded yet, in this thread; returns
+        ready()
+        """
+        for name, step, check in STEPS:
+            if self._done(name, check):
+                continue
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.warning('Warm-up step %s failed: %s', name, e)
+                result = {'ok': False, 'error': str(e)}
+            else:
+                result = {'ok': True}
+            result['seconds'] = round(time.perf_counter() - started, 4)
+            self.results[name] = result
+        return self.ready()
+
+    def start(self):
+        """
+        Warm up in a background thread, unless one is running or the worker
+        is ready already
+        """
+        if not self.enabled or self.ready():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run_until_ready, name='warmup', daemon=True)
+            self._thread.start()
+
+    def _run_until_ready(self):
+        started = time.perf_counter()
+        while not self.run():
+            time.sleep(self.retry_interval)
+        logger.info('Worker %s warmed up in %.2fs', os.getpid(), time.perf_counter() - started)
+
+    def ready(self):
+        """
+        Whether every step ran and its cache is still populated
+        """
+        if not self.enabled:
+            return True
+        return all(self._done(name, check) for name, _, check in STEPS)
+
+    def _done(self, name, check):
+        # A cache warmed earlier can have been cleared since
+        return self.results.get(name, {}).get('ok', False) and (check is None or check())
+
+    def status(self):
+        return {'status': 'ready' if self.ready() else 'warming', 'checks': dict(self.results)}
+
+    def _reset_after_fork(self):
+        # A warm-up thread does not survive into a forked worker
+        self._thread = None
+
+
+warmup = Warmup()
+os.register_at_fork(after_in_child=warmup._reset_after_fork)
+
+
+class HealthMiddleware:
+    """Answer the liveness and readiness probes; first in MIDDLEWARE."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        path = request.path_info
+        if path == LIVENESS_PATH:
+            response = JsonResponse({'status': 'alive'})
+        elif path == READINESS_PATH:
+            warmup.start()
+            status = warmup.status()
+            response = JsonResponse(status, status=200 if status['status'] == 'ready' else 503)
+        else:
+            return self.get_response(request)
+        response['Cache-Control'] = 'no-store'
+        return response
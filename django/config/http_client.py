@@ -0,0 +1,202 @@
+"""
+Shared, pooled HTTP client for outbound calls (OIDC discovery, token
+exchange, userinfo).
+
+Module-level ``requests.get`` opens a new TCP (and TLS) connection per call.
+The client below keeps one ``requests.Session`` per process with a
+keep-alive connection pool per host, retries idempotent requests that
+could not connect or got a 502/503/504 with exponential backoff (never after
+a read timeout, so a slow upstream costs one timeout, not one per attempt),
+applies a default timeout, and counts connections created versus requests
+served so pool reuse can be monitored.
+
+Configured with HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_RETRIES,
+HTTP_RETRY_BACKOFF and HTTP_TIMEOUT.
+
+requests and urllib3 are imported with the first session, on the first
+outbound call, not when a worker boots: a worker serving logged-in pages may
+never need them.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .metrics import metrics
+
+
+def _timed_pool_classes(record_connection):
+    """
+    urllib3 pool classes whose connections report each new connection and
+    its setup time (TCP connect plus TLS handshake) to ``record_connection``
+    """
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def timed(connection_class):
+        class TimedConnection(connection_class):
+            def connect(self):
+                started = time.perf_counter()
+                super().connect()
+                record_connection(self.host, time.perf_counter() - started)
+        return TimedConnection
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = timed(HTTPConnection)
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = timed(HTTPSConnection)
+
+    return {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+def _pooled_adapter(record_connection, **kwargs):
+    """
+    A requests adapter whose pools use ``_timed_pool_classes``
+    """
+    from requests.adapters import HTTPAdapter
+
+    class PooledAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = pool_classes
+
+    pool_classes = _timed_pool_classes(record_connection)
+    return PooledAdapter(**kwargs)
+
+
+class _HostStats:
+    __slots__ = ('requests', 'connections', 'connect_time', 'connect_time_max')
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.connect_time = 0.0
+        self.connect_time_max = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'pool_hits': max(self.requests - self.connections, 0),
+            'pool_misses': self.connections,
+            'connect_time_total': self.connect_time,
+            'connect_time_max': self.connect_time_max,
+        }
+
+
+class PooledHTTPClient:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self._stats = defaultdict(_HostStats)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'HTTP_TIMEOUT', 10)
+
+    @property
+    def session(self):
+        session = self._session
+        if session is None:
+            with self._lock:
+                session = self._session
+                if session is None:
+                    session = self._session = self._build_session()
+        return session
+
+    def _build_session(self):
+        import requests
+        from urllib3.util.retry import Retry
+
+        retries = Retry(
+            total=getattr(settings, 'HTTP_RETRIES', 2),
+            backoff_factor=getattr(settings, 'HTTP_RETRY_BACKOFF', 0.2),
+            # A read timeout is not retried: the upstream got the request and
+            # is slow, so another attempt would only multiply the wait.
+            read=False,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # idempotent methods only
+            raise_on_status=False,
+        )
+        adapter = _pooled_adapter(
+            self._record_connection,
+            pool_connections=getattr(settings, 'HTTP_POOL_CONNECTIONS', 10),
+            pool_maxsize=getattr(settings, 'HTTP_POOL_MAXSIZE', 10),
+            max_retries=retries,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        Send a request through the shared session. ``timeout`` defaults to
+        HTTP_TIMEOUT; pass it explicitly for calls with their own budget.
+        """
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            self._stats[host].requests += 1
+        if timeout is None:
+            timeout = self.timeout
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _record_connection(self, host, seconds):
+        with self._lock:
+            stats = self._stats[host or '']
+            stats.connections += 1
+            stats.connect_time += seconds
+            stats.connect_time_max = max(stats.connect_time_max, seconds)
+
+    def stats(self):
+        """
+        Per-host request counts, pool hits/misses and connection setup time
+        """
+        with self._lock:
+            return {host: stats.as_dict() for host, stats in self._stats.items()}
+
+    def close(self):
+        """
+        Close pooled connections; the session is rebuilt on next use
+        """
+        with self._lock:
+            session, self._session = self._session, None
+            self._stats.clear()
+        if session is not None:
+            session.close()
+
+    def _reset_after_fork(self):
+        # Sockets inherited from a preloading parent must not be shared.
+        self._lock = threading.Lock()
+        self._session = None
+        self._stats = defaultdict(_HostStats)
+
+
+http_client = PooledHTTPClient()
+
+
+def _collect_metrics():
+    stats = http_client.stats()
+    return [
+        ('http_client_requests_total', 'counter', 'Outbound HTTP requests, by host',
+         [({'host': host}, s['requests']) for host, s in stats.items()]),
+        ('http_client_connections_total', 'counter', 'Connections opened by the pooled client (pool misses)',
+         [({'host': host}, s['pool_misses']) for host, s in stats.items()]),
+        ('http_client_connect_seconds_total', 'counter', 'Time the pooled client spent opening connections',
+         [({'host': host}, s['connect_time_total']) for host, s in stats.items()]),
+    ]
+
+
+metrics.add_collector(_collect_metrics)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=http_client._reset_after_fork)
@@ -0,0 +1,162 @@
+"""
+Local validation of the ID token returned by the token endpoint.
+
+The callback used to call the userinfo endpoint after every code exchange
+just to learn ``sub``, ``preferred_username`` and ``email``, which Keycloak
+already puts in the signed ID token. The token is verified here against the
+provider's keys (``jwks_uri`` from the discovery document, cached per
+process) and its iss/aud/exp/nonce checked, so a login costs one round-trip
+to Keycloak instead of two.
+
+PyJWT is imported on the first login, not when a worker boots.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .http_client import http_client
+from .metrics import metrics, timed
+from .oidc_discovery import discovery
+
+
+# Claims describing the token rather than the user; not shown as user claims
+PROTOCOL_CLAIMS = frozenset({
+    'iss', 'aud', 'exp', 'iat', 'nbf', 'jti', 'nonce', 'auth_time', 'azp', 'typ',
+    'at_hash', 'c_hash', 'acr', 'amr', 'sid', 'session_state',
+})
+
+# Asymmetric algorithms only: the key has to come from the JWKS
+ALGORITHMS = ('RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512', 'ES256', 'ES384', 'ES512')
+
+
+class IDTokenError(Exception):
+    """Raised when the ID token is invalid and the login must be rejected."""
+
+
+class JWKSError(Exception):
+    """Raised when the provider's keys cannot be fetched."""
+
+
+class JWKSCache:
+    """
+    The provider's signing keys indexed by ``kid``, refetched after
+    OIDC_JWKS_TTL seconds or when a token names an unknown ``kid`` (key
+    rotation), at most once every OIDC_JWKS_MIN_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._keys = {}
+        self._fetched_at = 0
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'OIDC_JWKS_TTL', 3600)
+
+    @property
+    def min_refresh_interval(self):
+        return getattr(settings, 'OIDC_JWKS_MIN_REFRESH_INTERVAL', 30)
+
+    @property
+    def loaded(self):
+        return bool(self._keys)
+
+    def get_key(self, kid):
+        """
+        Return the ``jwt.PyJWK`` for ``kid``, fetching the key set if needed
+        """
+        now = time.time()
+        key = self._keys.get(kid)
+        if key is not None and now - self._fetched_at < self.ttl:
+            return key
+        with self._lock:
+            key = self._keys.get(kid)
+            age = time.time() - self._fetched_at
+            if (key is None and age >= self.min_refresh_interval) or age >= self.ttl:
+                self._keys, self._fetched_at = self._fetch(), time.time()
+                key = self._keys.get(kid)
+        if key is None:
+            raise IDTokenError(f'unknown signing key {kid!r}')
+        return key
+
+    def refresh(self):
+        """
+        Fetch the key set now, e.g. while a new worker warms up
+        """
+        with self._lock:
+            self._keys, self._fetched_at = self._fetch(), time.time()
+
+    def _fetch(self):
+        import jwt
+
+        try:
+            with timed('jwks'):
+                r = http_client.get(discovery.get_endpoint('jwks_uri'), timeout=5)
+            r.raise_for_status()
+            keys = {}
+            for data in r.json().get('keys', []):
+                if data.get('use', 'sig') != 'sig' or data.get('alg', 'RS256') not in ALGORITHMS:
+                    continue
+                try:
+                    keys[data.get('kid')] = jwt.PyJWK(data)
+                except jwt.PyJWTError:
+                    continue
+        except Exception as e:
+            metrics.inc('upstream_errors_total', upstream='jwks')
+            raise JWKSError(f'Failed to fetch JWKS: {e}') from e
+        if not keys:
+            raise JWKSError('JWKS contains no usable signing keys')
+        return keys
+
+
+jwks = JWKSCache()
+
+
+def verify_id_token(id_token, nonce):
+    """
+    Verify the signature, issuer, audience, expiry and nonce of ``id_token``
+    and return its claims. Raises IDTokenError when the token is invalid and
+    JWKSError when the keys cannot be fetched.
+    """
+    import jwt
+
+    try:
+        header = jwt.get_unverified_header(id_token)
+    except jwt.PyJWTError as e:
+        raise IDTokenError(f'malformed ID token: {e}') from e
+    if header.get('alg') not in ALGORITHMS:
+        raise IDTokenError(f"unsupported algorithm {header.get('alg')!r}")
+
+    key = jwks.get_key(header.get('kid'))
+    client_id = settings.OIDC_RP_CLIENT_ID
+    try:
+        with timed('id_token'):
+            claims = jwt.decode(
+                id_token,
+                key.key,
+                algorithms=[header['alg']],
+                audience=client_id,
+                issuer=discovery.get_endpoint('issuer'),
+                leeway=getattr(settings, 'OIDC_ID_TOKEN_LEEWAY', 30),
+                options={'require': ['exp', 'iat', 'iss', 'aud', 'sub'], 'verify_aud': bool(client_id)},
+            )
+    except jwt.PyJWTError as e:
+        raise IDTokenError(str(e)) from e
+
+    if claims.get('nonce') != nonce:
+        raise IDTokenError('nonce mismatch')
+    # With several audiences the token must have been issued to us
+    if isinstance(claims['aud'], list) and len(claims['aud']) > 1 and claims.get('azp') != client_id:
+        raise IDTokenError('azp does not match the client id')
+    return claims
+
+
+def user_claims(claims):
+    """
+    The claims about the user, as the userinfo endpoint would return them
+    """
+    return {k: v for k, v in claims.items() if k not in PROTOCOL_CLAIMS}
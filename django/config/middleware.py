@@ -3,25 +3,56 @@ from django.shortcuts import redirect
 from django.conf import settings
 
 
+_REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+def compile_exempt_matcher(patterns):
+    """Compile LOGIN_EXEMPT_URLS into one ``match(path) -> bool`` callable.
+
+    Patterns that are plain anchored prefixes (``^/static/``) are checked with a
+    single ``str.startswith`` over a tuple; any remaining regexes are joined into
+    one alternation, so a request costs at most one prefix check and one regex
+    match however many exemptions are configured.
+    """
+    prefixes = []
+    regexes = []
+    for pattern in patterns:
+        literal = pattern[1:] if pattern.startswith('^') else None
+        if literal and not _REGEX_METACHARACTERS.intersection(literal):
+            prefixes.append(literal)
+        else:
+            regexes.append(pattern)
+
+    prefixes = tuple(prefixes)
+    combined = re.compile('|'.join(f'(?:{p})' for p in regexes)).match if regexes else None
+
+    if combined is None:
+        return lambda path: path.startswith(prefixes)
+    return lambda path: path.startswith(prefixes) or combined(path) is not None
+
+
 class LoginRequiredMiddleware:
     """Middleware that requires a user to be authenticated to access any page.
 
     Exemptions can be configured via settings.LOGIN_EXEMPT_URLS (list of regex strings).
     The login URL is taken from settings.LOGIN_URL.
+
+    The exemption check runs before ``request.user`` is touched. Sessions and
+    users are loaded lazily, so requests for exempt paths never query the
+    session or user tables.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
         patterns = getattr(settings, 'LOGIN_EXEMPT_URLS', [])
-        # compile regex patterns once
-        self.exempt = [re.compile(p) for p in patterns]
+        # compile patterns once into a single matcher
+        self.is_exempt = compile_exempt_matcher(patterns)
 
     def __call__(self, request):
         # Allow if path matches any exempt pattern
         path = request.path_info
-        for p in self.exempt:
-            if p.match(path):
-                return self.get_response(request)
+        if self.is_exempt(path):
+            return self.get_response(request)
 
         # Allow authenticated users
         if getattr(request, 'user', None) and request.user.is_authenticated:
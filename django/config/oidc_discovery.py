@@ -0,0 +1,190 @@
+"""
+Lazily loaded, disk-persisted OpenID Connect discovery document.
+
+settings.py used to fetch ``/.well-known/openid-configuration`` at import
+time, so every worker boot and every management command waited on Keycloak
+(up to 5 s per URL when it was slow). The store below fetches the document
+on first use and persists it to OIDC_DISCOVERY_CACHE_FILE, so later processes
+start from the cached copy without any network call. Once the document is
+older than OIDC_DISCOVERY_TTL seconds it is still served while one background
+thread refreshes it.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from .http_client import http_client
+from .metrics import metrics, timed
+
+
+logger = logging.getLogger(__name__)
+
+WELL_KNOWN_PATH = '/.well-known/openid-configuration'
+
+
+class DiscoveryError(Exception):
+    """Raised when no discovery document is cached and Keycloak cannot be reached."""
+
+
+def discovery_urls(endpoint):
+    """
+    URLs to try for ``endpoint``, which may be the issuer or the full
+    discovery URL
+    """
+    url = endpoint.rstrip('/')
+    if url.endswith(WELL_KNOWN_PATH):
+        return [url]
+    return [url + WELL_KNOWN_PATH, url]
+
+
+class DiscoveryStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Forget the in-memory document; the next access reloads it
+        """
+        self._document = None
+        self._fetched_at = 0
+        self._retry_at = 0
+        self._refreshing = False
+
+    @property
+    def endpoint(self):
+        return getattr(settings, 'OIDC_OP_DISCOVERY_ENDPOINT', None)
+
+    @property
+    def cache_file(self):
+        return getattr(settings, 'OIDC_DISCOVERY_CACHE_FILE', None)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'OIDC_DISCOVERY_TTL', 3600)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'OIDC_DISCOVERY_TIMEOUT', 5)
+
+    @property
+    def loaded(self):
+        return self._document is not None
+
+    def get(self):
+        """
+        Return the discovery document, loading it on first use
+        """
+        document = self._document
+        if document is None:
+            with self._lock:
+                if self._document is None:
+                    self._load()
+                document = self._document
+        now = time.time()
+        if now - self._fetched_at >= self.ttl and now >= self._retry_at:
+            self._start_refresh()
+        return document
+
+    def get_endpoint(self, name):
+        """
+        Return one field of the document, e.g. ``token_endpoint``
+        """
+        return self.get().get(name)
+
+    def _load(self):
+        cached = self._read_cache()
+        if cached is not None:
+            self._document, self._fetched_at = cached
+            return
+        # Nothing on disk: this first request has to wait for Keycloak.
+        self._document, self._fetched_at = self._fetch()
+        self._write_cache()
+
+    def refresh(self):
+        """
+        Refetch the document from Keycloak and persist it
+        """
+        document, fetched_at = self._fetch()
+        with self._lock:
+            self._document, self._fetched_at = document, fetched_at
+            self._write_cache()
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name='oidc-discovery-refresh', daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except DiscoveryError as e:
+            # Keep serving the cached document; try again a little later.
+            logger.warning('OIDC discovery refresh failed: %s', e)
+            self._retry_at = time.time() + min(self.ttl, 60)
+        finally:
+            self._refreshing = False
+
+    def _fetch(self):
+        endpoint = self.endpoint
+        if not endpoint:
+            raise DiscoveryError('OIDC_OP_DISCOVERY_ENDPOINT (OAUTH_ISSUER) is not configured')
+        errors = []
+        for url in discovery_urls(endpoint):
+            try:
+                with timed('discovery'):
+                    r = http_client.get(url, timeout=self.timeout)
+                if r.ok:
+                    return r.json(), time.time()
+                errors.append(f'{url}: HTTP {r.status_code}')
+            except Exception as e:
+                errors.append(f'{url}: {e}')
+        metrics.inc('upstream_errors_total', upstream='discovery')
+        raise DiscoveryError('Failed to fetch OIDC discovery document (' + '; '.join(errors) + ')')
+
+    def _read_cache(self):
+        """
+        Return ``(document, fetched_at)`` from the cache file when it was
+        written for the configured endpoint, else None
+        """
+        path = self.cache_file
+        if not path:
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('endpoint') != self.endpoint or not isinstance(cached.get('document'), dict):
+                return None
+            return cached['document'], float(cached['fetched_at'])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def _write_cache(self):
+        path = self.cache_file
+        if not path:
+            return
+        cached = {'endpoint': self.endpoint, 'fetched_at': self._fetched_at, 'document': self._document}
+        try:
+            # Write to a temporary file and rename, so a concurrently booting
+            # worker never reads a half-written document.
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.oidc-discovery-')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(cached, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning('Could not write OIDC discovery cache %s: %s', path, e)
+
+
+discovery = DiscoveryStore()
@@ -0,0 +1,86 @@
+"""
+What the OIDC login keeps in the session, and for how long.
+
+The callback used to store the whole token response (access, refresh and ID
+tokens plus metadata) twice over and the userinfo claims, and left the PKCE
+verifier and state behind, so every page view deserialized several kilobytes
+of session data. Only the access token (shown on the private page), its
+expiry, the refresh token needed to renew it and the userinfo claims are kept
+now, and the session expires together with the tokens instead of after
+SESSION_COOKIE_AGE.
+"""
+import time
+
+from django.conf import settings
+
+
+TOKENS_KEY = 'oidc_tokens'
+USERINFO_KEY = 'oidc_userinfo'
+
+# Only needed between the login redirect and the callback
+LOGIN_KEYS = ('pkce_code_verifier', 'oidc_auth_state', 'oidc_nonce')
+
+
+def compact_tokens(tokens, now=None):
+    """
+    The fields of a token endpoint response that the views use, with
+    relative lifetimes turned into absolute timestamps
+    """
+    now = time.time() if now is None else now
+    compact = {'access_token': tokens.get('access_token')}
+    if tokens.get('expires_in'):
+        compact['expires_at'] = int(now + tokens['expires_in'])
+    if tokens.get('refresh_token'):
+        compact['refresh_token'] = tokens['refresh_token']
+        if tokens.get('refresh_expires_in'):
+            compact['refresh_expires_at'] = int(now + tokens['refresh_expires_in'])
+    return compact
+
+
+def session_lifetime(tokens):
+    """
+    Seconds the session stays useful: until the refresh token (or, without
+    one, the access token) expires, capped at SESSION_COOKIE_AGE
+    """
+    max_age = getattr(settings, 'SESSION_COOKIE_AGE', 1209600)
+    lifetime = tokens.get('refresh_expires_in') or tokens.get('expires_in')
+    if not lifetime:
+        return max_age
+    return max(1, min(int(lifetime), max_age))
+
+
+def store_login(session, tokens, userinfo):
+    """
+    Save a completed login in ``session`` and align its expiry with the tokens
+    """
+    for key in LOGIN_KEYS:
+        session.pop(key, None)
+    session[USERINFO_KEY] = userinfo
+    store_tokens(session, tokens)
+
+
+def store_tokens(session, tokens):
+    """
+    Save a token endpoint response (login or refresh) in ``session`` and
+    align the session expiry with it
+    """
+    compact = compact_tokens(tokens)
+    previous = get_tokens(session)
+    if 'refresh_token' not in compact and 'refresh_token' in previous:
+        # A refresh that did not rotate the refresh token: keep it, and the
+        # session expiry that goes with it
+        for key in ('refresh_token', 'refresh_expires_at'):
+            if key in previous:
+                compact[key] = previous[key]
+        session[TOKENS_KEY] = compact
+        return
+    session[TOKENS_KEY] = compact
+    session.set_expiry(session_lifetime(tokens))
+
+
+def get_tokens(session):
+    return session.get(TOKENS_KEY) or {}
+
+
+def get_userinfo(session):
+    return session.get(USERINFO_KEY) or {}
@@ -1,27 +1,40 @@
 import base64
 import hashlib
-import os
+import logging
 import secrets
 from urllib.parse import urlencode
 
 from django.conf import settings
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.shortcuts import redirect
-from django.contrib.auth import login as auth_login, get_user_model
+from django.contrib.auth import login as auth_login
 from django.urls import reverse
-import requests
-import json
-import html
 
-import dotenv
+from .http_client import http_client
+from .id_token import IDTokenError, JWKSError, user_claims, verify_id_token
+from .metrics import metrics, timed
+from .oidc_discovery import DiscoveryError, discovery
+from .oidc_session import get_userinfo, store_login
+from .provisioning import users
+from .token_refresh import current_tokens
+from . import pages
 
-dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
 
 
 def _base64url_encode(data: bytes) -> str:
     return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
 
 
+def _provider_unavailable(error):
+    return HttpResponse(f'OIDC provider unavailable: {error}', status=503)
+
+
+def _login_failed(reason, message):
+    metrics.inc('login_failures_total', reason=reason)
+    return HttpResponseBadRequest(message)
+
+
 def login_view(request):
     # generate PKCE code verifier and challenge
     code_verifier = _base64url_encode(secrets.token_bytes(32))
@@ -30,11 +43,16 @@ def login_view(request):
     request.session['pkce_code_verifier'] = code_verifier
 
     # Build authorization request
-    auth_endpoint = getattr(settings, 'OIDC_OP_AUTHORIZATION_ENDPOINT')
+    try:
+        auth_endpoint = discovery.get_endpoint('authorization_endpoint')
+    except DiscoveryError as e:
+        return _provider_unavailable(e)
     client_id = settings.OIDC_RP_CLIENT_ID
     redirect_uri = settings.OAUTH_REDIRECT_URI or request.build_absolute_uri(reverse('oidc_callback'))
     state = secrets.token_urlsafe(16)
     request.session['oidc_auth_state'] = state
+    nonce = secrets.token_urlsafe(16)
+    request.session['oidc_nonce'] = nonce
 
     params = {
         'response_type': 'code',
@@ -42,7 +60,7 @@ def login_view(request):
         'client_id': client_id,
         'redirect_uri': redirect_uri,
         'state': state,
-        'nonce': secrets.token_urlsafe(16),
+        'nonce': nonce,
         'code_challenge': code_challenge,
         'code_challenge_method': 'S256',
     }
@@ -53,21 +71,25 @@ def login_view(request):
 def callback_view(request):
     error = request.GET.get('error')
     if error:
-        return HttpResponseBadRequest(f"OIDC error: {error} - {request.GET.get('error_description')}")
+        return _login_failed('provider', f"OIDC error: {error} - {request.GET.get('error_description')}")
 
     code = request.GET.get('code')
     state = request.GET.get('state')
     if not code or state != request.session.get('oidc_auth_state'):
-        return HttpResponseBadRequest('Invalid OIDC response')
+        return _login_failed('state', 'Invalid OIDC response')
 
     # Exchange code for tokens using PKCE (send code_verifier)
-    token_endpoint = getattr(settings, 'OIDC_OP_TOKEN_ENDPOINT')
+    try:
+        token_endpoint = discovery.get_endpoint('token_endpoint')
+        userinfo_endpoint = discovery.get_endpoint('userinfo_endpoint')
+    except DiscoveryError as e:
+        return _provider_unavailable(e)
     client_id = settings.OIDC_RP_CLIENT_ID
     client_secret = settings.OIDC_RP_CLIENT_SECRET
     redirect_uri = settings.OAUTH_REDIRECT_URI or request.build_absolute_uri(reverse('oidc_callback'))
     code_verifier = request.session.get('pkce_code_verifier')
     if not code_verifier:
-        return HttpResponseBadRequest('Missing PKCE verifier in session')
+        return _login_failed('pkce', 'Missing PKCE verifier in session')
 
     data = {
         'grant_type': 'authorization_code',
@@ -80,44 +102,55 @@ def callback_view(request):
     if client_secret:
         data['client_secret'] = client_secret
 
-    r = requests.post(token_endpoint, data=data, timeout=10)
+    with timed('token'):
+        r = http_client.post(token_endpoint, data=data, timeout=10)
     if not r.ok:
-        return HttpResponseBadRequest(f'Token exchange failed: {r.status_code} {r.text}')
+        return _login_failed('token_exchange', f'Token exchange failed: {r.status_code} {r.text}')
 
     tokens = r.json()
 
-    # store tokens in session
-    request.session['oidc_tokens'] = tokens
-    request.session['oidc_id_token'] = tokens.get('id_token')
+    # Take the user claims from the ID token when it verifies locally and has
+    # them; the userinfo endpoint is only asked otherwise
+    userinfo = None
+    if getattr(settings, 'OIDC_LOCAL_ID_TOKEN', True) and tokens.get('id_token'):
+        try:
+            claims = verify_id_token(tokens['id_token'], request.session.get('oidc_nonce'))
+        except IDTokenError as e:
+            return _login_failed('id_token', f'Invalid ID token: {e}')
+        except (JWKSError, DiscoveryError) as e:
+            logger.warning('ID token not verified locally, using userinfo: %s', e)
+        else:
+            if claims.get('sub') and (claims.get('preferred_username') or claims.get('email')):
+                userinfo = user_claims(claims)
 
     # Fetch userinfo to get a stable identifier (sub) and preferred username/email
     access_token = tokens.get('access_token')
-    userinfo = {}
-    try:
-        if access_token and getattr(settings, 'OIDC_OP_USER_ENDPOINT', None):
-            r_ui = requests.get(settings.OIDC_OP_USER_ENDPOINT, headers={'Authorization': f'Bearer {access_token}'}, timeout=5)
-            if r_ui.ok:
-                userinfo = r_ui.json()
-    except Exception:
+    if userinfo is None:
         userinfo = {}
-
-    # persist userinfo into session for private pages
-    request.session['oidc_userinfo'] = userinfo
+        try:
+            if access_token and userinfo_endpoint:
+                with timed('userinfo'):
+                    r_ui = http_client.get(userinfo_endpoint, headers={'Authorization': f'Bearer {access_token}'}, timeout=5)
+                if r_ui.ok:
+                    userinfo = r_ui.json()
+                else:
+                    metrics.inc('upstream_errors_total', upstream='userinfo')
+        except Exception:
+            metrics.inc('upstream_errors_total', upstream='userinfo')
+            userinfo = {}
 
     sub = userinfo.get('sub') or tokens.get('id_token') or 'sso-user'
     preferred = userinfo.get('preferred_username') or userinfo.get('email') or sub
 
-    # Create or get a Django user and log them in properly
-    User = get_user_model()
-    try:
-        user, created = User.objects.get_or_create(username=preferred, defaults={'email': userinfo.get('email', '')})
-    except Exception:
-        # fallback: create a simple user with username=sub
-        user, created = User.objects.get_or_create(username=sub)
+    # Create or get a Django user (cached by sub) and log them in properly
+    user = users.provision(sub, preferred, userinfo.get('email', ''))
 
     # perform django login to set _auth_user_id correctly (integer PK)
     auth_login(request, user)
 
+    # keep only what the pages need; the session expires with the tokens
+    store_login(request.session, tokens, userinfo)
+
     return redirect('/')
 
 
@@ -131,48 +164,9 @@ def logout_view(request):
 
 
 def private_view(request):
-    # Require session 'oidc_tokens' to be present
-    if not request.session.get('oidc_tokens'):
+    # Require session 'oidc_tokens' to be present, renewing an expired access token
+    tokens = current_tokens(request.session)
+    if not tokens:
         return redirect(reverse('login') + f'?next={request.path}')
 
-    info = request.session.get('oidc_userinfo', {})
-    style = """
-    <style>
-    body{font-family:Inter, system-ui, -apple-system, 'Segoe UI', Roboto, 'Helvetica Neue', Arial; padding:32px; background:#f6f8fa}
-    .card{background:#fff;padding:24px;border-radius:10px;box-shadow:0 8px 24px rgba(15,23,42,0.06);max-width:900px;margin:12px auto}
-    .btn{display:inline-block;padding:10px 16px;color:#fff;border-radius:8px;text-decoration:none;font-weight:700}
-    .btn-orange{background:#ff7a18}
-    .btn-blue{background:#1976d2}
-    /* ghost button: match home page Back to Portal styling */
-    .btn-ghost{background:#e2e8f0;color:#0f1724;font-weight:600;border-radius:8px;padding:10px 16px;text-decoration:none}
-    pre{background:#0f1724;color:#e6edf3;padding:12px;border-radius:8px;overflow:auto}
-    /* token-block: ensure long tokens wrap nicely (handles no-space long strings) */
-    .token-block pre{background:#071226;color:#dbeefd;padding:12px;border-radius:8px;overflow:auto;white-space:pre-wrap;word-break:break-word;word-wrap:break-word;overflow-wrap:anywhere}
-    </style>
-    """
-
-    # Render the user claims as a JSON code block (escaped for HTML safety)
-    try:
-        pretty = json.dumps(info, indent=2, ensure_ascii=False)
-    except Exception:
-        pretty = str(info)
-    escaped = html.escape(pretty)
-
-    json_html = f"""
-    <pre style=\"background:#0f1724;color:#e6edf3;padding:12px;border-radius:8px;overflow:auto\"><code>{escaped}</code></pre>
-    """
-
-    # also show access token in a separate code block
-    tokens = request.session.get('oidc_tokens', {}) or {}
-    access_token = tokens.get('access_token')
-    if access_token:
-        access_escaped = html.escape(access_token)
-        access_html = f"""
-        <h3>Access token</h3>
-        <div class=\"token-block\"><pre><code>{access_escaped}</code></pre></div>
-        """
-    else:
-        access_html = "<p class=\"muted\">No access token present in session.</p>"
-
-    body = f"{style}<div class=\"card\"><h1>Protected page</h1><p>You successfully authenticated via SSO.</p><h3>User claims</h3>{json_html}{access_html}<p><a class=\"btn btn-orange\" href=\"/logout\">Logout</a> <a class=\"btn btn-blue\" style=\"margin-left:12px;\" href=\"/\">Home</a> <a class=\"btn btn-ghost\" style=\"margin-left:12px;\" href=\"http://{os.getenv('PORTAL_HOST', 'localhost')}:{os.getenv('PORTAL_PORT', '3000')}\">Back to Portal</a></p></div>"
-    return HttpResponse(body)
+    return pages.respond(request, pages.private_page(get_userinfo(request.session), tokens.get('access_token')))
@@ -0,0 +1,348 @@
+"""
+Pre-rendered HTML for the home, logged-out and private pages.
+
+The pages used to be rebuilt on every hit: ``inspect.getsource`` and
+``textwrap.dedent`` on two view functions, ``markdown.markdown``,
+``html.escape`` and a few kilobytes of inline CSS. None of that depends on
+the request, so each page variant is built once, on first use, and kept as
+encoded bytes. Only the private page has per-user parts (claims and access
+token); it is stored as a prefix and suffix around them.
+
+Responses carry a strong ETag of the page variant (for the private page, of
+the shell plus the access token's signature, so a matching If-None-Match is
+answered with 304 before the claims are even serialised) and are gzip or brotli
+compressed above PAGE_COMPRESS_MIN_SIZE bytes. Compressed bodies of the
+shared variants are cached with them.
+"""
+import gzip
+import hashlib
+import html
+import json
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+
+from .static_files import accepted_encodings, brotli
+
+
+HOME_STYLE = """
+    <style>
+    :root { --bg:#f6f8fa; --card:#ffffff; --accent:#1976d2; --orange:#ff7a18; --muted:#6b7280 }
+    body { margin:0;font-family:Inter,system-ui,-apple-system,'Segoe UI',Roboto,Helvetica,Arial;background:var(--bg);color:#0f1724 }
+    .hero { display:flex;align-items:center;justify-content:center;min-height:60vh;padding:3rem 1rem }
+    .card { background:var(--card);padding:2rem;border-radius:12px;box-shadow:0 12px 40px rgba(15,23,42,0.08);max-width:900px;width:100%;text-align:center }
+    h1 { margin:0;font-size:2.25rem;color:var(--accent) }
+    p.lead { color:#334155;margin:0.5rem 0 1.25rem }
+    .actions { display:flex;gap:0.75rem;justify-content:center;flex-wrap:wrap;margin-top:1rem }
+    .btn { display:inline-flex;align-items:center;justify-content:center;padding:10px 16px;border-radius:8px;text-decoration:none;color:#fff;font-weight:700;min-width:160px;cursor:pointer;border:none }
+    .btn-primary { background:linear-gradient(90deg,var(--accent),#42a5f5) }
+    .btn-accent { background:linear-gradient(90deg,#ff8a00,var(--orange)) }
+    .btn-ghost { background:#e2e8f0;color:#0f1724;font-weight:600;border-radius:8px;padding:10px 16px }
+    .btn-code { min-width:200px }
+    .code-wrapper { margin-top:1.5rem;text-align:left }
+    .code-wrapper pre { background:#0f1724;color:#e6edf3;padding:16px;border-radius:12px;overflow:auto;font-size:0.95rem;line-height:1.5 }
+    .code-wrapper h3 { margin:0 0 0.75rem;font-size:1.25rem;color:var(--accent) }
+    .muted { color:var(--muted) }
+    .footer { text-align:center;margin-top:1.25rem;color:var(--muted) }
+    </style>
+    """
+
+LOGGEDOUT_STYLE = """
+    <style>
+    :root { --bg:#f6f8fa; --card:#ffffff; --accent:#1976d2; --orange:#ff7a18; --muted:#6b7280 }
+    body { margin:0;font-family:Inter,system-ui,-apple-system,'Segoe UI',Roboto,Helvetica,Arial;background:var(--bg);color:#0f1724 }
+    .hero { display:flex;align-items:center;justify-content:center;min-height:60vh;padding:3rem 1rem }
+    .card { background:var(--card);padding:2rem;border-radius:12px;box-shadow:0 12px 40px rgba(15,23,42,0.08);max-width:900px;width:100%;text-align:center }
+    h1 { margin:0;font-size:2.25rem;color:var(--accent) }
+    p.lead { color:#334155;margin:0.5rem 0 1.25rem }
+    .actions { display:flex;gap:0.75rem;justify-content:center;flex-wrap:wrap;margin-top:1rem }
+    .btn { display:inline-flex;align-items:center;justify-content:center;padding:10px 16px;border-radius:8px;text-decoration:none;color:#fff;font-weight:700;min-width:160px }
+    .btn-primary { background:linear-gradient(90deg,var(--accent),#42a5f5) }
+    .btn-accent { background:linear-gradient(90deg,#ff8a00,var(--orange)) }
+    .btn-ghost { background:#e2e8f0;color:#0f1724;font-weight:600;border-radius:8px;padding:10px 16px }
+    .footer { text-align:center;margin-top:1.25rem;color:var(--muted) }
+    </style>
+    """
+
+PRIVATE_STYLE = """
+    <style>
+    body{font-family:Inter, system-ui, -apple-system, 'Segoe UI', Roboto, 'Helvetica Neue', Arial; padding:32px; background:#f6f8fa}
+    .card{background:#fff;padding:24px;border-radius:10px;box-shadow:0 8px 24px rgba(15,23,42,0.06);max-width:900px;margin:12px auto}
+    .btn{display:inline-block;padding:10px 16px;color:#fff;border-radius:8px;text-decoration:none;font-weight:700}
+    .btn-orange{background:#ff7a18}
+    .btn-blue{background:#1976d2}
+    /* ghost button: match home page Back to Portal styling */
+    .btn-ghost{background:#e2e8f0;color:#0f1724;font-weight:600;border-radius:8px;padding:10px 16px;text-decoration:none}
+    pre{background:#0f1724;color:#e6edf3;padding:12px;border-radius:8px;overflow:auto}
+    /* token-block: ensure long tokens wrap nicely (handles no-space long strings) */
+    .token-block pre{background:#071226;color:#dbeefd;padding:12px;border-radius:8px;overflow:auto;white-space:pre-wrap;word-break:break-word;word-wrap:break-word;overflow-wrap:anywhere}
+    </style>
+    """
+
+# Markdown content for home page (kept from previous content)
+HOME_MARKDOWN = """
+    This is a simple demo app that uses SSO (OpenID Connect) to protect pages.
+
+    - Click Login to authenticate via Keycloak.
+    - After login, visit the Protected page to view your user claims.
+    """
+
+TOGGLE_SCRIPT = """
+    <script>
+    (function(){
+        const btn = document.getElementById('show-code-btn');
+        const wrapper = document.getElementById('oidc-code-wrapper');
+        if (!btn || !wrapper) return;
+        btn.addEventListener('click', function(){
+            const isHidden = wrapper.style.display === 'none' || wrapper.getAttribute('aria-hidden') === 'true';
+            wrapper.style.display = isHidden ? 'block' : 'none';
+            wrapper.setAttribute('aria-hidden', isHidden ? 'false' : 'true');
+            btn.textContent = isHidden ? 'Hide OIDC Code' : 'Show OIDC Code';
+        });
+    })();
+    </script>
+    """
+
+# Marks where the per-user parts go in the private page shell
+_USER_SLOT = '\x00user\x00'
+
+_pages = {}
+
+# Content-Encodings offered for pages, best first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def _etag(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()[:32]
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+class Page:
+    """
+    A page variant: its body (built on first access when given ``render``),
+    strong ETag and compressed bodies
+    """
+
+    def __init__(self, body=None, etag=None, render=None, size_hint=None):
+        self._body = body
+        self._render = render
+        self.etag = etag or _etag(body)
+        self._size = len(body) if body is not None else size_hint
+        self._encoded = {}
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = self._render()
+        return self._body
+
+    def compressible(self):
+        size = self._size if self._size is not None else len(self.body)
+        return size >= getattr(settings, 'PAGE_COMPRESS_MIN_SIZE', 1024)
+
+    def encoded(self, encoding):
+        body = self._encoded.get(encoding)
+        if body is None:
+            body = self._encoded[encoding] = compress(self.body, encoding)
+        return body
+
+
+def respond(request, page):
+    """
+    200 with the best encoding the client accepts, or 304 when its
+    If-None-Match already names that representation
+    """
+    encoding = None
+    if page.compressible():
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding = next((e for e in ENCODINGS if e in accepted), None)
+    etag = f'"{page.etag}-{encoding}"' if encoding else f'"{page.etag}"'
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and {t.strip().removeprefix('W/') for t in if_none_match.split(',')} & {etag, '*'}:
+        response = HttpResponseNotModified()
+    elif encoding:
+        response = HttpResponse(page.encoded(encoding))
+        response['Content-Encoding'] = encoding
+    else:
+        response = HttpResponse(page.body)
+    response['ETag'] = etag
+    # Per-user pages: keep them out of shared caches, revalidate every time
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def portal_url():
+    return f"http://{os.getenv('PORTAL_HOST', 'localhost')}:{os.getenv('PORTAL_PORT', '3000')}"
+
+
+def _cached(key, build):
+    page = _pages.get(key)
+    if page is None:
+        # Building twice under a race is harmless; the result is identical.
+        page = _pages[key] = build()
+    return page
+
+
+def clear():
+    """
+    Drop the pre-rendered pages, e.g. after settings or sources changed
+    """
+    _pages.clear()
+
+
+def warm():
+    """
+    Build (and compress) every page variant now rather than on first request
+    """
+    for page in (index_page(False), index_page(True), loggedout_page()):
+        for encoding in ENCODINGS:
+            page.encoded(encoding)
+    _private_shell()
+
+
+def index_page(logged_in):
+    return _cached(('index', logged_in), lambda: Page(build_index(logged_in).encode('utf-8')))
+
+
+def loggedout_page():
+    return _cached('loggedout', lambda: Page(build_loggedout().encode('utf-8')))
+
+
+def private_page(userinfo, access_token):
+    """
+    The private page for one user; its ETag is known before it is rendered
+    """
+    prefix, suffix, shell_etag = _private_shell()
+    if access_token:
+        # The claims are stored with the tokens at login and the access token
+        # changes on every refresh, so its signature segment identifies both
+        fingerprint = access_token.rpartition('.')[2]
+    else:
+        fingerprint = json.dumps(userinfo, sort_keys=True, default=str)
+    return Page(
+        etag=_etag(shell_etag, fingerprint),
+        render=lambda: prefix + render_private_user(userinfo, access_token).encode('utf-8') + suffix,
+        # The shell alone is above the compression threshold
+        size_hint=len(prefix) + len(suffix),
+    )
+
+
+def _private_shell():
+    def build():
+        prefix, suffix = build_private_shell()
+        return prefix, suffix, _etag(prefix, suffix)
+    return _cached('private', build)
+
+
+def render_index(logged_in):
+    return index_page(logged_in).body
+
+
+def render_loggedout():
+    return loggedout_page().body
+
+
+def render_private(userinfo, access_token):
+    return private_page(userinfo, access_token).body
+
+
+def oidc_code_snippet():
+    """
+    Source of the login and callback views, as shown on the home page
+    """
+    import inspect
+    import textwrap
+
+    from . import oidc_views
+
+    try:
+        login_source = textwrap.dedent(inspect.getsource(oidc_views.login_view))
+        callback_source = textwrap.dedent(inspect.getsource(oidc_views.callback_view))
+        return f"# OIDC login flow in Django\n{login_source}\n{callback_source}"
+    except (OSError, TypeError):
+        return "# Unable to load OIDC code snippet dynamically."
+
+
+def build_index(logged_in):
+    import markdown
+
+    html_content = markdown.markdown(HOME_MARKDOWN)
+
+    # action buttons (use the same classes as dotnet)
+    if logged_in:
+        primary_actions = ["<a class=\"btn btn-primary\" href=\"/private\">Private</a>", "<a class=\"btn btn-accent\" href=\"/logout\">Logout</a>"]
+    else:
+        login_url = reverse('login')
+        primary_actions = [f"<a class=\"btn btn-accent\" href=\"{login_url}\">Login with SSO</a>"]
+
+    portal_button = f'<a class="btn btn-ghost" href="{portal_url()}" target="_top">Back to Portal</a>'
+    code_button = '<button class="btn btn-ghost btn-code" type="button" id="show-code-btn">Show OIDC Code</button>'
+
+    buttons_html = " ".join(primary_actions + [portal_button, code_button])
+
+    escaped_code = html.escape(oidc_code_snippet())
+    code_section = f"""
+    <div id="oidc-code-wrapper" class="code-wrapper" aria-hidden="true" style="display:none;">
+        <h3>OIDC integration code</h3>
+        <pre><code>{escaped_code}</code></pre>
+        <p class="muted">This snippet is pulled directly from <code>config/oidc_views.py</code> to show the actual login and callback implementation.</p>
+    </div>
+    """
+
+    return f"{HOME_STYLE}<main class='hero'><div class='card'><h1>Customer Portal — Django Sample</h1><p class='lead'>This is a Django sample demonstrating OIDC login and access token display.</p>{html_content}<div class='actions'>{buttons_html}</div>{code_section}<div class='footer'><small>Running in container — use this for development & testing only.</small></div></div>{TOGGLE_SCRIPT}</main>"
+
+
+def build_loggedout():
+    login_url = reverse('login')
+    return f"{LOGGEDOUT_STYLE}<main class='hero'><div class='card'><h1>Logged out</h1><p class='lead'>You have been successfully logged out.</p><div class='actions'><a class=\"btn btn-accent\" href=\"{login_url}\">Login again</a><a class=\"btn btn-ghost\" href=\"{portal_url()}\" target=\"_top\">Back to Portal</a></div><div class='footer'><small>Running in container — use this for development & testing only.</small></div></div></main>"
+
+
+def build_private_shell():
+    """
+    Return the private page as (prefix, suffix) bytes around the user claims
+    """
+    page = f"{PRIVATE_STYLE}<div class=\"card\"><h1>Protected page</h1><p>You successfully authenticated via SSO.</p><h3>User claims</h3>{_USER_SLOT}<p><a class=\"btn btn-orange\" href=\"/logout\">Logout</a> <a class=\"btn btn-blue\" style=\"margin-left:12px;\" href=\"/\">Home</a> <a class=\"btn btn-ghost\" style=\"margin-left:12px;\" href=\"{portal_url()}\">Back to Portal</a></p></div>"
+    prefix, suffix = page.split(_USER_SLOT)
+    return prefix.encode('utf-8'), suffix.encode('utf-8')
+
+
+def render_private_user(userinfo, access_token):
+    """
+    The per-user part of the private page: claims and access token
+    """
+    # Render the user claims as a JSON code block (escaped for HTML safety)
+    try:
+        pretty = json.dumps(userinfo, indent=2, ensure_ascii=False)
+    except Exception:
+        pretty = str(userinfo)
+    escaped = html.escape(pretty)
+
+    json_html = f"""
+    <pre style=\"background:#0f1724;color:#e6edf3;padding:12px;border-radius:8px;overflow:auto\"><code>{escaped}</code></pre>
+    """
+
+    # also show access token in a separate code block
+    if access_token:
+        access_escaped = html.escape(access_token)
+        access_html = f"""
+        <h3>Access token</h3>
+        <div class=\"token-block\"><pre><code>{access_escaped}</code></pre></div>
+        """
+    else:
+        access_html = "<p class=\"muted\">No access token present in session.</p>"
+
+    return json_html + access_html
@@ -0,0 +1,181 @@
+"""
+Django users for OIDC logins, cached by the Keycloak subject.
+
+Every login used to run ``User.objects.get_or_create`` and then let
+``auth_login`` save ``last_login``, i.e. a read and a write against the
+database per login, which serialized login peaks on it. The provisioner
+remembers, per ``sub``, which user the login maps to in the Django cache
+(Redis when REDIS_URL is set, so it is shared by the workers) and only goes
+to the database the first time a subject is seen or when its username or
+email changed. ``last_login`` updates are collected and written in batches.
+
+Users are still looked up by username in the database, so a renamed
+Keycloak account maps to a new Django user exactly as before.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import DatabaseError
+from django.db.models import Case, DateTimeField, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .metrics import metrics, timed
+
+
+logger = logging.getLogger(__name__)
+
+
+def _sub_key(sub):
+    return f'oidc-user:{sub}'
+
+
+def _id_key(user_id):
+    return f'oidc-user-sub:{user_id}'
+
+
+class UserProvisioner:
+    @property
+    def ttl(self):
+        return getattr(settings, 'OIDC_USER_CACHE_TTL', 3600)
+
+    def provision(self, sub, username, email):
+        """
+        Return the user to log in for subject ``sub``, creating it on first
+        sight. A cache hit returns an unsaved instance carrying just what
+        ``auth_login`` needs (pk and session auth hash).
+        """
+        entry = cache.get(_sub_key(sub)) if self.ttl else None
+        if entry is not None and entry['claims'] == (username, email):
+            metrics.inc('oidc_user_cache_requests_total', result='hit')
+            return self._cached_user(entry)
+
+        metrics.inc('oidc_user_cache_requests_total', result='miss')
+        with timed('provision'):
+            user = self._get_or_create(sub, username, email)
+        if self.ttl:
+            cache.set_many({
+                _sub_key(sub): {
+                    'claims': (username, email),
+                    'id': user.pk,
+                    'username': user.get_username(),
+                    'auth_hash': user.get_session_auth_hash(),
+                },
+                _id_key(user.pk): sub,
+            }, self.ttl)
+        return user
+
+    def _get_or_create(self, sub, username, email):
+        User = get_user_model()
+        try:
+            user, created = User.objects.get_or_create(username=username, defaults={'email': email})
+        except Exception:
+            # fallback: create a simple user with username=sub
+            user, created = User.objects.get_or_create(username=sub)
+        if not created and email and user.email != email:
+            user.email = email
+            user.save(update_fields=['email'])
+        return user
+
+    @staticmethod
+    def _cached_user(entry):
+        user = get_user_model()(pk=entry['id'], username=entry['username'])
+        auth_hash = entry['auth_hash']
+        user.get_session_auth_hash = lambda: auth_hash
+        return user
+
+    def forget(self, user_id):
+        """
+        Drop the cached mapping for ``user_id``, e.g. after the user changed
+        """
+        sub = cache.get(_id_key(user_id))
+        if sub is not None:
+            cache.delete_many([_sub_key(sub), _id_key(user_id)])
+
+
+class LastLoginBuffer:
+    """
+    ``last_login`` timestamps waiting to be written, one UPDATE per batch.
+
+    A batch is written once it holds OIDC_LAST_LOGIN_BATCH_SIZE users or its
+    oldest entry is OIDC_LAST_LOGIN_FLUSH_INTERVAL seconds old, checked on
+    each login and at the end of each request, and at process exit. With an
+    interval of 0 every login is written straight away, still as an UPDATE
+    that leaves the cached user alone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._since = None
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'OIDC_LAST_LOGIN_BATCH_SIZE', 100)
+
+    @property
+    def interval(self):
+        return getattr(settings, 'OIDC_LAST_LOGIN_FLUSH_INTERVAL', 30)
+
+    def record(self, user_id, when):
+        with self._lock:
+            self._pending[user_id] = when
+            if self._since is None:
+                self._since = time.monotonic()
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        since = self._since
+        if since is not None and (len(self._pending) >= self.batch_size or time.monotonic() - since >= self.interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._since = self._pending, {}, None
+        if not pending:
+            return
+        try:
+            get_user_model().objects.filter(pk__in=pending).update(last_login=Case(
+                *(When(pk=pk, then=Value(when)) for pk, when in pending.items()),
+                output_field=DateTimeField(),
+            ))
+        except DatabaseError as e:
+            logger.warning('Could not write last_login for %d users: %s', len(pending), e)
+
+
+users = UserProvisioner()
+last_logins = LastLoginBuffer()
+
+
+def _record_login(sender, user, **kwargs):
+    last_logins.record(user.pk, timezone.now())
+
+
+def _flush_if_due(**kwargs):
+    last_logins.flush_if_due()
+
+
+def _forget_user(sender, instance, update_fields=None, **kwargs):
+    # last_login is not part of the cached mapping
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    users.forget(instance.pk)
+
+
+# Any save (password, email, is_active...) or deletion invalidates the cached mapping
+post_save.connect(_forget_user, sender=settings.AUTH_USER_MODEL, dispatch_uid='oidc_forget_user_saved')
+post_delete.connect(_forget_user, sender=settings.AUTH_USER_MODEL, dispatch_uid='oidc_forget_user_deleted')
+
+# Replace Django's per-login save of last_login with the buffer
+user_logged_in.disconnect(update_last_login, dispatch_uid='update_last_login')
+user_logged_in.connect(_record_login, dispatch_uid='oidc_record_login')
+request_finished.connect(_flush_if_due, dispatch_uid='oidc_flush_last_login')
+atexit.register(last_logins.flush)
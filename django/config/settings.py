@@ -1,32 +1,17 @@
 import os
 from pathlib import Path
 
+from .env import load_env
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# A local .env file (development/docker) is loaded into the process
+# environment before anything reads it; see config/env.py.
+load_env(BASE_DIR / '.env')
+
 SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'dev-secret')
 DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
-# If a local .env file is mounted (common in development/docker), load it into
-# the process environment so settings that read os.environ[...] pick them up.
-env_path = BASE_DIR / '.env'
-if env_path.exists():
-    try:
-        for raw in env_path.read_text().splitlines():
-            line = raw.strip()
-            if not line or line.startswith('#'):
-                continue
-            if '=' not in line:
-                continue
-            key, val = line.split('=', 1)
-            key = key.strip()
-            val = val.strip().strip('"').strip("'")
-            # don't overwrite an already-set environment variable
-            if key and key not in os.environ:
-                os.environ[key] = val
-    except Exception:
-        # Best-effort loader; failing to parse the .env should not stop Django
-        pass
-
 ALLOWED_HOSTS = ['*']
 
 INSTALLED_APPS = [
@@ -39,7 +24,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Liveness/readiness probes, answered before metrics, sessions, login and the database
+    'config.health.HealthMiddleware',
+    # Next, so Server-Timing and the request histograms cover the whole chain
+    'config.metrics.MetricsMiddleware',
+    # Inert unless PROFILE_SAMPLE_RATE or PROFILE_HEADER is set
+    'config.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Collected static files are answered here, before sessions and auth
+    'config.static_files.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -54,6 +47,8 @@ LOGIN_EXEMPT_URLS = [
     r'^/loggedout',  # Add exempt page for post-logout landing
     r'^/static/',
     r'^/healthz',
+    r'^/readyz',
+    r'^/metrics$',
     r'^/admin',
 ]
 
@@ -96,12 +91,55 @@ else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'db.sqlite3',
+            'NAME': os.environ.get('DJANGO_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+
+# Cache: Redis when REDIS_URL is set (shared by all workers), else per-process memory.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            # Room for the per-user login entries (config/provisioning.py)
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('DJANGO_CACHE_MAX_ENTRIES', '10000'))},
         }
     }
 
+# Session storage (DJANGO_SESSION_STORE):
+#   db         database rows (default)
+#   cached_db  read from the cache, written through to the database
+#   cache      cache only; sessions vanish with the cache
+# cache and cached_db need a cache shared by all workers (REDIS_URL): with the
+# per-process memory cache a logout in one worker would not be seen by others.
+SESSION_STORE = os.environ.get('DJANGO_SESSION_STORE', 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+}[SESSION_STORE]
+# Upper bound only: a login session expires with its refresh token (config/oidc_session.py)
+SESSION_COOKIE_AGE = int(os.environ.get('DJANGO_SESSION_COOKIE_AGE', str(60 * 60 * 24 * 14)))
+
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATICFILES_DIRS = [BASE_DIR / 'static']
+# collectstatic writes content-hashed copies plus .gz/.br variants (config/static_files.py)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'config.static_files.CompressedManifestStaticFilesStorage'},
+}
+# Cache lifetime of static files requested by their original, unhashed name
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', '60'))
+
+# HTML pages (config/pages.py) at least this large are sent gzip/brotli compressed
+PAGE_COMPRESS_MIN_SIZE = int(os.environ.get('PAGE_COMPRESS_MIN_SIZE', '1024'))
 
 # Authentication / OIDC settings (read from environment variables)
 OIDC_RP_CLIENT_ID = os.environ.get('OAUTH_CLIENT_ID')
@@ -111,37 +149,72 @@ OIDC_OP_DISCOVERY_ENDPOINT = os.environ.get('OAUTH_ISSUER')
 # Redirect URI used in the OIDC flow (should match Keycloak client's Valid redirect URIs)
 OAUTH_REDIRECT_URI = os.environ.get('OAUTH_REDIRECT_URI')
 
-# If a discovery endpoint is provided, attempt to fetch the OpenID Connect configuration
-# and populate the specific endpoint settings required by mozilla-django-oidc.
-if OIDC_OP_DISCOVERY_ENDPOINT:
-    try:
-        import requests
-        disc_url = OIDC_OP_DISCOVERY_ENDPOINT.rstrip('/')
-        # If the value looks like the issuer (no /.well-known), try well-known first
-        if not disc_url.endswith('/.well-known/openid-configuration'):
-            try_urls = [disc_url + '/.well-known/openid-configuration', disc_url]
-        else:
-            try_urls = [disc_url]
-
-        discovery = None
-        for u in try_urls:
-            try:
-                r = requests.get(u, timeout=5)
-                if r.ok:
-                    discovery = r.json()
-                    break
-            except Exception:
-                continue
-
-        if discovery:
-            OIDC_OP_AUTHORIZATION_ENDPOINT = discovery.get('authorization_endpoint')
-            OIDC_OP_TOKEN_ENDPOINT = discovery.get('token_endpoint')
-            OIDC_OP_USER_ENDPOINT = discovery.get('userinfo_endpoint')
-            OIDC_OP_JWKS_ENDPOINT = discovery.get('jwks_uri')
-            OIDC_OP_ISSUER = discovery.get('issuer')
-    except Exception as e:
-        # Best-effort only — failure will be surfaced by mozilla-django-oidc later
-        print('Warning: failed to fetch OIDC discovery document:', str(e))
+# The discovery document is not fetched here: config.oidc_discovery loads it on
+# first use and persists it to OIDC_DISCOVERY_CACHE_FILE, so worker boots and
+# management commands never wait on Keycloak. Cached copies older than
+# OIDC_DISCOVERY_TTL seconds are refreshed in the background.
+OIDC_DISCOVERY_CACHE_FILE = os.environ.get('OIDC_DISCOVERY_CACHE_FILE', str(BASE_DIR / '.oidc-discovery.json'))
+OIDC_DISCOVERY_TTL = int(os.environ.get('OIDC_DISCOVERY_TTL', '3600'))
+OIDC_DISCOVERY_TIMEOUT = int(os.environ.get('OIDC_DISCOVERY_TIMEOUT', '5'))
+
+# Verify the ID token against the provider's JWKS (config/id_token.py) and take
+# the user claims from it; the userinfo endpoint is only called when that is
+# disabled, the keys cannot be fetched, or sub/username/email are missing.
+OIDC_LOCAL_ID_TOKEN = os.environ.get('OIDC_LOCAL_ID_TOKEN', '1') == '1'
+OIDC_JWKS_TTL = int(os.environ.get('OIDC_JWKS_TTL', '3600'))
+OIDC_JWKS_MIN_REFRESH_INTERVAL = int(os.environ.get('OIDC_JWKS_MIN_REFRESH_INTERVAL', '30'))
+OIDC_ID_TOKEN_LEEWAY = int(os.environ.get('OIDC_ID_TOKEN_LEEWAY', '30'))
+
+# Login user provisioning (config/provisioning.py): the user for a Keycloak sub
+# is cached for OIDC_USER_CACHE_TTL seconds (0 disables), and last_login is
+# written in batches every OIDC_LAST_LOGIN_FLUSH_INTERVAL seconds or
+# OIDC_LAST_LOGIN_BATCH_SIZE logins (interval 0 writes it on every login).
+OIDC_USER_CACHE_TTL = int(os.environ.get('OIDC_USER_CACHE_TTL', '3600'))
+OIDC_LAST_LOGIN_FLUSH_INTERVAL = int(os.environ.get('OIDC_LAST_LOGIN_FLUSH_INTERVAL', '30'))
+OIDC_LAST_LOGIN_BATCH_SIZE = int(os.environ.get('OIDC_LAST_LOGIN_BATCH_SIZE', '100'))
+
+# Expired access tokens are renewed with the refresh token (config/token_refresh.py)
+# once they are within OIDC_TOKEN_REFRESH_SKEW seconds of expiry.
+OIDC_TOKEN_REFRESH_SKEW = int(os.environ.get('OIDC_TOKEN_REFRESH_SKEW', '30'))
+OIDC_TOKEN_REFRESH_TIMEOUT = int(os.environ.get('OIDC_TOKEN_REFRESH_TIMEOUT', '10'))
+
+# Shared outbound HTTP client (config/http_client.py): keep-alive pool per host,
+# retries with backoff for idempotent requests that failed to connect or got a
+# 502/503/504 (not read timeouts), default timeout in seconds.
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', '10'))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '10'))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', '2'))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', '0.2'))
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', '10'))
+
+# Request metrics (config/metrics.py): per-phase latency histograms and counters
+# served on /metrics (no login), and a Server-Timing header on every response
+# (it shows clients how long Keycloak calls took; turn it off with
+# SERVER_TIMING=0 where that should stay internal).
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+
+# Request profiling (config/profiling.py): profile a PROFILE_SAMPLE_RATE fraction of
+# requests, and with PROFILE_HEADER=1 those carrying an X-Profile header signed
+# with PROFILE_SECRET (a dedicated key of 32+ characters, not SECRET_KEY;
+# without one the header is ignored). PROFILER is cprofile (.pstats) or stack
+# (sampled .collapsed stacks); results are aggregated per endpoint under PROFILE_DIR,
+# written every PROFILE_FLUSH_INTERVAL seconds, newest PROFILE_KEEP kept.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_HEADER = os.environ.get('PROFILE_HEADER', '0') == '1'
+PROFILE_HEADER_MAX_AGE = int(os.environ.get('PROFILE_HEADER_MAX_AGE', '3600'))
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+PROFILE_STACK_INTERVAL = float(os.environ.get('PROFILE_STACK_INTERVAL', '0.005'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_FLUSH_INTERVAL = int(os.environ.get('PROFILE_FLUSH_INTERVAL', '60'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '20'))
+
+# Worker warm-up (config/health.py): gunicorn workers load the discovery document
+# and JWKS and pre-render the pages before /readyz reports them ready; failed
+# steps are retried every WARMUP_RETRY_INTERVAL seconds.
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', '1') == '1'
+WARMUP_RETRY_INTERVAL = int(os.environ.get('WARMUP_RETRY_INTERVAL', '10'))
 
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -0,0 +1,190 @@
+"""
+Fingerprinted, pre-compressed static files served ahead of the app.
+
+``collectstatic`` (run at image build, or by the entrypoint when STATIC_ROOT
+is empty) stores every asset under a content-hashed name next to the
+original (ManifestStaticFilesStorage) and writes ``.gz`` and, when the
+``brotli`` package is installed, ``.br`` variants of the compressible ones.
+
+StaticFilesMiddleware answers ``STATIC_URL`` requests from that directory
+before the session and authentication middleware run. It indexes the files
+once per process, picks the smallest variant the client accepts, and
+returns a FileResponse so the WSGI server can send the file with its file
+wrapper (sendfile under gunicorn). Hashed names never change content and are
+cached as immutable for a year; original names get STATIC_MAX_AGE seconds.
+"""
+import gzip
+import json
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are built
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = frozenset({
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.md', '.ico', '.wasm',
+})
+
+# Below this size compression does not pay for the Content-Encoding header
+MIN_COMPRESS_SIZE = 256
+
+# Variant suffix per Content-Encoding, best first (breaks size ties)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def compress_file(path):
+    """
+    Write ``path.gz`` (and ``path.br``) if they are worth keeping; return the
+    variants written
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    written = []
+    for suffix, compressed in variants:
+        if len(compressed) < len(data) * 0.95:
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written.append(suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that also writes compressed variants
+    """
+
+    # Fall back to the original name when the manifest has no entry, e.g. in
+    # tests and before the first collectstatic
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS and self.exists(name):
+                compress_file(self.path(name))
+
+
+def accepted_encodings(header):
+    """
+    Content codings the client accepts according to Accept-Encoding
+    """
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.last_modified = http_date(stat.st_mtime)
+        self.cache_control = IMMUTABLE if immutable else f"public, max-age={getattr(settings, 'STATIC_MAX_AGE', 60)}"
+        etag = f'{stat.st_size:x}-{int(stat.st_mtime):x}'
+        # (encoding, path, size, etag), smallest first; sorted once so
+        # choose() returns the smallest variant the client accepts
+        self.variants = []
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(path + suffix):
+                size = os.path.getsize(path + suffix)
+                self.variants.append((encoding, path + suffix, size, f'"{etag}-{encoding}"'))
+        self.variants.append((None, path, stat.st_size, f'"{etag}"'))
+        self.variants.sort(key=lambda variant: variant[2])
+
+    def choose(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding) if accept_encoding else ()
+        for variant in self.variants:
+            if variant[0] is None or variant[0] in accepted:
+                return variant
+
+    def response(self, request):
+        encoding, path, size, etag = self.choose(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and {t.strip().removeprefix('W/') for t in if_none_match.split(',')} & {etag, '*'}:
+            response = HttpResponseNotModified()
+        elif request.method == 'HEAD':
+            response = HttpResponse(content_type=self.content_type)
+            response['Content-Length'] = size
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=self.content_type)
+            response.headers.pop('Content-Disposition', None)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if len(self.variants) > 1:
+            response['Vary'] = 'Accept-Encoding'
+        response['ETag'] = etag
+        response['Last-Modified'] = self.last_modified
+        response['Cache-Control'] = self.cache_control
+        return response
+
+
+def index_static_root(root):
+    """
+    Map every collected file under ``root`` (relative URL path) to a
+    StaticFile; compressed variants are reached through their original
+    """
+    files = {}
+    if not root or not os.path.isdir(root):
+        return files
+    manifest_name = ManifestStaticFilesStorage.manifest_name
+    try:
+        with open(os.path.join(root, manifest_name), encoding='utf-8') as f:
+            hashed = set(json.load(f).get('paths', {}).values())
+    except (OSError, ValueError):
+        hashed = set()
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(('.gz', '.br')) and os.path.isfile(os.path.join(directory, filename[:-3])):
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if name != manifest_name:
+                files[name] = StaticFile(path, immutable=name in hashed)
+    return files
+
+
+class StaticFilesMiddleware:
+    """Serve collected static files before sessions and authentication run.
+
+    Requests for STATIC_URL paths that are not in STATIC_ROOT (or when it
+    has not been collected) fall through to the rest of the stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else '/' + settings.STATIC_URL
+        self.files = index_static_root(settings.STATIC_ROOT)
+
+    def __call__(self, request):
+        path = request.path_info
+        if self.files and request.method in ('GET', 'HEAD') and path.startswith(self.prefix):
+            static_file = self.files.get(path[len(self.prefix):])
+            if static_file is not None:
+                return static_file.response(request)
+        return self.get_response(request)
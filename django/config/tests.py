@@ -0,0 +1,798 @@
+import gzip
+import json
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+import requests
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import pages
+from .env import load_env
+from .health import warmup
+from .http_client import PooledHTTPClient
+from .id_token import JWKSError, jwks
+from .metrics import metrics
+from .middleware import compile_exempt_matcher
+from .oidc_discovery import DiscoveryError, DiscoveryStore, discovery
+from .oidc_session import compact_tokens, session_lifetime
+from .oidc_views import login_view
+from .profiling import SALT, ProfilingMiddleware, profile_header_value, profiler
+from .provisioning import last_logins, users
+from .static_files import StaticFilesMiddleware, accepted_encodings
+from .token_refresh import refresher
+
+
+CLIENT_ID = 'sample-django'
+SIGNING_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+class StubKeycloak:
+    """Local stand-in for Keycloak's HTTP endpoints, recording requested paths"""
+
+    def __init__(self):
+        self.requests = []
+        self.status = 200
+        self.tokens = {
+            'access_token': 'access-' + 'a' * 1200,
+            'expires_in': 300,
+            'refresh_token': 'refresh-' + 'r' * 600,
+            'refresh_expires_in': 1800,
+            'token_type': 'Bearer',
+            'not-before-policy': 0,
+            'session_state': 'abc',
+            'scope': 'openid email profile',
+        }
+        self.userinfo = {'sub': 'f3a9', 'preferred_username': 'alice', 'email': 'alice@example.com'}
+        # User claims in the ID token, and the nonce it echoes back
+        self.id_claims = dict(self.userinfo)
+        self.nonce = None
+        # grant_type of each token request, and how long the endpoint takes
+        self.grants = []
+        self.token_delay = 0
+        self.delay = 0  # for GET requests
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                time.sleep(stub.delay)
+                if self.path.endswith('/userinfo'):
+                    self.reply(stub.userinfo)
+                elif self.path.endswith('/certs'):
+                    self.reply(stub.jwks())
+                else:
+                    self.reply(stub.document())
+
+            def do_POST(self):
+                stub.requests.append(self.path)
+                form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+                grant = form['grant_type'][0]
+                stub.grants.append(grant)
+                time.sleep(stub.token_delay)
+                if grant == 'refresh_token':
+                    self.reply(dict(stub.tokens, access_token=f'refreshed-{len(stub.grants)}'))
+                else:
+                    self.reply(dict(stub.tokens, id_token=stub.id_token()))
+
+            def reply(self, document):
+                body = json.dumps(document).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.issuer = f'http://127.0.0.1:{self.server.server_port}/realms/test'
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def document(self):
+        protocol = f'{self.issuer}/protocol/openid-connect'
+        return {
+            'issuer': self.issuer,
+            'authorization_endpoint': f'{protocol}/auth',
+            'token_endpoint': f'{protocol}/token',
+            'userinfo_endpoint': f'{protocol}/userinfo',
+            'jwks_uri': f'{protocol}/certs',
+        }
+
+    def jwks(self):
+        key = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(SIGNING_KEY.public_key()))
+        return {'keys': [dict(key, kid='test-key', use='sig', alg='RS256')]}
+
+    def id_token(self):
+        now = int(time.time())
+        claims = {
+            'iss': self.issuer, 'aud': CLIENT_ID, 'azp': CLIENT_ID,
+            'iat': now, 'exp': now + 300, 'nonce': self.nonce, **self.id_claims,
+        }
+        return jwt.encode(claims, SIGNING_KEY, algorithm='RS256', headers={'kid': 'test-key'})
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class KeycloakMixin:
+    """Points OIDC settings at a StubKeycloak and a temporary cache file"""
+
+    def setUp(self):
+        self.keycloak = StubKeycloak()
+        self.addCleanup(self.keycloak.close)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cache_file = os.path.join(self.tmpdir, 'discovery.json')
+        settings_override = override_settings(
+            OIDC_OP_DISCOVERY_ENDPOINT=self.keycloak.issuer,
+            OIDC_DISCOVERY_CACHE_FILE=self.cache_file,
+            OIDC_DISCOVERY_TTL=3600,
+            OIDC_RP_CLIENT_ID=CLIENT_ID,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        discovery.clear()
+        self.addCleanup(discovery.clear)
+        jwks.clear()
+        self.addCleanup(jwks.clear)
+        # Cached sub -> user mappings would outlive the rolled back test users
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # Write buffered last_login values inside the test transaction rather
+        # than at exit, when the test database is gone
+        self.addCleanup(last_logins.flush)
+
+    def login(self):
+        """Run the login redirect and the callback through the test client"""
+        response = self.client.get('/auth/authenticate/')
+        self.keycloak.nonce = parse_qs(urlsplit(response['Location']).query)['nonce'][0]
+        state = self.client.session['oidc_auth_state']
+        return self.client.get('/auth/callback/', {'code': 'c0de', 'state': state})
+
+
+class KeycloakTestCase(KeycloakMixin, SimpleTestCase):
+    pass
+
+
+class DiscoveryStoreTests(KeycloakTestCase):
+    def test_document_is_fetched_lazily_and_persisted(self):
+        store = DiscoveryStore()
+        self.assertEqual(self.keycloak.requests, [])
+        self.assertEqual(store.get_endpoint('token_endpoint'), self.keycloak.document()['token_endpoint'])
+        store.get()
+        self.assertEqual(self.keycloak.requests, ['/realms/test/.well-known/openid-configuration'])
+        with open(self.cache_file) as f:
+            self.assertEqual(json.load(f)['document'], self.keycloak.document())
+
+    def test_new_process_starts_from_the_cache_file(self):
+        DiscoveryStore().get()
+        self.keycloak.requests.clear()
+        with mock.patch('config.oidc_discovery.http_client.get', side_effect=AssertionError('network used')):
+            store = DiscoveryStore()
+            self.assertEqual(store.get_endpoint('issuer'), self.keycloak.issuer)
+
+    def test_fixture_file_is_used_without_network(self):
+        with open(self.cache_file, 'w') as f:
+            json.dump({
+                'endpoint': self.keycloak.issuer,
+                'fetched_at': time.time(),
+                'document': {'authorization_endpoint': 'https://idp.example/auth'},
+            }, f)
+        self.keycloak.close()
+        self.assertEqual(DiscoveryStore().get_endpoint('authorization_endpoint'), 'https://idp.example/auth')
+
+    def test_cache_for_another_issuer_is_ignored(self):
+        with open(self.cache_file, 'w') as f:
+            json.dump({'endpoint': 'https://other.example', 'fetched_at': time.time(), 'document': {}}, f)
+        self.assertEqual(DiscoveryStore().get_endpoint('issuer'), self.keycloak.issuer)
+        self.assertEqual(len(self.keycloak.requests), 1)
+
+    def test_stale_document_is_served_while_refreshing(self):
+        store = DiscoveryStore()
+        store.get()
+        store._fetched_at -= 7200
+        self.assertEqual(store.get_endpoint('issuer'), self.keycloak.issuer)
+        deadline = time.time() + 5
+        while store._refreshing and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.keycloak.requests), 2)
+        self.assertGreater(store._fetched_at, time.time() - 60)
+
+    def test_failed_refresh_keeps_the_cached_document(self):
+        store = DiscoveryStore()
+        store.get()
+        store._fetched_at -= 7200
+        self.keycloak.status = 503
+        with self.assertLogs('config.oidc_discovery', 'WARNING'):
+            store.get()
+            deadline = time.time() + 5
+            while store._refreshing and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(store.get_endpoint('issuer'), self.keycloak.issuer)
+        self.assertGreater(store._retry_at, time.time())
+
+    def test_unreachable_provider_without_cache(self):
+        self.keycloak.status = 503
+        with self.assertRaises(DiscoveryError):
+            DiscoveryStore().get()
+
+
+class PooledHTTPClientTests(SimpleTestCase):
+    def setUp(self):
+        self.keycloak = StubKeycloak()
+        self.addCleanup(self.keycloak.close)
+        self.client = PooledHTTPClient()
+        self.addCleanup(self.client.close)
+
+    def test_read_timeouts_are_not_retried(self):
+        self.keycloak.delay = 1
+        started = time.perf_counter()
+        with self.assertRaises(requests.Timeout):
+            self.client.get(f'{self.keycloak.issuer}/.well-known/openid-configuration', timeout=0.3)
+        self.assertLess(time.perf_counter() - started, 0.9)
+        self.assertEqual(len(self.keycloak.requests), 1)
+
+    @override_settings(HTTP_RETRY_BACKOFF=0)
+    def test_unavailable_upstream_is_retried(self):
+        self.keycloak.status = 503
+        with override_settings(HTTP_RETRIES=1):
+            self.client.get(f'{self.keycloak.issuer}/.well-known/openid-configuration')
+        self.assertEqual(len(self.keycloak.requests), 2)
+        self.client.close()
+        self.keycloak.requests.clear()
+        response = self.client.get(f'{self.keycloak.issuer}/.well-known/openid-configuration')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.keycloak.requests), 3)
+
+
+class LoginViewTests(KeycloakTestCase):
+    def test_login_redirects_to_discovered_authorization_endpoint(self):
+        request = RequestFactory().get('/auth/authenticate/')
+        request.session = SessionStore()
+        response = login_view(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(self.keycloak.document()['authorization_endpoint'] + '?'))
+
+    def test_login_without_provider(self):
+        self.keycloak.status = 503
+        request = RequestFactory().get('/auth/authenticate/')
+        request.session = SessionStore()
+        self.assertEqual(login_view(request).status_code, 503)
+
+
+class PagesTests(SimpleTestCase):
+    def setUp(self):
+        pages.clear()
+        self.addCleanup(pages.clear)
+
+    def test_static_pages_are_built_once_per_variant(self):
+        with mock.patch('config.pages.build_index', wraps=pages.build_index) as build:
+            anonymous = pages.render_index(False)
+            self.assertIs(pages.render_index(False), anonymous)
+            logged_in = pages.render_index(True)
+        self.assertEqual(build.call_count, 2)
+        self.assertIn(b'Login with SSO', anonymous)
+        self.assertIn(b'href="/private"', logged_in)
+        self.assertIn(b'def callback_view', anonymous)
+
+    def test_private_page_escapes_per_user_parts(self):
+        page = pages.render_private({'name': '<b>Alice</b>'}, 'token<script>')
+        self.assertIn(b'&lt;b&gt;Alice&lt;/b&gt;', page)
+        self.assertIn(b'token&lt;script&gt;', page)
+        self.assertTrue(page.endswith(b'Back to Portal</a></p></div>'))
+        self.assertIn(b'No access token present', pages.render_private({}, None))
+
+    def get(self, page, **headers):
+        return pages.respond(RequestFactory().get('/', headers=headers), page)
+
+    def test_matching_etag_gets_304(self):
+        response = self.get(pages.index_page(False))
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+        not_modified = self.get(pages.index_page(False), if_none_match=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertNotEqual(self.get(pages.index_page(True))['ETag'], etag)
+
+    def test_pages_are_compressed_for_clients_that_accept_it(self):
+        response = self.get(pages.loggedout_page(), accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), pages.render_loggedout())
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+        with override_settings(PAGE_COMPRESS_MIN_SIZE=10 ** 6):
+            self.assertNotIn('Content-Encoding', self.get(pages.loggedout_page(), accept_encoding='gzip'))
+
+    def test_private_page_revalidates_without_rendering(self):
+        etag = self.get(pages.private_page({'sub': 'a'}, 'token'))['ETag']
+        with mock.patch('config.pages.render_private_user') as render:
+            response = self.get(pages.private_page({'sub': 'a'}, 'token'), if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        render.assert_not_called()
+        self.assertNotEqual(self.get(pages.private_page({'sub': 'a'}, 'other'))['ETag'], etag)
+        self.assertNotEqual(self.get(pages.private_page({'sub': 'a'}, 'head.body.other'))['ETag'], etag)
+        self.assertNotEqual(pages.private_page({'sub': 'a'}, None).etag, pages.private_page({'sub': 'b'}, None).etag)
+
+
+class LoginRequiredMiddlewareTests(TestCase):
+    def setUp(self):
+        self.addCleanup(last_logins.flush)
+        user = get_user_model().objects.create(username='alice')
+        # A logged-in browser sends its session cookie with every request.
+        self.client.force_login(user)
+
+    def test_exempt_paths_do_not_touch_the_database(self):
+        for path in ('/static/vendor/mermaid.min.js', '/healthz', '/loggedout', '/auth/unknown/'):
+            with self.subTest(path=path), self.assertNumQueries(0):
+                self.client.get(path)
+
+    def test_protected_paths_resolve_the_user(self):
+        # Session row and user row
+        with self.assertNumQueries(2):
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_anonymous_requests_are_redirected_to_login(self):
+        self.client.logout()
+        response = self.client.get('/private')
+        self.assertRedirects(response, '/auth/authenticate/?next=/private', fetch_redirect_response=False)
+
+    def test_exempt_matcher(self):
+        is_exempt = compile_exempt_matcher([r'^/auth/', r'^/static/', r'^/healthz$', r'^/api/v\d+/public'])
+        self.assertTrue(is_exempt('/auth/callback/'))
+        self.assertTrue(is_exempt('/static/app.js'))
+        self.assertTrue(is_exempt('/healthz'))
+        self.assertTrue(is_exempt('/api/v2/public/x'))
+        self.assertFalse(is_exempt('/healthz/extra'))
+        self.assertFalse(is_exempt('/private'))
+        self.assertFalse(is_exempt('/x/auth/'))
+        self.assertFalse(compile_exempt_matcher([])('/auth/'))
+
+
+class OidcSessionTests(KeycloakMixin, TestCase):
+    def test_callback_keeps_only_what_the_pages_read(self):
+        response = self.login()
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        session = self.client.session
+        self.assertEqual(
+            sorted(k for k in session.keys() if not k.startswith('_')),
+            ['oidc_tokens', 'oidc_userinfo'],
+        )
+        tokens = session['oidc_tokens']
+        self.assertEqual(sorted(tokens), ['access_token', 'expires_at', 'refresh_expires_at', 'refresh_token'])
+        self.assertEqual(session['oidc_userinfo'], self.keycloak.userinfo)
+        self.assertIn(tokens['access_token'].encode(), self.client.get('/private').content)
+
+    def test_session_expires_with_the_refresh_token(self):
+        self.login()
+        self.assertAlmostEqual(self.client.session.get_expiry_age(), 1800, delta=5)
+        row = Session.objects.get()
+        self.assertLess(len(row.session_data), 3000)
+
+    def test_lifetime(self):
+        self.assertEqual(session_lifetime({'expires_in': 300}), 300)
+        self.assertEqual(session_lifetime({'expires_in': 300, 'refresh_expires_in': 0}), 300)
+        with override_settings(SESSION_COOKIE_AGE=600):
+            self.assertEqual(session_lifetime({'expires_in': 300, 'refresh_expires_in': 86400}), 600)
+            self.assertEqual(session_lifetime({}), 600)
+        self.assertEqual(compact_tokens({'access_token': 'a', 'expires_in': 60}, now=1000), {'access_token': 'a', 'expires_at': 1060})
+
+
+class IDTokenLoginTests(KeycloakMixin, TestCase):
+    def userinfo_requests(self):
+        return [p for p in self.keycloak.requests if p.endswith('/userinfo')]
+
+    def test_claims_come_from_the_verified_id_token(self):
+        self.assertRedirects(self.login(), '/', fetch_redirect_response=False)
+        self.assertEqual(self.userinfo_requests(), [])
+        self.assertEqual(self.client.session['oidc_userinfo'], self.keycloak.userinfo)
+        self.assertEqual(get_user_model().objects.get().username, 'alice')
+        # The keys are fetched once and reused by later logins
+        self.client.logout()
+        self.login()
+        self.assertEqual(len([p for p in self.keycloak.requests if p.endswith('/certs')]), 1)
+
+    def test_nonce_mismatch_is_rejected(self):
+        self.client.get('/auth/authenticate/')
+        self.keycloak.nonce = 'replayed'
+        state = self.client.session['oidc_auth_state']
+        response = self.client.get('/auth/callback/', {'code': 'c0de', 'state': state})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'nonce', response.content)
+
+    def test_token_for_another_client_is_rejected(self):
+        self.keycloak.id_claims['aud'] = 'other-client'
+        self.assertEqual(self.login().status_code, 400)
+        self.assertNotIn('oidc_tokens', self.client.session)
+
+    def test_missing_claims_fall_back_to_userinfo(self):
+        self.keycloak.id_claims = {'sub': 'f3a9'}
+        self.login()
+        self.assertEqual(len(self.userinfo_requests()), 1)
+        self.assertEqual(self.client.session['oidc_userinfo'], self.keycloak.userinfo)
+
+    def test_unreachable_jwks_falls_back_to_userinfo(self):
+        with mock.patch.object(jwks, '_fetch', side_effect=JWKSError('down')), \
+                self.assertLogs('config.oidc_views', 'WARNING'):
+            self.assertRedirects(self.login(), '/', fetch_redirect_response=False)
+        self.assertEqual(len(self.userinfo_requests()), 1)
+
+    @override_settings(OIDC_LOCAL_ID_TOKEN=False)
+    def test_local_validation_can_be_disabled(self):
+        self.login()
+        self.assertEqual(len(self.userinfo_requests()), 1)
+
+
+class ProvisioningTests(KeycloakMixin, TestCase):
+    def test_known_subject_does_not_query_the_database(self):
+        user = users.provision('f3a9', 'alice', 'alice@example.com')
+        with self.assertNumQueries(0):
+            cached = users.provision('f3a9', 'alice', 'alice@example.com')
+        self.assertEqual(cached.pk, user.pk)
+        self.assertEqual(cached.get_session_auth_hash(), user.get_session_auth_hash())
+
+    def test_changed_email_is_saved(self):
+        user = users.provision('f3a9', 'alice', 'alice@example.com')
+        users.provision('f3a9', 'alice', 'alice@new.example')
+        user.refresh_from_db()
+        self.assertEqual(user.email, 'alice@new.example')
+
+    def test_saving_the_user_invalidates_the_cache(self):
+        user = users.provision('f3a9', 'alice', 'alice@example.com')
+        user.set_password('changed')
+        user.save()
+        with self.assertNumQueries(1):
+            cached = users.provision('f3a9', 'alice', 'alice@example.com')
+        self.assertEqual(cached.get_session_auth_hash(), user.get_session_auth_hash())
+
+    def test_logins_reuse_the_cached_user_and_batch_last_login(self):
+        self.login()
+        self.client.logout()
+        self.login()
+        self.assertEqual(self.client.get('/').status_code, 200)
+        user = get_user_model().objects.get()
+        self.assertIsNone(user.last_login)
+        last_logins.flush()
+        user.refresh_from_db()
+        self.assertIsNotNone(user.last_login)
+
+    @override_settings(OIDC_LAST_LOGIN_FLUSH_INTERVAL=0)
+    def test_last_login_written_on_every_login_keeps_the_user_cached(self):
+        self.login()
+        user = get_user_model().objects.get()
+        self.assertIsNotNone(user.last_login)
+        self.client.logout()
+        with mock.patch.object(users, '_get_or_create') as get_or_create:
+            self.login()
+        get_or_create.assert_not_called()
+        self.assertGreater(get_user_model().objects.get().last_login, user.last_login)
+
+    def test_saving_only_last_login_keeps_the_user_cached(self):
+        user = users.provision('f3a9', 'alice', 'alice@example.com')
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            users.provision('f3a9', 'alice', 'alice@example.com')
+
+
+class TokenRefreshTests(KeycloakMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def expire_access_token(self):
+        session = self.client.session
+        session['oidc_tokens']['expires_at'] = int(time.time()) - 1
+        session.save()
+
+    def test_valid_access_token_is_used_as_is(self):
+        self.client.get('/private')
+        self.assertEqual(self.keycloak.grants, ['authorization_code'])
+
+    def test_expired_access_token_is_refreshed_silently(self):
+        self.expire_access_token()
+        response = self.client.get('/private')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'refreshed-2', response.content)
+        self.assertEqual(self.keycloak.grants, ['authorization_code', 'refresh_token'])
+        tokens = self.client.session['oidc_tokens']
+        self.assertEqual(tokens['access_token'], 'refreshed-2')
+        self.assertGreater(tokens['expires_at'], time.time())
+
+    def test_failed_refresh_requires_login(self):
+        self.expire_access_token()
+        self.keycloak.status = 400
+        response = self.client.get('/private')
+        self.assertRedirects(response, '/auth/authenticate/?next=/private', fetch_redirect_response=False)
+
+    def test_cache_failures_do_not_break_the_refresh(self):
+        self.expire_access_token()
+        broken = mock.Mock(**{'get.side_effect': ConnectionError('cache down'), 'set.side_effect': ConnectionError('cache down')})
+        with mock.patch('config.token_refresh.cache', broken), self.assertLogs('config.token_refresh', 'WARNING') as logs:
+            response = self.client.get('/private')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'refreshed-2', response.content)
+        self.assertEqual(self.keycloak.grants, ['authorization_code', 'refresh_token'])
+        self.assertEqual(len(logs.records), 2)
+
+    def test_concurrent_refreshes_share_one_request(self):
+        self.keycloak.token_delay = 0.2
+        refresh_token = self.client.session['oidc_tokens']['refresh_token']
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(refresher.refresh(refresh_token))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.keycloak.grants, ['authorization_code', 'refresh_token'])
+        self.assertEqual({r['access_token'] for r in results}, {'refreshed-2'})
+
+
+class MetricsTests(KeycloakMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+        self.addCleanup(metrics.clear)
+
+    def phases(self, response):
+        return [item.split(';')[0] for item in response['Server-Timing'].split(', ')]
+
+    def test_login_is_broken_down_by_phase(self):
+        phases = self.phases(self.login())
+        for phase in ('mw', 'token', 'jwks', 'id_token', 'provision', 'db'):
+            self.assertIn(phase, phases)
+        self.assertEqual(phases[-1], 'total')
+        self.assertEqual(self.phases(self.client.get('/loggedout')), ['mw', 'total'])
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        self.assertNotIn('Server-Timing', self.client.get('/loggedout'))
+
+    def test_prometheus_endpoint_needs_no_login(self):
+        self.login()
+        self.client.get('/auth/callback/', {'code': 'c0de', 'state': 'forged'})
+        self.client.logout()
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        for line in (
+            '# TYPE phase_duration_seconds histogram',
+            'phase_duration_seconds_count{phase="token"} 1',
+            'phase_duration_seconds_bucket{phase="id_token",le="+Inf"} 1',
+            'http_requests_total{method="GET",status="302",view="oidc_callback"} 1',
+            'http_requests_total{method="GET",status="400",view="oidc_callback"} 1',
+            'login_failures_total{reason="state"} 1',
+            'oidc_user_cache_requests_total{result="miss"} 1',
+        ):
+            self.assertIn(line + '\n', body)
+        self.assertIn('http_client_requests_total{host="127.0.0.1"} ', body)
+
+
+PROFILE_SECRET = 'profile-secret-for-tests-' + 'x' * 16
+
+
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        settings_override = override_settings(PROFILE_DIR=self.directory, PROFILE_SECRET=PROFILE_SECRET)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        profiler.clear()
+        self.addCleanup(profiler.clear)
+
+    def test_off_by_default(self):
+        response = self.client.get('/loggedout', HTTP_X_PROFILE=profile_header_value())
+        self.assertNotIn('X-Profiled', response)
+
+    @override_settings(PROFILE_HEADER=True)
+    def test_signed_header_profiles_the_request(self):
+        self.assertNotIn('X-Profiled', self.client.get('/loggedout', HTTP_X_PROFILE='forged'))
+        response = self.client.get('/loggedout', HTTP_X_PROFILE=profile_header_value())
+        self.assertEqual(response['X-Profiled'], 'cprofile')
+
+        profiler.flush()
+        [name] = os.listdir(os.path.join(self.directory, 'loggedout'))
+        stats = pstats.Stats(os.path.join(self.directory, 'loggedout', name))
+        self.assertTrue(any(func[2] == 'loggedout_view' for func in stats.stats))
+
+    @override_settings(PROFILE_HEADER=True)
+    def test_header_needs_a_dedicated_secret(self):
+        # Signed with SECRET_KEY, which is public in development
+        forged = signing.TimestampSigner(salt=SALT).sign('profile')
+        self.assertNotIn('X-Profiled', self.client.get('/loggedout', HTTP_X_PROFILE=forged))
+        for secret in ('', 'short', settings.SECRET_KEY, 'django-insecure-your-secret-key-here'):
+            with self.subTest(secret=secret), override_settings(PROFILE_SECRET=secret):
+                self.assertFalse(profiler.header_enabled)
+                with self.assertRaises(ImproperlyConfigured):
+                    profile_header_value()
+                with self.assertLogs('config.profiling', 'WARNING'), self.assertRaises(MiddlewareNotUsed):
+                    ProfilingMiddleware(lambda request: None)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_KEEP=2, PROFILE_FLUSH_INTERVAL=0)
+    def test_files_are_rotated(self):
+        for _ in range(4):
+            self.client.get('/loggedout')
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'loggedout'))), 2)
+
+
+class HealthTests(KeycloakTestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(WARMUP_RETRY_INTERVAL=0.05)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for store in (warmup, pages, metrics):
+            store.clear()
+            self.addCleanup(store.clear)
+        self.addCleanup(self.wait_for_warmup)
+
+    def wait_for_warmup(self):
+        if warmup._thread is not None:
+            warmup._thread.join(5)
+
+    def test_liveness_skips_sessions_and_login(self):
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'alive'})
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertIsNone(warmup._thread)
+
+    def test_ready_once_warmed_up(self):
+        self.keycloak.status = 503
+        with self.assertLogs('config.health', 'WARNING'):
+            self.assertFalse(warmup.run())
+            # Starts the warm-up thread, which retries until Keycloak answers
+            response = self.client.get('/readyz')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()['status'], 'warming')
+            self.assertFalse(response.json()['checks']['discovery']['ok'])
+            self.keycloak.status = 200
+            self.wait_for_warmup()
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        checks = response.json()['checks']
+        self.assertEqual(list(checks), ['urls', 'discovery', 'jwks', 'pages'])
+        self.assertTrue(all(check['ok'] for check in checks.values()))
+
+        # A login finds the discovery document, the keys and the pages ready
+        self.keycloak.requests.clear()
+        jwks.get_key('test-key')
+        discovery.get_endpoint('token_endpoint')
+        self.assertEqual(self.keycloak.requests, [])
+        with mock.patch('config.pages.build_index', side_effect=AssertionError('page rendered')):
+            pages.index_page(False)
+
+    def test_not_ready_when_a_cache_is_dropped(self):
+        self.assertTrue(warmup.run())
+        jwks.clear()
+        self.assertEqual(self.client.get('/readyz').status_code, 503)
+        self.wait_for_warmup()
+        self.assertTrue(jwks.loaded)
+        self.assertEqual(self.client.get('/readyz').status_code, 200)
+
+    @override_settings(OIDC_LOCAL_ID_TOKEN=False)
+    def test_keys_are_not_fetched_without_local_id_tokens(self):
+        self.assertTrue(warmup.run())
+        self.assertEqual(self.keycloak.requests, ['/realms/test/.well-known/openid-configuration'])
+
+    @override_settings(WARMUP_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/readyz').status_code, 200)
+        self.assertIsNone(warmup._thread)
+        self.assertEqual(self.keycloak.requests, [])
+
+
+class StartupTests(SimpleTestCase):
+    def test_env_file_is_loaded_once_without_overriding(self):
+        path = os.path.join(tempfile.mkdtemp(), '.env')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('# comment\nSTARTUP_TEST_A="from file"\nexport STARTUP_TEST_B=b\nnot a pair\n')
+        with mock.patch.dict(os.environ, {'STARTUP_TEST_B': 'from environment'}):
+            self.assertEqual(load_env(path), {'STARTUP_TEST_A': 'from file'})
+            self.assertEqual(os.environ['STARTUP_TEST_A'], 'from file')
+            self.assertEqual(os.environ['STARTUP_TEST_B'], 'from environment')
+            os.remove(path)
+            self.assertEqual(load_env(path), {'STARTUP_TEST_A': 'from file'})  # cached
+
+    def test_heavy_modules_are_imported_on_first_use(self):
+        # What a worker imports before its first request (benchmarks/startup.py)
+        code = (
+            'import sys, config.wsgi\n'
+            'from django.urls import get_resolver\n'
+            'get_resolver().url_patterns\n'
+            'print(" ".join(sys.modules))\n'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='config.settings'),
+        )
+        modules = set(result.stdout.split())
+        for name in ('requests', 'urllib3', 'jwt', 'markdown', 'dotenv'):
+            self.assertNotIn(name, modules)
+
+
+class StaticFilesTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings_override = override_settings(STATIC_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(root, 'staticfiles.json')) as f:
+            self.hashed = json.load(f)['paths']['vendor/mermaid.min.js']
+        self.middleware = StaticFilesMiddleware(lambda request: HttpResponse('app'))
+
+    def get(self, path, **headers):
+        return self.middleware(RequestFactory().get(path, headers=headers))
+
+    def test_hashed_name_is_immutable_and_compressed(self):
+        response = self.get(f'/static/{self.hashed}', accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Disposition', response)
+        body = b''.join(response.streaming_content)
+        with open(os.path.join('static', 'vendor', 'mermaid.min.js'), 'rb') as f:
+            self.assertEqual(gzip.decompress(body), f.read())
+
+    def test_original_name_gets_a_short_max_age(self):
+        response = self.get('/static/vendor/mermaid.min.js')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        response.close()
+
+    def test_conditional_request(self):
+        etag = self.get(f'/static/{self.hashed}', accept_encoding='gzip')['ETag']
+        self.assertEqual(self.get(f'/static/{self.hashed}', accept_encoding='gzip', if_none_match=etag).status_code, 304)
+        response = self.get(f'/static/{self.hashed}', if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_smallest_accepted_variant_is_served(self):
+        path = os.path.join(settings.STATIC_ROOT, self.hashed)
+        with open(path + '.br', 'wb') as f:
+            f.write(b'x' * (os.path.getsize(path + '.gz') + 1))
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse('app'))
+        response = middleware(RequestFactory().get(f'/static/{self.hashed}', headers={'accept_encoding': 'br, gzip'}))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response.close()
+
+    def test_other_paths_reach_the_app(self):
+        self.assertEqual(self.get('/static/missing.js').content, b'app')
+        self.assertEqual(self.get('/private').content, b'app')
+
+    def test_accept_encoding(self):
+        self.assertEqual(accepted_encodings('gzip;q=1.0, br;q=0, identity'), {'gzip', 'identity'})
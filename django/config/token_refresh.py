@@ -0,0 +1,154 @@
+"""
+Silent renewal of expired access tokens with the session's refresh token.
+
+Without it an expired access token could only be replaced by a full login:
+redirect to Keycloak, back to the callback, code exchange and a new session.
+``current_tokens`` renews the tokens against the token endpoint instead, when
+the access token is (about to be) expired and the refresh token is still
+valid.
+
+Requests of the same session that find the token expired at the same time
+share one refresh: within a process they wait for the first one, and the
+result is kept in the Django cache for a minute, keyed by the refresh token
+it replaced, so other workers using a shared cache reuse it too. This
+matters with refresh token rotation, where a second use of the old refresh
+token would be rejected by Keycloak. Cache failures are treated as misses:
+the refresh then goes to the token endpoint.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .http_client import http_client
+from .metrics import metrics, timed
+from .oidc_discovery import DiscoveryError, discovery
+from .oidc_session import get_tokens, store_tokens
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRefreshError(Exception):
+    """Raised when the token endpoint does not renew the tokens."""
+
+
+class _Refresh:
+    def __init__(self):
+        self.done = threading.Event()
+        self.tokens = None
+        self.error = None
+
+
+class TokenRefresher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    @property
+    def skew(self):
+        return getattr(settings, 'OIDC_TOKEN_REFRESH_SKEW', 30)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'OIDC_TOKEN_REFRESH_TIMEOUT', 10)
+
+    def refresh(self, refresh_token):
+        """
+        Return the token endpoint response for ``refresh_token``, making at
+        most one request for concurrent callers with the same token
+        """
+        with self._lock:
+            pending = self._inflight.get(refresh_token)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[refresh_token] = _Refresh()
+
+        if not leader:
+            if not pending.done.wait(self.timeout):
+                raise TokenRefreshError('timed out waiting for a concurrent refresh')
+            if pending.tokens is None:
+                raise TokenRefreshError(f'concurrent refresh failed: {pending.error}')
+            return pending.tokens
+
+        try:
+            key = 'oidc-refresh:' + hashlib.sha256(refresh_token.encode()).hexdigest()
+            tokens = self._cache_get(key)
+            if tokens is None:
+                tokens = self._request(refresh_token)
+                self._cache_set(key, tokens)
+            pending.tokens = tokens
+            return tokens
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[refresh_token]
+            pending.done.set()
+
+    def _cache_get(self, key):
+        try:
+            return cache.get(key)
+        except Exception:
+            logger.warning('Cache read failed for %s', key, exc_info=True)
+            return None
+
+    def _cache_set(self, key, tokens):
+        try:
+            cache.set(key, tokens, 60)
+        except Exception:
+            logger.warning('Cache write failed for %s', key, exc_info=True)
+
+    def _request(self, refresh_token):
+        import requests  # loaded by the HTTP client on first use
+
+        data = {
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+            'client_id': settings.OIDC_RP_CLIENT_ID,
+        }
+        if settings.OIDC_RP_CLIENT_SECRET:
+            data['client_secret'] = settings.OIDC_RP_CLIENT_SECRET
+        try:
+            with timed('refresh'):
+                r = http_client.post(discovery.get_endpoint('token_endpoint'), data=data, timeout=self.timeout)
+            if r.status_code >= 500:
+                raise requests.HTTPError(f'HTTP {r.status_code}')
+            if not r.ok:
+                raise TokenRefreshError(f'HTTP {r.status_code} {r.text[:200]}')
+            tokens = r.json()
+        except (DiscoveryError, requests.RequestException, ValueError) as e:
+            metrics.inc('upstream_errors_total', upstream='refresh')
+            raise TokenRefreshError(str(e)) from e
+        if not tokens.get('access_token'):
+            raise TokenRefreshError('no access token in the response')
+        return tokens
+
+
+refresher = TokenRefresher()
+
+
+def current_tokens(session):
+    """
+    The session's tokens with an unexpired access token, refreshed if
+    needed; empty when there are none or they cannot be renewed
+    """
+    tokens = get_tokens(session)
+    now = time.time()
+    # Sessions from before expiry tracking have no expires_at
+    if not tokens or tokens.get('expires_at', now + refresher.skew + 1) > now + refresher.skew:
+        return tokens
+
+    refresh_token = tokens.get('refresh_token')
+    if not refresh_token or tokens.get('refresh_expires_at', now + 1) <= now:
+        return {}
+    try:
+        store_tokens(session, refresher.refresh(refresh_token))
+    except TokenRefreshError as e:
+        logger.info('Token refresh failed, login required: %s', e)
+        return {}
+    return get_tokens(session)
@@ -1,14 +1,36 @@
 #!/bin/sh
 set -e
 
+# DJANGO_SERVER=clearsessions runs the expired-session purge instead of the
+# app (the clearsessions service in docker-compose.yml, or a scheduled job):
+# every DJANGO_CLEARSESSIONS_INTERVAL seconds (default 3600), or once with 0.
+# It leaves migrations and static files to the web service, exits on the first
+# failure so it is restarted and the failure is visible, and exits right away
+# with DJANGO_SESSION_STORE=cache, where sessions expire in the cache.
+if [ "${DJANGO_SERVER:-}" = "clearsessions" ]; then
+  if [ "${DJANGO_SESSION_STORE:-db}" = "cache" ]; then
+    echo "DJANGO_SESSION_STORE=cache: no expired sessions to purge"
+    exit 0
+  fi
+  interval="${DJANGO_CLEARSESSIONS_INTERVAL:-3600}"
+  while :; do
+    python manage.py clearsessions
+    [ "$interval" = "0" ] && exit 0
+    sleep "$interval"
+  done
+fi
+
 # Run migrations if DJANGO_MIGRATE=1
 if [ "${DJANGO_MIGRATE:-1}" != "0" ]; then
   echo "Running migrations..."
   python manage.py migrate --noinput || true
 fi
 
-# Collect static if DJANGO_COLLECTSTATIC=1
-if [ "${DJANGO_COLLECTSTATIC:-0}" = "1" ]; then
+# Collect static files (hashed names plus .gz/.br variants): DJANGO_COLLECTSTATIC=1
+# always, 0 never, auto (default) only when the image build's copy is missing,
+# e.g. because the project directory is mounted over /app
+DJANGO_COLLECTSTATIC="${DJANGO_COLLECTSTATIC:-auto}"
+if [ "$DJANGO_COLLECTSTATIC" = "1" ] || { [ "$DJANGO_COLLECTSTATIC" = "auto" ] && [ ! -f staticfiles/staticfiles.json ]; }; then
   echo "Collecting static files..."
   python manage.py collectstatic --noinput
 fi
@@ -0,0 +1,11 @@
+"""
+gunicorn settings, picked up from the working directory by the image's CMD.
+
+Every worker warms its caches once it has forked (see config/health.py).
+"""
+
+
+def post_worker_init(worker):
+    # In the worker, after the fork: caches and connections are per process
+    from config.health import warmup
+    warmup.start()
@@ -0,0 +1,304 @@
+"""
+Local stand-in for Keycloak and the weather API, for load tests.
+
+One asyncio HTTP/1.1 server (keep-alive, never the bottleneck) serving a
+realm at ``/realms/<realm>``:
+
+- ``/.well-known/openid-configuration``  discovery document
+- ``/protocol/openid-connect/certs``     JWKS of the current and previous RSA keys
+- ``/protocol/openid-connect/auth``      signs the next of --users users in
+  without a form and redirects back with a code
+- ``/protocol/openid-connect/token``     authorization_code (PKCE checked),
+  refresh_token (rotated, old one revoked), password and client_credentials
+- ``/protocol/openid-connect/userinfo``  claims of the bearer token
+
+and outside the realm:
+
+- ``GET /mint?username=&ttl=``            an access token for API load tests
+- ``GET /weather/<city>``                 goweather.xyz-shaped answer after --weather-delay
+- ``POST /admin/rotate-keys[?drop=1]``    new signing key; ``drop`` also removes the old ones
+- ``POST /admin/latency?weather=&idp=``   change the injected latencies (seconds)
+- ``GET /admin/stats``                    requests served per endpoint
+
+    python loadtest/fake_upstream.py [--port 8180] [--realm bench] [--weather-delay 0.05]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import secrets
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+def new_signing_key():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    kid = uuid.uuid4().hex[:16]
+    jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+    return kid, private_key, jwk
+
+
+class FakeKeycloak:
+    def __init__(self, base_url, realm, users, token_ttl, refresh_ttl):
+        self.issuer = f'{base_url}/realms/{realm}'
+        self.path = f'/realms/{realm}'
+        self.users = users
+        self.token_ttl = token_ttl
+        self.refresh_ttl = refresh_ttl
+        self.keys = [new_signing_key()]
+        self.codes = {}
+        self.refresh_tokens = {}
+        self.next_user = itertools.count()
+
+    def discovery(self):
+        protocol = f'{self.issuer}/protocol/openid-connect'
+        return {
+            'issuer': self.issuer,
+            'authorization_endpoint': f'{protocol}/auth',
+            'token_endpoint': f'{protocol}/token',
+            'userinfo_endpoint': f'{protocol}/userinfo',
+            'jwks_uri': f'{protocol}/certs',
+            'end_session_endpoint': f'{protocol}/logout',
+            'id_token_signing_alg_values_supported': ['RS256'],
+            'grant_types_supported': ['authorization_code', 'refresh_token', 'password', 'client_credentials'],
+        }
+
+    def jwks(self):
+        return {'keys': [jwk for _, _, jwk in self.keys]}
+
+    def rotate_keys(self, drop=False):
+        self.keys.insert(0, new_signing_key())
+        if drop:
+            del self.keys[1:]
+
+    def user_claims(self, username):
+        return {
+            'sub': str(uuid.uuid5(uuid.NAMESPACE_URL, f'{self.issuer}/{username}')),
+            'preferred_username': username,
+            'email': f'{username}@example.com',
+            'email_verified': True,
+            'name': username.replace('-', ' ').title(),
+        }
+
+    def sign(self, claims):
+        kid, private_key, _ = self.keys[0]
+        return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': kid})
+
+    def access_token(self, username, client_id='bench', ttl=None):
+        now = int(time.time())
+        return self.sign({
+            'iss': self.issuer, 'aud': 'account', 'azp': client_id, 'typ': 'Bearer',
+            'iat': now, 'exp': now + (ttl or self.token_ttl), 'jti': uuid.uuid4().hex,
+            'scope': 'openid email profile', **self.user_claims(username),
+        })
+
+    def token_response(self, username, client_id, nonce=None):
+        now = int(time.time())
+        refresh_token = secrets.token_urlsafe(32)
+        self.refresh_tokens[refresh_token] = (username, client_id, now + self.refresh_ttl)
+        id_claims = {'iss': self.issuer, 'aud': client_id, 'azp': client_id, 'iat': now, 'exp': now + self.token_ttl}
+        if nonce:
+            id_claims['nonce'] = nonce
+        return {
+            'access_token': self.access_token(username, client_id),
+            'expires_in': self.token_ttl,
+            'refresh_token': refresh_token,
+            'refresh_expires_in': self.refresh_ttl,
+            'id_token': self.sign({**id_claims, **self.user_claims(username)}),
+            'token_type': 'Bearer',
+            'scope': 'openid email profile',
+        }
+
+    def authorize(self, query):
+        """Sign the next user in and return the redirect back to the client"""
+        username = f'user-{next(self.next_user) % self.users}'
+        code = secrets.token_urlsafe(24)
+        self.codes[code] = {
+            'username': username,
+            'client_id': query.get('client_id'),
+            'redirect_uri': query.get('redirect_uri'),
+            'nonce': query.get('nonce'),
+            'challenge': query.get('code_challenge'),
+        }
+        redirect_uri = query['redirect_uri']
+        separator = '&' if '?' in redirect_uri else '?'
+        return redirect_uri + separator + urlencode({'code': code, 'state': query.get('state', '')})
+
+    def token(self, form):
+        """Return (status, body) for a token endpoint request"""
+        grant = form.get('grant_type')
+        client_id = form.get('client_id', 'bench')
+        if grant == 'authorization_code':
+            grant_data = self.codes.pop(form.get('code'), None)
+            if grant_data is None or grant_data['redirect_uri'] != form.get('redirect_uri'):
+                return 400, {'error': 'invalid_grant'}
+            if grant_data['challenge']:
+                verifier = form.get('code_verifier', '').encode('ascii')
+                challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier).digest()).rstrip(b'=').decode()
+                if challenge != grant_data['challenge']:
+                    return 400, {'error': 'invalid_grant', 'error_description': 'PKCE verification failed'}
+            return 200, self.token_response(grant_data['username'], client_id, grant_data['nonce'])
+        if grant == 'refresh_token':
+            entry = self.refresh_tokens.pop(form.get('refresh_token'), None)
+            if entry is None or entry[2] < time.time():
+                return 400, {'error': 'invalid_grant', 'error_description': 'Token is not active'}
+            return 200, self.token_response(entry[0], entry[1])
+        if grant == 'password':
+            return 200, self.token_response(form.get('username', 'user-0'), client_id)
+        if grant == 'client_credentials':
+            return 200, {'access_token': self.access_token(f'service-account-{client_id}', client_id),
+                         'expires_in': self.token_ttl, 'token_type': 'Bearer'}
+        return 400, {'error': 'unsupported_grant_type'}
+
+    def userinfo(self, authorization):
+        try:
+            token = authorization.split(' ', 1)[1]
+            claims = jwt.decode(token, options={'verify_signature': False})
+        except (IndexError, jwt.PyJWTError):
+            return 401, {'error': 'invalid_token'}
+        return 200, self.user_claims(claims['preferred_username'])
+
+
+def weather(city):
+    return {
+        'temperature': '+31 °C',
+        'wind': '12 km/h',
+        'description': f'Partly cloudy in {city}',
+        'forecast': [
+            {'day': '1', 'temperature': '+30 °C', 'wind': '10 km/h'},
+            {'day': '2', 'temperature': '+32 °C', 'wind': '8 km/h'},
+            {'day': '3', 'temperature': '+29 °C', 'wind': '14 km/h'},
+        ],
+    }
+
+
+class FakeUpstream:
+    def __init__(self, port, realm, users, weather_delay, idp_delay, token_ttl, refresh_ttl):
+        self.port = port
+        self.keycloak = FakeKeycloak(f'http://127.0.0.1:{port}', realm, users, token_ttl, refresh_ttl)
+        self.weather_delay = weather_delay
+        self.idp_delay = idp_delay
+        self.stats = Counter()
+
+    async def route(self, method, target, headers, body):
+        """Return (status, headers, body) for one request"""
+        url = urlsplit(target)
+        path = url.path
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        kc = self.keycloak
+
+        if path.startswith('/weather/'):
+            self.stats['weather'] += 1
+            await asyncio.sleep(self.weather_delay)
+            return 200, {}, weather(path[len('/weather/'):])
+        if path == '/mint':
+            self.stats['mint'] += 1
+            ttl = int(query['ttl']) if 'ttl' in query else None
+            return 200, {}, {'access_token': kc.access_token(query.get('username', 'user-0'), ttl=ttl)}
+        if path.startswith('/admin/'):
+            return self.admin(method, path, query)
+
+        if not path.startswith(kc.path):
+            return 404, {}, {'error': 'not found'}
+        endpoint = path[len(kc.path):]
+        self.stats[endpoint] += 1
+        await asyncio.sleep(self.idp_delay)
+        if endpoint == '/.well-known/openid-configuration':
+            return 200, {}, kc.discovery()
+        if endpoint == '/protocol/openid-connect/certs':
+            return 200, {'Cache-Control': 'max-age=300'}, kc.jwks()
+        if endpoint == '/protocol/openid-connect/auth':
+            if 'redirect_uri' not in query:
+                return 400, {}, {'error': 'invalid_request'}
+            return 302, {'Location': kc.authorize(query)}, None
+        if endpoint == '/protocol/openid-connect/token' and method == 'POST':
+            form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            status, document = kc.token(form)
+            return status, {}, document
+        if endpoint == '/protocol/openid-connect/userinfo':
+            status, document = kc.userinfo(headers.get('authorization', ''))
+            return status, {}, document
+        return 404, {}, {'error': 'not found'}
+
+    def admin(self, method, path, query):
+        if path == '/admin/stats':
+            return 200, {}, dict(self.stats)
+        if method != 'POST':
+            return 405, {}, {'error': 'method not allowed'}
+        if path == '/admin/rotate-keys':
+            self.keycloak.rotate_keys(drop=query.get('drop') == '1')
+            return 200, {}, {'kids': [kid for kid, _, _ in self.keycloak.keys]}
+        if path == '/admin/latency':
+            self.weather_delay = float(query.get('weather', self.weather_delay))
+            self.idp_delay = float(query.get('idp', self.idp_delay))
+            return 200, {}, {'weather': self.weather_delay, 'idp': self.idp_delay}
+        return 404, {}, {'error': 'not found'}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, extra_headers, document = await self.route(method, target, headers, body)
+                payload = b'' if document is None else json.dumps(document).encode()
+                head = [f'HTTP/1.1 {status} {"OK" if status < 300 else "Redirect" if status < 400 else "Error"}']
+                head.append(f'Content-Length: {len(payload)}')
+                if document is not None:
+                    head.append('Content-Type: application/json')
+                head.extend(f'{k}: {v}' for k, v in extra_headers.items())
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, '127.0.0.1', self.port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8180)
+    parser.add_argument('--realm', default='bench')
+    parser.add_argument('--users', type=int, default=1000, help='distinct users handed out by the auth endpoint')
+    parser.add_argument('--weather-delay', type=float, default=0.05, help='seconds before each weather answer')
+    parser.add_argument('--idp-delay', type=float, default=0.0, help='seconds before each realm endpoint answer')
+    parser.add_argument('--token-ttl', type=int, default=300, help='access and ID token lifetime')
+    parser.add_argument('--refresh-ttl', type=int, default=1800, help='refresh token lifetime')
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(
+        args.port, args.realm, args.users, args.weather_delay, args.idp_delay, args.token_ttl, args.refresh_ttl,
+    )
+    try:
+        asyncio.run(upstream.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
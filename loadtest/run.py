@@ -0,0 +1,309 @@
+"""
+Load scenarios for django-api and the django web app against local fakes.
+
+Starts loadtest/fake_upstream.py (Keycloak realm + weather API), the API
+under gunicorn (gunicorn.conf.py, DJANGO_SERVER=gunicorn or asgi) and the
+web app under gunicorn with a throwaway SQLite database, then runs each
+scenario for --seconds with --concurrency clients:
+
+- api-profile   GET /api/profile/, one minted token per client
+- api-weather   GET /api/weather/bangkok/ (upstream delay --weather-delay)
+- web-login     the whole login: /auth/authenticate/ -> realm auth ->
+                /auth/callback/ (code exchange) -> /, one sample per login
+- web-private   GET /private with a logged-in session per client
+
+and reports throughput and p50/p95/p99 latency. ``--save`` writes the
+results as JSON, ``--compare`` prints the change against a saved run:
+
+    python loadtest/run.py --save loadtest/results/before.json
+    python loadtest/run.py --compare loadtest/results/before.json
+
+Needs gunicorn, httpx and PyJWT[crypto] (and uvicorn for --api-server asgi).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT_DIR, 'django-api')
+WEB_DIR = os.path.join(ROOT_DIR, 'django')
+REALM = 'bench'
+CLIENT_ID = 'bench-web'
+
+SCENARIOS = ('api-profile', 'api-weather', 'web-login', 'web-private')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{url}: server exited with {process.returncode}')
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f'{url} did not come up')
+
+
+class Stack:
+    """The fake upstream and both projects, each on a free local port"""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.tempdir = tempfile.TemporaryDirectory(prefix='loadtest-')
+        self.upstream = f'http://127.0.0.1:{free_port()}'
+        self.issuer = f'{self.upstream}/realms/{REALM}'
+        self.api = f'http://127.0.0.1:{free_port()}'
+        self.web = f'http://127.0.0.1:{free_port()}'
+
+    def spawn(self, command, cwd, env=None):
+        process = subprocess.Popen(command, cwd=cwd, env=env)
+        self.processes.append(process)
+        return process
+
+    def start(self, scenarios):
+        args = self.args
+        upstream = self.spawn([
+            sys.executable, os.path.join(ROOT_DIR, 'loadtest', 'fake_upstream.py'),
+            '--port', self.upstream.rsplit(':', 1)[1], '--realm', REALM, '--users', str(args.users),
+            '--weather-delay', str(args.weather_delay), '--idp-delay', str(args.idp_delay),
+        ], ROOT_DIR)
+        wait_for(f'{self.issuer}/.well-known/openid-configuration', upstream)
+
+        if any(s.startswith('api-') for s in scenarios):
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE='config.settings',
+                DJANGO_SERVER=args.api_server,
+                DJANGO_API_STATELESS='1' if args.api_profile == 'stateless' else '0',
+                DJANGO_BIND=self.api.removeprefix('http://'),
+                DEBUG='0',
+                KEYCLOAK_URL=self.issuer,
+                KEYCLOAK_CERT_URL=f'{self.issuer}/protocol/openid-connect/certs',
+                WEATHER_API_URL=f'{self.upstream}/weather/{{city}}',
+                GUNICORN_WORKERS=str(args.workers),
+                GUNICORN_LOGLEVEL='warning',
+            )
+            api = self.spawn([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], API_DIR, env)
+            # Measure warmed-up workers: /readyz answers 200 once the key set is loaded
+            wait_for(f'{self.api}/readyz', api)
+
+        if any(s.startswith('web-') for s in scenarios):
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE='config.settings',
+                DJANGO_DEBUG='0',
+                DJANGO_SQLITE_PATH=os.path.join(self.tempdir.name, 'web.sqlite3'),
+                OAUTH_ISSUER=self.issuer,
+                OAUTH_CLIENT_ID=CLIENT_ID,
+                OAUTH_CLIENT_SECRET='bench-secret',
+                OAUTH_REDIRECT_URI=f'{self.web}/auth/callback/',
+                OIDC_DISCOVERY_CACHE_FILE=os.path.join(self.tempdir.name, 'oidc-discovery.json'),
+            )
+            env.pop('POSTGRES_HOST', None)
+            subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'], cwd=WEB_DIR, env=env, check=True)
+            web = self.spawn([
+                sys.executable, '-m', 'gunicorn', 'config.wsgi:application', '--bind', self.web.removeprefix('http://'),
+                '--workers', str(args.workers), '--threads', '8', '--log-level', 'warning',
+            ], WEB_DIR, env)
+            wait_for(f'{self.web}/readyz', web)
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.tempdir.cleanup()
+
+
+async def login(client):
+    """Run one login flow on ``client``; True when it ends logged in"""
+    client.cookies.clear()
+    response = await client.get('/auth/authenticate/', follow_redirects=True)
+    return response.status_code == 200 and response.url.path == '/' and 'sessionid' in client.cookies
+
+
+async def measure(stack, scenario, concurrency, seconds, warmup):
+    """
+    Run ``scenario`` with ``concurrency`` clients; returns (latencies, errors,
+    elapsed)
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    base_url = stack.api if scenario.startswith('api-') else stack.web
+    clients = [httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=4), timeout=60)
+               for _ in range(concurrency)]
+    async with httpx.AsyncClient(base_url=stack.upstream, limits=limits, timeout=60) as upstream:
+        if scenario.startswith('api-'):
+            async def mint(n):
+                response = await upstream.get('/mint', params={'username': f'user-{n}', 'ttl': 3600})
+                return response.json()['access_token']
+            tokens = await asyncio.gather(*(mint(n) for n in range(concurrency)))
+            for client, token in zip(clients, tokens):
+                client.headers['Authorization'] = f'Bearer {token}'
+        elif scenario == 'web-private':
+            if not all(await asyncio.gather(*(login(client) for client in clients))):
+                raise RuntimeError('web-private: login failed')
+
+    if scenario == 'web-login':
+        async def request(client):
+            return await login(client)
+    else:
+        path = {
+            'api-profile': '/api/profile/',
+            'api-weather': '/api/weather/bangkok/',
+            'web-private': '/private',
+        }[scenario]
+
+        async def request(client):
+            response = await client.get(path)
+            return response.status_code == 200
+
+    latencies = []
+    errors = 0
+
+    async def user(client, deadline, record):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = await request(client)
+            except httpx.HTTPError:
+                ok = False
+            if not record:
+                continue
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    try:
+        # Warm-up: worker imports, JWKS/discovery fetches, caches
+        deadline = time.perf_counter() + warmup
+        await asyncio.gather(*(user(client, deadline, False) for client in clients))
+        started = time.perf_counter()
+        deadline = started + seconds
+        await asyncio.gather(*(user(client, deadline, True) for client in clients))
+        elapsed = time.perf_counter() - started
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+    return latencies, errors, elapsed
+
+
+def summarize(latencies, errors, elapsed):
+    result = {'requests': len(latencies), 'errors': errors, 'rps': len(latencies) / elapsed}
+    if len(latencies) >= 2:
+        quantiles = statistics.quantiles(latencies, n=100)
+        result.update(p50=quantiles[49] * 1000, p95=quantiles[94] * 1000, p99=quantiles[98] * 1000)
+    return result
+
+
+def fmt(value, previous, unit):
+    text = f'{value:>8.1f}{unit}' if value is not None else f'{"-":>8}{unit}'
+    if value is None or not previous:
+        return text
+    return text + f' ({(value - previous) / previous * 100:+5.1f}%)'
+
+
+def report(results, baseline):
+    print(f'{"scenario":<12} {"req/s":>9} {"p50":>11} {"p95":>11} {"p99":>11} {"errors":>7}')
+    for scenario, result in results.items():
+        before = baseline.get(scenario, {})
+        print(
+            f'{scenario:<12}'
+            f' {fmt(result["rps"], before.get("rps"), "")}'
+            f' {fmt(result.get("p50"), before.get("p50"), "ms")}'
+            f' {fmt(result.get("p95"), before.get("p95"), "ms")}'
+            f' {fmt(result.get("p99"), before.get("p99"), "ms")}'
+            f' {result["errors"]:>7}'
+        )
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help=f'scenarios to run (default: all of {", ".join(SCENARIOS)})')
+    parser.add_argument('--concurrency', type=int, default=50, help='simultaneous clients')
+    parser.add_argument('--seconds', type=float, default=10.0, help='measured duration of each scenario')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each scenario')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers of each project')
+    parser.add_argument('--api-server', choices=('gunicorn', 'asgi'), default='gunicorn', help='DJANGO_SERVER of the API')
+    parser.add_argument('--api-profile', choices=('stateless', 'stateful'), default='stateless',
+                        help='API settings profile (DJANGO_API_STATELESS), as in the container by default')
+    parser.add_argument('--users', type=int, default=1000, help='distinct users the fake realm logs in')
+    parser.add_argument('--weather-delay', type=float, default=0.05, help='weather upstream latency in seconds')
+    parser.add_argument('--idp-delay', type=float, default=0.0, help='fake Keycloak latency in seconds')
+    parser.add_argument('--save', metavar='FILE', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='show the change against results saved with --save')
+    args = parser.parse_args()
+    scenarios = args.scenarios or list(SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenario: {", ".join(sorted(unknown))}')
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    stack = Stack(args)
+    results = {}
+    try:
+        stack.start(scenarios)
+        print(
+            f'{args.concurrency} clients, {args.seconds:.0f}s per scenario, {args.workers} workers,'
+            f' api {args.api_server} ({args.api_profile}), weather delay {args.weather_delay * 1000:.0f} ms'
+        )
+        for scenario in scenarios:
+            results[scenario] = summarize(*asyncio.run(
+                measure(stack, scenario, args.concurrency, args.seconds, args.warmup)
+            ))
+    finally:
+        stack.stop()
+
+    report(results, baseline)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'options': {k: v for k, v in vars(args).items() if k not in ('save', 'compare')},
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()